@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+"""Compare building and serializing emails with the email package against the bytes builder
+used by Notify.
+"""
+
+import argparse
+import timeit
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from notifier import Renderer
+from notifier.mime import build_message, encode_part
+
+FROM = 'no-reply@sanger.ac.uk'
+CASES = [
+    ('catalogue_new', 'Aker | New Catalogue Available', ['akerdev@sanger.ac.uk'], {}),
+    ('manifest_received', 'Aker | Material Received 1234',
+     ['user@sanger.ac.uk', 'custodian@sanger.ac.uk', 'deputy1@sanger.ac.uk'],
+     {'manifest_id': 1234, 'link': 'http://aker.localhost:80/reception/1234',
+      'barcode': 'AKER-1234', 'created_at': '2018-03-20T10:01:02.000Z', 'all_received': True}),
+    ('catalogue_rejected', 'Aker | Catalogue Rejected', ['akerdev@sanger.ac.uk'],
+     {'error': 'Le catalogue reçu est invalide', 'timestamp': '2018-03-23 14:37:45'}),
+]
+
+
+def build_with_email_package(subject, to, text, html):
+    """The previous way of building an email, serialized as send_message does."""
+    msg = MIMEMultipart('alternative')
+    msg.attach(MIMEText(text, 'plain'))
+    msg.attach(MIMEText(html, 'html'))
+    msg['Subject'] = subject
+    msg['From'] = FROM
+    msg['To'] = ', '.join(to)
+    # Added by the bytes builder, for a fair comparison
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid(domain='sanger.ac.uk')
+    return msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+
+
+def build_with_bytes_builder(subject, to, text, html):
+    return build_message(subject, FROM, to, (encode_part(text, 'plain'), encode_part(html, 'html')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', help='emails built per run', type=int, default=5000)
+    parser.add_argument('--repeat', help='runs, the fastest is reported', type=int, default=5)
+    args = parser.parse_args()
+
+    renderer = Renderer()
+    for template, subject, to, data in CASES:
+        # Rendering the templates is the same for both, and is left out
+        text = renderer.render(template + '.txt', data)
+        html = renderer.render(template + '.html', data)
+        parts = (encode_part(text, 'plain'), encode_part(html, 'html'))
+        cases = [
+            ('email package', lambda: build_with_email_package(subject, to, text, html)),
+            ('bytes builder', lambda: build_with_bytes_builder(subject, to, text, html)),
+            ('bytes builder, cached parts', lambda: build_message(subject, FROM, to, parts)),
+        ]
+        for name, func in cases:
+            best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+            print('{:<20} {:<28} {:>8.2f} us/email {:>6} bytes'.format(
+                template, name, best / args.number * 1e6, len(func())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+"""Replay a mix of synthetic events through parsing, the rules, building and sending the emails
+(to an in-process SMTP sink) and report the throughput and the latency of each stage.
+
+Compare against a stored baseline with --baseline, the exit code is 1 if the throughput dropped
+or the p99 latency of a stage grew by more than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from notifier import consts
+from notifier import Config, EmailCollector, Message, Notify, RenderCache, Renderer, Rule
+from notifier import synthetic
+from notifier.loadgen import percentile
+from notifier.sink import SMTPSink
+from notifier.smtp_pool import SMTPPool
+
+STAGES = ('parse', 'rules', 'build', 'send', 'total')
+
+
+def process(body, notify, config):
+    """Handle a single event, returning the time spent in each stage."""
+    start = time.perf_counter()
+    message = Message.from_json(body)
+    parsed = time.perf_counter()
+
+    collector = EmailCollector()
+    Rule(env=consts.ENV_TEST, config=config, message=message, notify=collector).check_rules()
+    checked = time.perf_counter()
+
+    emails = [notify.build_email(*email) for email in collector.emails]
+    built = time.perf_counter()
+
+    for email in emails:
+        notify.send(email)
+    sent = time.perf_counter()
+
+    return {'parse': parsed - start,
+            'rules': checked - parsed,
+            'build': built - checked,
+            'send': sent - built,
+            'total': sent - start}, len(emails)
+
+
+def run(config, events):
+    """Process the events, returning the report."""
+    notify = Notify(consts.ENV_TEST, config)
+    timings = {stage: [] for stage in STAGES}
+    emails = 0
+    start = time.perf_counter()
+    for _, body in events:
+        timing, count = process(body, notify, config)
+        emails += count
+        for stage in STAGES:
+            timings[stage].append(timing[stage])
+    elapsed = time.perf_counter() - start
+
+    report = {'messages': len(timings['total']),
+              'emails': emails,
+              'messages_per_second': len(timings['total']) / elapsed,
+              'latency_ms': {}}
+    for stage in STAGES:
+        values = sorted(timings[stage])
+        report['latency_ms'][stage] = {'p50': percentile(values, 0.5) * 1000,
+                                       'p99': percentile(values, 0.99) * 1000}
+    return report
+
+
+def memory(config, events):
+    """Return the mean and maximum memory (in KiB) allocated at once while processing an event."""
+    notify = Notify(consts.ENV_TEST, config)
+    peaks = []
+    for _, body in events:
+        tracemalloc.start()
+        process(body, notify, config)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return {'mean_peak_kib': sum(peaks) / len(peaks), 'max_peak_kib': max(peaks)}
+
+
+def regressions(report, baseline, tolerance):
+    """Return a description of each regression of the report compared with the baseline."""
+    found = []
+    minimum = baseline['messages_per_second'] * (1 - tolerance)
+    if report['messages_per_second'] < minimum:
+        found.append('throughput {:.1f} msg/s is below {:.1f} msg/s'.format(
+            report['messages_per_second'], minimum))
+    for stage in STAGES:
+        maximum = baseline['latency_ms'][stage]['p99'] * (1 + tolerance)
+        if report['latency_ms'][stage]['p99'] > maximum:
+            found.append('{} p99 {:.3f} ms is above {:.3f} ms'.format(
+                stage, report['latency_ms'][stage]['p99'], maximum))
+    return found
+
+
+def print_report(report):
+    print('{messages} messages, {emails} emails, {messages_per_second:.1f} messages/s'.format(
+        **report))
+    print('{:<8} {:>10} {:>10}'.format('stage', 'p50 ms', 'p99 ms'))
+    for stage in STAGES:
+        print('{:<8} {:>10.3f} {:>10.3f}'.format(stage, report['latency_ms'][stage]['p50'],
+                                                 report['latency_ms'][stage]['p99']))
+    if 'memory' in report:
+        print('memory   {mean_peak_kib:.1f} KiB mean peak, {max_peak_kib:.1f} KiB max peak '
+              'allocated per message'.format(**report['memory']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', help='number of events', type=int, default=2000)
+    parser.add_argument('--mix', help='weights of the kinds of events, e.g. '
+                                      'manifest_received=3,catalogue_new=1 (kinds: {})'.format(
+                                          ', '.join(sorted(synthetic.KINDS))), default='')
+    parser.add_argument('--seed', help='seed for generating the events', type=int, default=0)
+    parser.add_argument('--memory-sample', help='number of events to measure the memory of',
+                        type=int, default=200)
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--save-baseline', help='write the JSON report to this path')
+    parser.add_argument('--tolerance', help='allowed regression as a fraction', type=float,
+                        default=0.25)
+    args = parser.parse_args()
+
+    config_file_path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                    consts.PATH_CONFIG, 'test.cfg')
+    config = Config(config_file_path)
+    Renderer.configure(config.templates)
+    RenderCache.configure(config.templates)
+
+    weights = synthetic.parse_mix(args.mix)
+    with SMTPSink() as sink:
+        config = config.replace(email=config.email._replace(smtp_host=sink.host,
+                                                            smtp_port=sink.port,
+                                                            smtp_username=''))
+        # Warm up the connections and caches
+        run(config, synthetic.events(weights, 50, seed=args.seed))
+        report = run(config, list(synthetic.events(weights, args.count, seed=args.seed)))
+        if args.memory_sample:
+            report['memory'] = memory(config, list(synthetic.events(weights, args.memory_sample,
+                                                                    seed=args.seed)))
+        SMTPPool.close_all()
+
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for regression in found:
+            print('REGRESSION: {}'.format(regression))
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+"""Compare parsing messages with json and dateutil against the fast path used by Message."""
+
+import argparse
+import dateutil.parser
+import json
+import timeit
+import tracemalloc
+from notifier import Message
+from notifier.message import parse_timestamp
+
+BODY = json.dumps({
+    'event_type': 'aker.events.manifest.received',
+    'lims_id': 'aker',
+    'uuid': '3e0bd0d7-7f89-4dd0-a9d6-7fe4c4e1e0c4',
+    'timestamp': '2018-03-23T14:37:45.123Z',
+    'user_identifier': 'user@sanger.ac.uk',
+    'roles': [],
+    'metadata': {
+        'manifest_id': 1234,
+        'barcode': 'AKER-1234',
+        'created_at': '2018-03-20T10:01:02.000Z',
+        'sample_custodian': 'custodian@sanger.ac.uk',
+        'deputies': ['deputy1@sanger.ac.uk', 'deputy2@sanger.ac.uk'],
+        'all_received': True,
+    },
+    'notifier_info': {},
+}).encode('utf-8')
+
+
+def parse_with_dateutil(body):
+    """The previous way of parsing a message."""
+    data = json.loads(body.decode('utf-8'))
+    data['timestamp'] = dateutil.parser.parse(data['timestamp'])
+    for key in ('lims_id', 'uuid', 'roles'):
+        data.pop(key, None)
+    return Message(**data)
+
+
+def memory_per_message(parse, count=10000):
+    """Return the number of bytes held by each parsed message."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = [parse(BODY) for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del messages
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', help='messages parsed per run', type=int, default=20000)
+    parser.add_argument('--repeat', help='runs, the fastest is reported', type=int, default=5)
+    args = parser.parse_args()
+
+    timestamp = '2018-03-23T14:37:45.123Z'
+    cases = [
+        ('timestamp: dateutil', lambda: dateutil.parser.parse(timestamp)),
+        ('timestamp: fast path', lambda: parse_timestamp(timestamp)),
+        ('message: json + dateutil', lambda: parse_with_dateutil(BODY)),
+        ('message: Message.from_json', lambda: Message.from_json(BODY)),
+    ]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        print('{:<30} {:>8.2f} us/op'.format(name, best / args.number * 1e6))
+
+    for name, parse in (('memory: json + dateutil', parse_with_dateutil),
+                        ('memory: Message.from_json', Message.from_json)):
+        print('{:<30} {:>8.0f} bytes/message'.format(name, memory_per_message(parse)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+"""Push events through the same consumer callbacks as run.py at a target rate, with an in-memory
+stand in for the broker and an in-process SMTP sink, and report the throughput and latencies.
+
+The events are read from a newline delimited JSON file (one event per line, - for stdin) or
+generated with the shapes the rules expect. The latency of a message runs from when it was due to
+arrive, according to the rate, until it was acknowledged (or nacked).
+"""
+
+import argparse
+import json
+import os
+import sys
+from functools import partial
+from notifier import consts
+from notifier import Config, Dispatcher, Notify, RenderCache, Renderer
+from notifier import loadgen, synthetic
+from notifier.sink import SMTPSink
+from notifier.smtp_pool import SMTPPool
+from notifier.rule import registry as rule_registry
+from run import on_message, on_message_dispatch, settle_dispatched
+
+
+def load_events(args):
+    """Return the bodies of the events to replay, according to the arguments."""
+    if args.events == '-':
+        return list(loadgen.read_events(sys.stdin.buffer))
+    if args.events:
+        with open(args.events, 'rb') as stream:
+            return list(loadgen.read_events(stream))
+    weights = synthetic.parse_mix(args.mix)
+    return [body for _, body in synthetic.events(weights, args.count, seed=args.seed)]
+
+
+def run(env, config, bodies, rate):
+    """Replay the bodies, returning the report."""
+    channel = loadgen.MemoryChannel()
+    notify = Notify(env, config)
+    if config.dispatch.workers:
+        dispatcher = Dispatcher(notify=notify,
+                                workers=config.dispatch.workers,
+                                queue_size=config.dispatch.queue_size)
+        try:
+            elapsed = loadgen.replay(bodies, channel,
+                                     partial(on_message_dispatch, env=env, config=config,
+                                             dispatcher=dispatcher),
+                                     rate=rate,
+                                     poll=partial(settle_dispatched, channel, dispatcher, config))
+        finally:
+            dispatcher.stop()
+    else:
+        elapsed = loadgen.replay(bodies, channel,
+                                 partial(on_message, env=env, config=config, notify=notify),
+                                 rate=rate)
+    return loadgen.report(channel, elapsed, rate)
+
+
+def print_report(report):
+    print('{messages} messages ({acked} acked, {nacked} nacked), {emails} emails in '
+          '{elapsed_seconds:.2f}s'.format(**report))
+    target = '{:.1f} messages/s'.format(report['target_rate']) if report['target_rate'] else \
+        'unlimited'
+    print('throughput {:.1f} messages/s (target {})'.format(report['messages_per_second'], target))
+    print('latency ms p50 {p50:.3f} p90 {p90:.3f} p99 {p99:.3f} max {max:.3f}'.format(
+        **report['latency_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('events', help='newline delimited JSON events, - for stdin (default: '
+                                       'synthetic events)', nargs='?', default=None)
+    parser.add_argument('--rate', help='messages per second, 0 for as fast as possible',
+                        type=float, default=0)
+    parser.add_argument('--count', help='number of synthetic events', type=int, default=1000)
+    parser.add_argument('--mix', help='weights of the kinds of synthetic events, e.g. '
+                                      'manifest_received=3,catalogue_new=1 (kinds: {})'.format(
+                                          ', '.join(sorted(synthetic.KINDS))), default='')
+    parser.add_argument('--seed', help='seed for generating the events', type=int, default=0)
+    parser.add_argument('--config', help='config file (default: config/test.cfg)')
+    parser.add_argument('--dispatch-workers', help='threads sending emails, overrides the '
+                                                   '[Dispatch] workers of the config', type=int)
+    parser.add_argument('--json', help='print the report as JSON', action='store_true')
+    args = parser.parse_args()
+
+    config_file_path = args.config or os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                   consts.PATH_CONFIG, 'test.cfg')
+    config = Config(config_file_path)
+    if args.dispatch_workers is not None:
+        config = config.replace(dispatch=config.dispatch._replace(workers=args.dispatch_workers))
+    Renderer.configure(config.templates)
+    RenderCache.configure(config.templates)
+    rule_registry.load_plugins(config.rules.plugins)
+
+    bodies = load_events(args)
+    with SMTPSink() as sink:
+        config = config.replace(email=config.email._replace(smtp_host=sink.host,
+                                                            smtp_port=sink.port,
+                                                            smtp_username=''))
+        report = run(consts.ENV_TEST, config, bodies, args.rate)
+        SMTPPool.close_all()
+        report['emails'] = sink.received
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
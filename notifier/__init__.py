@@ -1,4 +1,52 @@
-from .config import Config
-from .message import Message
-from .notify import Notify
-from .rule import Rule
+"""Send notifications for the events of the Aker queue.
+
+The classes below are imported from their modules when first used, so that importing a single
+module of the package (e.g. notifier.config) does not import all of them, and pika, jinja2 or the
+email stack with them.
+"""
+import importlib
+import sys
+import types
+
+# Name -> module of the package it is imported from
+_EXPORTS = {
+    'Alerts': 'alerts',
+    'Batch': 'batch',
+    'Channels': 'channels',
+    'Config': 'config',
+    'Digest': 'digest',
+    'Dispatcher': 'dispatch',
+    'Fleet': 'fleet',
+    'Message': 'message',
+    'Envelope': 'mime',
+    'Email': 'notify',
+    'EmailCollector': 'notify',
+    'Notify': 'notify',
+    'RenderCache': 'notify',
+    'Outbox': 'outbox',
+    'Renderer': 'render',
+    'Rule': 'rule',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+class _LazyModule(types.ModuleType):
+    """The package, importing the module of a name in _EXPORTS the first time it is used."""
+
+    def __getattr__(self, name):
+        # Only called when the name has not been set on the package yet
+        try:
+            module = _EXPORTS[name]
+        except KeyError:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(self.__name__, name))
+        value = getattr(importlib.import_module('.' + module, self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_EXPORTS))
+
+
+# Modules can not define __getattr__ before Python 3.7
+sys.modules[__name__].__class__ = _LazyModule
@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from .consts import *
+from .notify import Email
+
+logger = logging.getLogger(__name__)
+
+
+class Alerts:
+    """Notify the devs about failed messages without flooding them, or a broken SMTP server.
+
+    Each failure is sent in its own email until `threshold` failures happen within `window`
+    seconds, or an alert can not be sent. The circuit then opens: failures are only counted, by
+    exception and event type, and a single summary email is sent once `cooldown` seconds have
+    passed. If the summary can not be sent either, the circuit stays open for another cooldown.
+    """
+
+    def __init__(self, send, config, threshold, window, cooldown, poll_interval=1.0):
+        """Init the class and start the thread sending the summaries.
+
+        Args:
+            send: callable sending an Email
+            config: the config for the environment
+            threshold: number of failures within the window which opens the circuit
+            window: number of seconds failures are counted over
+            cooldown: number of seconds the circuit stays open for
+            poll_interval: number of seconds between checks for the end of the cooldown
+        """
+        self._send = send
+        self._config = config
+        self._threshold = threshold
+        self._window = window
+        self._cooldown = cooldown
+        self._failures = deque()
+        self._opened_at = None
+        self._opened_on = None
+        # (exception, event type) -> number of failures not sent individually
+        self._suppressed = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(poll_interval,),
+                                        name='alerts',
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def is_open(self):
+        """Whether the individual alerts are being suppressed."""
+        return self._opened_at is not None
+
+    @property
+    def suppressed(self):
+        """The number of failures not sent individually since the circuit opened."""
+        return sum(self._suppressed.values())
+
+    def failure(self, subject, body, trace):
+        """Alert the devs about a failed message, unless the circuit is open."""
+        now = time.monotonic()
+        with self._lock:
+            self._failures.append(now)
+            while self._failures and self._failures[0] <= now - self._window:
+                self._failures.popleft()
+            if self._opened_at is None and len(self._failures) >= self._threshold:
+                logger.error('{} failures in {}s, suppressing alerts for {}s'.format(
+                    len(self._failures), self._window, self._cooldown))
+                self._open(now)
+            if self._opened_at is not None:
+                self._suppressed[(_exception(trace), _event_type(body))] += 1
+                return
+
+        try:
+            self._send(Email(subject=subject,
+                             from_address=self._config.email.from_address,
+                             to=[self._config.contact.email_dev_team],
+                             template='notification_dev',
+                             data={'message': body, 'traceback': trace}))
+        except Exception:
+            logger.exception('Failed to alert the devs, suppressing alerts for {}s'.format(
+                self._cooldown))
+            with self._lock:
+                if self._opened_at is None:
+                    self._open(time.monotonic())
+                self._suppressed[(_exception(trace), _event_type(body))] += 1
+
+    def check(self, force=False):
+        """Send the summary and close the circuit if the cooldown is over, or if force is True."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if not force and time.monotonic() - self._opened_at < self._cooldown:
+                return
+            suppressed = self._suppressed
+            since = self._opened_on
+
+        if suppressed:
+            failures = [{'count': count, 'exception': exception, 'event_type': event_type}
+                        for (exception, event_type), count in suppressed.most_common()]
+            try:
+                self._send(Email(subject=SBJ_MSG_FAILED_SUMMARY,
+                                 from_address=self._config.email.from_address,
+                                 to=[self._config.contact.email_dev_team],
+                                 template='notification_summary',
+                                 data={'total': sum(suppressed.values()),
+                                       'since': since.isoformat(' ', 'seconds'),
+                                       'failures': failures}))
+            except Exception:
+                logger.exception('Failed to send the summary of failures, suppressing alerts '
+                                 'for another {}s'.format(self._cooldown))
+                with self._lock:
+                    self._opened_at = time.monotonic()
+                return
+
+        with self._lock:
+            logger.info('Sending individual alerts again')
+            self._opened_at = None
+            self._opened_on = None
+            self._suppressed = Counter()
+            self._failures.clear()
+
+    def close(self):
+        """Stop the thread and send the summary of the failures suppressed."""
+        self._stopped.set()
+        self._thread.join()
+        self.check(force=True)
+
+    def _open(self, now):
+        self._opened_at = now
+        self._opened_on = datetime.now()
+
+    def _run(self, poll_interval):
+        while not self._stopped.wait(poll_interval):
+            self.check()
+
+
+def _exception(trace):
+    """Extract the name of the exception from the last line of a traceback."""
+    lines = (trace or '').strip().splitlines()
+    return lines[-1].split(':', 1)[0] if lines else 'Unknown'
+
+
+def _event_type(body):
+    """Extract the event type from the body of a message, if it can be parsed."""
+    try:
+        return json.loads(body)['event_type']
+    except Exception:
+        return 'unknown'
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from aiosmtplib import SMTP, SMTPException, SMTPRecipientsRefused
+from .notify import Notify, any_accepted, check_refused, not_sent
+from .throttle import Throttle
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncNotify:
+    """Send the emails built by Notify from an asyncio event loop.
+
+    Up to `smtp_pool_size` SMTP connections are kept open and shared by all the coroutines sending
+    emails, a connection is reopened if it fails.
+    """
+
+    def __init__(self, env, config):
+        """Init the class with the environment and config for the environment."""
+        self._config = config
+        self._notify = Notify(env, config)
+        # The most recently used (open) connection is handed out first
+        self._connections = asyncio.LifoQueue()
+        for _ in range(config.email.smtp_pool_size):
+            self._connections.put_nowait(None)
+
+    async def send_email(self, subject, from_address, to, template, data):
+        """Curate and send an email, handling the refused recipients as Notify.send does."""
+        envelope = self._notify.build_email(subject, from_address, to, template, data)
+        max_recipients = self._config.email.smtp_max_recipients
+        transactions = [envelope.recipients[i:i + max_recipients]
+                        for i in range(0, len(envelope.recipients), max_recipients)]
+        throttle = Throttle.for_config(self._config.email, self._config.throttle)
+        refused = {}
+        done = 0
+
+        # Waits without blocking the other coroutines
+        await asyncio.sleep(throttle.reserve(transactions))
+        smtp = await self._connections.get()
+        try:
+            if smtp is None or not smtp.is_connected:
+                smtp = await self._connect()
+            logger.debug('Sending email to {}'.format(', '.join(envelope.recipients)))
+            for recipients in transactions:
+                try:
+                    errors, _ = await smtp.sendmail(envelope.sender, recipients, envelope.message)
+                except SMTPRecipientsRefused as e:
+                    rejected = not_sent(recipients, {error.recipient: (error.code, error.message)
+                                                     for error in e.recipients})
+                else:
+                    rejected = {address: (response.code, response.message)
+                                for address, response in errors.items()}
+                throttle.sent(recipients, rejected)
+                refused.update(rejected)
+                done += 1
+                if any(code == 421 for code, _ in rejected.values()):
+                    # The connection is closed, the email is retried for the others
+                    break
+        except (SMTPException, OSError) as e:
+            throttle.failed(e)
+            if smtp is not None:
+                smtp.close()
+            smtp = None
+            if not any_accepted(transactions[:done], refused):
+                raise
+            # The email was sent to some recipients already, it is only retried for the others
+            logger.warning('Sending email failed after {} of {} transactions: {!r}'
+                           .format(done, len(transactions), e))
+        finally:
+            self._connections.put_nowait(smtp)
+        for remaining in transactions[done:]:
+            refused.update(not_sent(remaining, {}))
+        return check_refused(envelope, refused)
+
+    async def send_emails(self, emails, on_sent=None):
+        """Send all the emails (collected by an EmailCollector) at the same time, calling the
+        on_sent callback of each email (if any) once it is sent.
+        """
+        await asyncio.gather(*[self._send_recorded(email, callback)
+                               for email, callback in zip(emails, on_sent or [None] * len(emails))])
+
+    async def _send_recorded(self, email, on_sent):
+        refused = await self.send_email(*email)
+        if on_sent is not None:
+            on_sent()
+        return refused
+
+    async def close(self):
+        """Close all the idle connections."""
+        connections = [self._connections.get_nowait() for _ in range(self._connections.qsize())]
+        for smtp in connections:
+            if smtp is not None and smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except (SMTPException, OSError):
+                    smtp.close()
+            self._connections.put_nowait(None)
+
+    async def _connect(self):
+        logger.debug('Opening SMTP connection to {}:{}'.format(self._config.email.smtp_host,
+                                                               self._config.email.smtp_port))
+        smtp = SMTP(hostname=self._config.email.smtp_host,
+                    port=int(self._config.email.smtp_port))
+        await smtp.connect()
+        if self._config.email.smtp_username:
+            await smtp.login(self._config.email.smtp_username, self._config.email.smtp_password)
+        return smtp
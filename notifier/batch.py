@@ -0,0 +1,96 @@
+import logging
+import traceback
+from .consts import *
+from .metrics import ACKS, IN_FLIGHT, NACKS
+
+logger = logging.getLogger(__name__)
+
+
+class Batch:
+    """Collect deliveries from a channel and settle them together.
+
+    A batch is processed once it holds `size` deliveries or `timeout` seconds after its first
+    delivery arrived, whichever comes first. The deliveries which failed are nacked one by one and
+    all the others are then acknowledged with a single basic_ack(multiple=True).
+    """
+
+    def __init__(self, connection, channel, process, on_failure, size, timeout):
+        """Init the class.
+
+        Args:
+            connection: the connection used to schedule the timeout
+            channel: the channel to acknowledge the deliveries on
+            process: callable processing the body of a delivery, raising if it fails
+            on_failure: callable given the subject, body and traceback of a failure
+            size: maximum number of deliveries in a batch
+            timeout: maximum number of seconds to wait before processing a batch
+        """
+        self._connection = connection
+        self._channel = channel
+        self._process = process
+        self._on_failure = on_failure
+        self._size = size
+        self._timeout = timeout
+        self._deliveries = []
+        self._timer = None
+
+    def __len__(self):
+        return len(self._deliveries)
+
+    def add(self, delivery_tag, body):
+        """Add a delivery to the batch, processing the batch if it is full."""
+        self._deliveries.append((delivery_tag, body))
+        IN_FLIGHT.inc()
+        if len(self._deliveries) >= self._size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._connection.add_timeout(self._timeout, self._on_timeout)
+
+    def flush(self):
+        """Process and settle all the deliveries in the batch."""
+        if self._timer is not None:
+            self._connection.remove_timeout(self._timer)
+            self._timer = None
+
+        deliveries, self._deliveries = self._deliveries, []
+        if not deliveries:
+            return
+
+        logger.info('Processing batch of {} messages'.format(len(deliveries)))
+        failures = []
+        last_success = None
+        for delivery_tag, body in deliveries:
+            try:
+                self._process(body)
+                last_success = delivery_tag
+            except Exception:
+                logger.exception('Error processing message {!s}.'.format(delivery_tag))
+                failures.append((delivery_tag, body, traceback.format_exc()))
+
+        IN_FLIGHT.dec(len(deliveries))
+
+        # Nack the failures first, so that they are not included in the multiple ack
+        alerts = []
+        for delivery_tag, body, trace in failures:
+            try:
+                self._channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+                NACKS.inc()
+                alerts.append((SBJ_MSG_FAILED, body, trace))
+            except Exception:
+                logger.exception('Failed to nack message.')
+                alerts.append((SBJ_NACK_FAILED, body, traceback.format_exc()))
+
+        if last_success is not None:
+            self._channel.basic_ack(delivery_tag=last_success, multiple=True)
+            ACKS.inc(len(deliveries) - len(failures))
+
+        # Only alert once the whole batch is settled
+        for subject, body, trace in alerts:
+            try:
+                self._on_failure(subject, body, trace)
+            except Exception:
+                logger.exception('Failed to notify about a failed message.')
+
+    def _on_timeout(self):
+        self._timer = None
+        self.flush()
@@ -0,0 +1,292 @@
+"""Send notifications over other channels than email, e.g. a chat webhook or a log file.
+
+Each channel is fed by its own ChannelPool of worker threads, so that a slow channel does not hold
+back the others, and the event types are routed to channels with the patterns of a Registry.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from functools import partial
+from .idempotency import call_after, send_recorded
+from .metrics import CHANNEL_DROPPED, CHANNEL_FAILED, CHANNEL_SENT
+from .notify import Email
+from .registry import Registry
+from .render import Renderer
+from .retry import backoff
+
+logger = logging.getLogger(__name__)
+
+# The channel sending the emails with the Notify given to the rules
+EMAIL = 'email'
+
+# Put on the work queue to stop a worker
+_STOP = object()
+
+
+class Channel:
+    """A way of sending notifications, given as the Emails built by the rules."""
+
+    name = None
+
+    def send(self, email):
+        """Send the notification, raising if it failed."""
+        raise NotImplementedError
+
+
+class WebhookChannel(Channel):
+    """Post the subject and the text version of the notification to a chat webhook.
+
+    The JSON body `{"text": ...}` is understood by the incoming webhooks of Slack, Mattermost and
+    Microsoft Teams.
+    """
+
+    name = 'webhook'
+
+    def __init__(self, url, timeout=10):
+        self._url = url
+        self._timeout = timeout
+        self._renderer = Renderer.shared()
+
+    def send(self, email):
+        # Only imported when a webhook is configured
+        import urllib.request
+        text = '{}\n\n{}'.format(email.subject,
+                                 self._renderer.render(email.template + '.txt', email.data))
+        request = urllib.request.Request(self._url,
+                                         data=json.dumps({'text': text}).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self._timeout) as response:
+            response.read()
+
+
+class LogChannel(Channel):
+    """Append the notifications to a file, one JSON object per line."""
+
+    name = 'log'
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def send(self, email):
+        line = json.dumps({'sent_at': datetime.now().isoformat(),
+                           'subject': email.subject,
+                           'to': email.to,
+                           'template': email.template,
+                           'data': email.data}, default=str)
+        with self._lock, open(self._path, 'a') as stream:
+            stream.write(line + '\n')
+
+
+class ChannelPool:
+    """Send the notifications of a channel from its own worker threads, retrying them with an
+    exponential backoff.
+
+    At most `queue_size` notifications wait for a worker. Once the queue is full `submit` waits
+    for up to `queue_timeout` seconds for some room, and then drops the notification, so that a
+    slow channel never blocks the consumer for long.
+    """
+
+    def __init__(self, channel, workers=1, queue_size=100, queue_timeout=1.0, retries=3,
+                 base_delay=1.0, max_delay=30.0):
+        """Init the pool and start the workers.
+
+        Args:
+            channel: the Channel to send the notifications with
+            workers: number of threads sending notifications
+            queue_size: maximum number of notifications waiting for a worker
+            queue_timeout: maximum number of seconds `submit` waits for room in the queue
+            retries: number of times a failed notification is retried
+            base_delay: number of seconds to wait before the first retry, doubled every retry
+            max_delay: maximum number of seconds to wait before a retry
+        """
+        self._channel = channel
+        self._queue_timeout = queue_timeout
+        self._retries = retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._stopped = threading.Event()
+        self._workers = [threading.Thread(target=self._work,
+                                          name='{}-{}'.format(channel.name, i),
+                                          daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @property
+    def pending(self):
+        """The number of notifications waiting for a worker."""
+        return self._jobs.qsize()
+
+    def submit(self, email):
+        """Queue the notification, returning a Future set once it has been sent (or failed)."""
+        future = Future()
+        try:
+            self._jobs.put((email, future), timeout=self._queue_timeout)
+        except queue.Full:
+            logger.error('Dropping {} notification {!r}, the queue is full'.format(
+                self._channel.name, email.subject))
+            CHANNEL_DROPPED.labels(self._channel.name).inc()
+            future.set_exception(queue.Full())
+        return future
+
+    def stop(self, timeout=None):
+        """Stop the workers once they have sent the notifications already queued."""
+        self._stopped.set()
+        for _ in self._workers:
+            self._jobs.put((_STOP, None))
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _work(self):
+        while True:
+            email, future = self._jobs.get()
+            if email is _STOP:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._send(email)
+            except Exception as e:
+                CHANNEL_FAILED.labels(self._channel.name).inc()
+                future.set_exception(e)
+            else:
+                CHANNEL_SENT.labels(self._channel.name).inc()
+                future.set_result(None)
+
+    def _send(self, email):
+        attempts = 0
+        while True:
+            try:
+                return self._channel.send(email)
+            except Exception:
+                attempts += 1
+                if attempts > self._retries or self._stopped.is_set():
+                    logger.exception('Failed to send {} notification {!r}'.format(
+                        self._channel.name, email.subject))
+                    raise
+                delay = backoff(attempts, self._base_delay, self._max_delay)
+                logger.warning('Failed to send {} notification {!r}, retrying in {:.1f}s'.format(
+                    self._channel.name, email.subject, delay), exc_info=True)
+                time.sleep(delay)
+
+
+class Channels:
+    """Route the notifications of each event type to channels.
+
+    The emails are sent with the Notify given to the rules, as before, the other channels are
+    sent to from their pools without waiting. Event types without a route only go to email.
+
+    The threaded consumers acknowledge a delivery without waiting for its channels: a
+    notification which fails (once retried) or is dropped is logged and counted, it is not sent
+    again. The asyncio consumer waits for them.
+    """
+
+    def __init__(self, pools, routes=()):
+        """Init the class.
+
+        Args:
+            pools: the ChannelPools of the channels other than email
+            routes: (event type or pattern, [channel names]) in order, see Registry
+        """
+        self._pools = {pool.channel.name: pool for pool in pools}
+        self._routes = Registry()
+        for event_type, names in routes:
+            for name in names:
+                if name != EMAIL and name not in self._pools:
+                    raise ValueError('Unknown channel {!r} for {}'.format(name, event_type))
+                self._routes.register(event_type, name)
+
+    @classmethod
+    def from_config(cls, channels_config):
+        """Create the pools of the channels enabled in the config and the routes to them."""
+        channels = []
+        if channels_config.webhook_url:
+            channels.append(WebhookChannel(channels_config.webhook_url))
+        if channels_config.log_path:
+            channels.append(LogChannel(channels_config.log_path))
+        pools = [ChannelPool(channel,
+                             workers=channels_config.workers,
+                             queue_size=channels_config.queue_size,
+                             queue_timeout=channels_config.queue_timeout_seconds,
+                             retries=channels_config.retries)
+                 for channel in channels]
+        return cls(pools, channels_config.routes)
+
+    def for_event(self, event_type):
+        """Return the names of the channels to notify for event_type, without duplicates."""
+        names = self._routes.handlers(event_type)
+        if not names:
+            return (EMAIL,)
+        return tuple(OrderedDict.fromkeys(names))
+
+    def send(self, name, email):
+        """Send the notification over the channel (other than email), returning a Future."""
+        return self._pools[name].submit(email)
+
+    def notify(self, event_type, notify):
+        """Return the stand in for notify sending the notifications of an event type."""
+        names = self.for_event(event_type)
+        if names == (EMAIL,):
+            return notify
+        return _Routed(self, names, notify)
+
+    def stop(self, timeout=None):
+        """Stop all the pools once they have sent the notifications already queued."""
+        for pool in self._pools.values():
+            pool.stop(timeout)
+
+
+class _Routed:
+    """Stand in for Notify sending the notifications to the channels of an event type.
+
+    The Futures of the notifications sent to the channels are kept in `futures`, for a caller
+    which waits for them (e.g. the asyncio consumer), the threaded consumers do not.
+    """
+
+    # Given on_sent, see send_recorded
+    defers_sending = True
+
+    def __init__(self, channels, names, notify):
+        self._channels = channels
+        self._names = names
+        self._notify = notify
+        self.futures = []
+
+    def send_email(self, subject, from_address, to, template, data, on_sent=None):
+        """Send the notification to the channels, calling on_sent (if given) once it has been
+        sent to all of them.
+        """
+        # Sent from the pools once the caller may have changed data
+        email = Email(subject=subject, from_address=from_address, to=list(to),
+                      template=template, data=dict(data))
+        others = [name for name in self._names if name != EMAIL]
+        if on_sent is not None:
+            on_sent = call_after(len(self._names), on_sent)
+        for name in others:
+            future = self._channels.send(name, email)
+            if on_sent is not None:
+                future.add_done_callback(partial(_if_sent, on_sent))
+            self.futures.append(future)
+        if EMAIL in self._names:
+            return send_recorded(self._notify, on_sent,
+                                 subject=subject,
+                                 from_address=from_address,
+                                 to=to,
+                                 template=template,
+                                 data=data)
+
+
+def _if_sent(callback, future):
+    if future.exception() is None:
+        callback()
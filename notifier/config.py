@@ -1,4 +1,5 @@
-from collections import namedtuple
+import copy
+from collections import OrderedDict, namedtuple
 from configparser import ConfigParser
 
 
@@ -6,15 +7,39 @@ class Config:
     """Extract the config from the provided config file path."""
 
     BrokerConfig = namedtuple('BrokerConfig',
-                              'user password host port virtual_host queue')
+                              '''user password host port virtual_host queue
+                                 prefetch_count batch_size batch_timeout_ms heartbeat_seconds
+                                 socket_timeout_seconds blocked_connection_timeout_seconds
+                                 reconnect_base_delay_seconds reconnect_max_delay_seconds''')
     EmailConfig = namedtuple('EmailConfig', '''from_address,
                                                smtp_host,
                                                smtp_port,
                                                smtp_username,
-                                               smtp_password''')
-    ProcessConfig = namedtuple('ProcessConfig', 'stdout_log stderr_log pidfile')
+                                               smtp_password,
+                                               smtp_pool_size,
+                                               smtp_idle_timeout,
+                                               smtp_max_recipients''')
+    ProcessConfig = namedtuple('ProcessConfig', 'stdout_log stderr_log pidfile startup_cache')
     ContactConfig = namedtuple('ContactConfig', 'email_dev_team email_hmdmc_verify')
     LinkConfig = namedtuple('LinkConfig', 'protocol root port')
+    DispatchConfig = namedtuple('DispatchConfig', 'workers queue_size poll_interval_ms')
+    RulesConfig = namedtuple('RulesConfig', 'plugins')
+    DigestConfig = namedtuple('DigestConfig', 'window_seconds templates')
+    MetricsConfig = namedtuple('MetricsConfig', 'host port')
+    OutboxConfig = namedtuple('OutboxConfig',
+                              'path base_delay_seconds max_delay_seconds max_attempts')
+    IdempotencyConfig = namedtuple('IdempotencyConfig', 'size ttl_seconds path')
+    ChannelsConfig = namedtuple('ChannelsConfig',
+                                '''workers queue_size queue_timeout_seconds retries webhook_url
+                                   log_path routes''')
+    LanesConfig = namedtuple('LanesConfig', 'weights queues routes')
+    ThrottleConfig = namedtuple('ThrottleConfig',
+                                '''relay_rate relay_burst domain_rate domain_burst decrease
+                                   increase min_fraction domains''')
+    AlertsConfig = namedtuple('AlertsConfig', 'threshold window_seconds cooldown_seconds')
+    AsyncConfig = namedtuple('AsyncConfig', 'concurrency')
+    TemplatesConfig = namedtuple('TemplatesConfig',
+                                 'auto_reload bytecode_cache_dir render_cache_size')
 
     def __init__(self, config_file_path):
         """Init the class with the path of the config file and use the standard configparser."""
@@ -26,6 +51,30 @@ class Config:
         self._email = self._email_config(config, 'Email')
         self._contact = self._contact_config(config, 'Contact')
         self._link = self._link_config(config, 'Link')
+        self._templates = self._templates_config(config, 'Templates')
+        self._asynchronous = self._async_config(config, 'Async')
+        self._dispatch = self._dispatch_config(config, 'Dispatch')
+        self._rules = self._rules_config(config, 'Rules')
+        self._digest = self._digest_config(config, 'Digest')
+        self._metrics = self._metrics_config(config, 'Metrics')
+        self._alerts = self._alerts_config(config, 'Alerts')
+        self._outbox = self._outbox_config(config, 'Outbox')
+        self._idempotency = self._idempotency_config(config, 'Idempotency')
+        self._channels = self._channels_config(config, 'Channels', 'Routes')
+        self._lanes = self._lanes_config(config, 'Lanes', 'LaneRoutes')
+        self._throttle = self._throttle_config(config, 'Throttle', 'ThrottleDomains')
+
+    def replace(self, **sections):
+        """Return a copy of the config with the given sections replaced.
+
+        e.g. config.replace(email=config.email._replace(smtp_port=2525))
+        """
+        config = copy.copy(self)
+        for name, value in sections.items():
+            if not hasattr(self, '_' + name):
+                raise ValueError('Unknown config section: {!r}'.format(name))
+            setattr(config, '_' + name, value)
+        return config
 
     @property
     def broker(self):
@@ -47,6 +96,54 @@ class Config:
     def link(self):
         return self._link
 
+    @property
+    def templates(self):
+        return self._templates
+
+    @property
+    def asynchronous(self):
+        return self._asynchronous
+
+    @property
+    def dispatch(self):
+        return self._dispatch
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @property
+    def digest(self):
+        return self._digest
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def alerts(self):
+        return self._alerts
+
+    @property
+    def outbox(self):
+        return self._outbox
+
+    @property
+    def idempotency(self):
+        return self._idempotency
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @property
+    def lanes(self):
+        return self._lanes
+
+    @property
+    def throttle(self):
+        return self._throttle
+
     def _broker_config(self, config, section):
         """Extract the config for the message broker."""
         return self.BrokerConfig(
@@ -56,6 +153,14 @@ class Config:
             config.getint(section, 'port'),
             config.get(section, 'virtual_host'),
             config.get(section, 'queue'),
+            config.getint(section, 'prefetch_count', fallback=0),
+            config.getint(section, 'batch_size', fallback=1),
+            config.getint(section, 'batch_timeout_ms', fallback=200),
+            config.getint(section, 'heartbeat_seconds', fallback=60),
+            config.getfloat(section, 'socket_timeout_seconds', fallback=10),
+            config.getfloat(section, 'blocked_connection_timeout_seconds', fallback=300),
+            config.getfloat(section, 'reconnect_base_delay_seconds', fallback=1),
+            config.getfloat(section, 'reconnect_max_delay_seconds', fallback=60),
         )
 
     def _email_config(self, config, section):
@@ -66,6 +171,9 @@ class Config:
             config.get(section, 'smtp_port'),
             config.get(section, 'smtp_username'),
             config.get(section, 'smtp_password'),
+            config.getint(section, 'smtp_pool_size', fallback=1),
+            config.getfloat(section, 'smtp_idle_timeout', fallback=60),
+            config.getint(section, 'smtp_max_recipients', fallback=100),
         )
 
     def _process_config(self, config, section):
@@ -74,6 +182,7 @@ class Config:
             config.get(section, 'stdout_log'),
             config.get(section, 'stderr_log'),
             config.get(section, 'pidfile'),
+            config.get(section, 'startup_cache', fallback=''),
         )
 
     def _contact_config(self, config, section):
@@ -90,3 +199,123 @@ class Config:
             config.get(section, 'root'),
             config.get(section, 'port'),
         )
+
+    def _templates_config(self, config, section):
+        """Extract the config for loading and compiling the email templates."""
+        return self.TemplatesConfig(
+            config.getboolean(section, 'auto_reload', fallback=False),
+            config.get(section, 'bytecode_cache_dir', fallback=''),
+            config.getint(section, 'render_cache_size', fallback=256),
+        )
+
+    def _async_config(self, config, section):
+        """Extract the config for the asyncio consumer."""
+        return self.AsyncConfig(
+            config.getint(section, 'concurrency', fallback=10),
+        )
+
+    def _dispatch_config(self, config, section):
+        """Extract the config for sending emails from a pool of worker threads."""
+        return self.DispatchConfig(
+            config.getint(section, 'workers', fallback=0),
+            config.getint(section, 'queue_size', fallback=100),
+            config.getint(section, 'poll_interval_ms', fallback=100),
+        )
+
+    def _rules_config(self, config, section):
+        """Extract the config for the rules checked for each event."""
+        plugins = config.get(section, 'plugins', fallback='')
+        return self.RulesConfig(
+            [name.strip() for name in plugins.split(',') if name.strip()],
+        )
+
+    def _digest_config(self, config, section):
+        """Extract the config for combining emails into digests."""
+        templates = config.get(section, 'templates', fallback='')
+        return self.DigestConfig(
+            config.getfloat(section, 'window_seconds', fallback=0),
+            [name.strip() for name in templates.split(',') if name.strip()],
+        )
+
+    def _metrics_config(self, config, section):
+        """Extract the config for serving the metrics."""
+        return self.MetricsConfig(
+            config.get(section, 'host', fallback='127.0.0.1'),
+            config.getint(section, 'port', fallback=0),
+        )
+
+    def _alerts_config(self, config, section):
+        """Extract the config for alerting the devs about failed messages."""
+        return self.AlertsConfig(
+            config.getint(section, 'threshold', fallback=5),
+            config.getfloat(section, 'window_seconds', fallback=60),
+            config.getfloat(section, 'cooldown_seconds', fallback=300),
+        )
+
+    def _outbox_config(self, config, section):
+        """Extract the config for storing the emails before sending them."""
+        return self.OutboxConfig(
+            config.get(section, 'path', fallback=''),
+            config.getfloat(section, 'base_delay_seconds', fallback=1),
+            config.getfloat(section, 'max_delay_seconds', fallback=300),
+            config.getint(section, 'max_attempts', fallback=10),
+        )
+
+    def _idempotency_config(self, config, section):
+        """Extract the config for skipping the emails already sent for redelivered events."""
+        return self.IdempotencyConfig(
+            config.getint(section, 'size', fallback=0),
+            config.getfloat(section, 'ttl_seconds', fallback=86400),
+            config.get(section, 'path', fallback=''),
+        )
+
+    def _lanes_config(self, config, section, routes_section):
+        """Extract the weights of the lanes, their queues and the routes of event types to them."""
+        weights = OrderedDict()
+        queues = []
+        if config.has_section(section):
+            for lane, value in config.items(section):
+                weight, _, queue = value.partition(',')
+                weights[lane] = int(weight)
+                if queue.strip():
+                    queues.append((lane, queue.strip()))
+        routes = []
+        if config.has_section(routes_section):
+            routes = [(event_type, lane.strip())
+                      for event_type, lane in config.items(routes_section)]
+        return self.LanesConfig(weights, queues, routes)
+
+    def _throttle_config(self, config, section, domains_section):
+        """Extract the rates emails are sent at through the SMTP relay and to each domain."""
+        domains = {}
+        if config.has_section(domains_section):
+            for domain, value in config.items(domains_section):
+                rate, _, burst = value.partition(',')
+                domains[domain.lower()] = (float(rate), float(burst or 0))
+        return self.ThrottleConfig(
+            config.getfloat(section, 'relay_rate', fallback=0),
+            config.getfloat(section, 'relay_burst', fallback=0),
+            config.getfloat(section, 'domain_rate', fallback=0),
+            config.getfloat(section, 'domain_burst', fallback=0),
+            config.getfloat(section, 'decrease', fallback=0.5),
+            config.getfloat(section, 'increase', fallback=0.05),
+            config.getfloat(section, 'min_fraction', fallback=0.05),
+            domains,
+        )
+
+    def _channels_config(self, config, section, routes_section):
+        """Extract the config for the channels other than email and the routes to them."""
+        routes = []
+        if config.has_section(routes_section):
+            for event_type, names in config.items(routes_section):
+                routes.append((event_type,
+                               [name.strip() for name in names.split(',') if name.strip()]))
+        return self.ChannelsConfig(
+            config.getint(section, 'workers', fallback=1),
+            config.getint(section, 'queue_size', fallback=100),
+            config.getfloat(section, 'queue_timeout_seconds', fallback=1),
+            config.getint(section, 'retries', fallback=3),
+            config.get(section, 'webhook_url', fallback=''),
+            config.get(section, 'log_path', fallback=''),
+            routes,
+        )
@@ -30,6 +30,9 @@ SBJ_MAN_RECEIVED = 'Aker | Material Received'
 SBJ_CAT_REJECTED = 'Aker | Catalogue Rejected'
 SBJ_MSG_FAILED = 'Aker | Notification Failure'
 SBJ_NACK_FAILED = 'Aker | NACK Failure'
+SBJ_MSG_FAILED_SUMMARY = 'Aker | Notification Failures Summary'
 SBJ_CAT_NEW = 'Aker | New Catalogue Available'
 SBJ_CAT_PROCESSED = 'Aker | Catalogue Processed'
 SBJ_PREFIX_WO = 'Aker | Work Order'
+SBJ_DIGEST = 'Aker | Notification Digest'
+SBJ_DIGEST_FAILED = 'Aker | Digest Failure'
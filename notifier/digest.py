@@ -0,0 +1,155 @@
+import json
+import logging
+import threading
+import time
+import traceback
+from functools import partial
+from markupsafe import Markup
+from .consts import *
+from .idempotency import call_after, send_recorded
+from .notify import unique_addresses
+from .render import Renderer
+
+logger = logging.getLogger(__name__)
+
+
+class Digest:
+    """Stand in for Notify which combines the emails sent to the same recipient using the same
+    template within a time window into a single email.
+
+    Emails using other templates are sent straight away. The emails being held are only kept in
+    memory, they are lost if the process dies before the window closes. The deliveries of the
+    emails are acknowledged once they are held: a digest which can not be sent (or stored, if
+    notify is an Outbox which retries it) is reported with on_failure, e.g. to Alerts.
+    """
+
+    # The emails are only sent once the window closes, see send_recorded
+    defers_sending = True
+
+    def __init__(self, notify, templates, window, poll_interval=1.0, on_failure=None):
+        """Init the class and start the thread sending the digests.
+
+        Args:
+            notify: used to send the emails
+            templates: names of the templates to combine into digests
+            window: number of seconds to hold the emails for, from the first one for a recipient
+            poll_interval: number of seconds between checks for digests to send
+            on_failure: called with (subject, body, traceback) when a digest could not be sent,
+                e.g. Alerts.failure, the body describes the emails of the digest as JSON
+        """
+        self._notify = notify
+        self._on_failure = on_failure
+        self._templates = frozenset(templates)
+        self._window = window
+        self._renderer = Renderer.shared()
+        # (recipient, template) -> (time of the first email,
+        #                           [(subject, from_address, recipient, data, on_sent)])
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(poll_interval,),
+                                        name='digest',
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """The number of emails being held."""
+        with self._lock:
+            return sum(len(entries) for _, entries in self._pending.values())
+
+    def send_email(self, subject, from_address, to, template, data, on_sent=None):
+        """Hold the email for the digests of its recipients, or send it if its template is not
+        combined into digests. on_sent is called once it has been sent to all its recipients.
+        """
+        if template not in self._templates:
+            send_recorded(self._notify, on_sent,
+                          subject=subject,
+                          from_address=from_address,
+                          to=to,
+                          template=template,
+                          data=data)
+            return
+
+        recipients = unique_addresses(to)
+        # Held past the return, when the caller may have changed data
+        data = dict(data)
+        if on_sent is not None:
+            on_sent = call_after(len(recipients), on_sent)
+        now = time.monotonic()
+        with self._lock:
+            for recipient in recipients:
+                key = (recipient.lower(), template)
+                if key not in self._pending:
+                    self._pending[key] = (now, [])
+                self._pending[key][1].append((subject, from_address, recipient, data, on_sent))
+
+    def flush(self, force=False):
+        """Send the digests whose window has closed, or all of them if force is True."""
+        deadline = time.monotonic() - self._window
+        with self._lock:
+            due = [key for key, (started, _) in self._pending.items()
+                   if force or started <= deadline]
+            digests = [(key[1], self._pending.pop(key)[1]) for key in due]
+
+        for template, entries in digests:
+            try:
+                self._send_digest(template, entries)
+            except Exception:
+                logger.exception('Failed to send digest of {} {} emails'.format(len(entries),
+                                                                                template))
+                if self._on_failure:
+                    self._on_failure(SBJ_DIGEST_FAILED, _describe(template, entries),
+                                     traceback.format_exc())
+
+    def close(self):
+        """Stop the thread and send all the digests held."""
+        self._stopped.set()
+        self._thread.join()
+        self.flush(force=True)
+
+    def _send_digest(self, template, entries):
+        callbacks = [on_sent for _, _, _, _, on_sent in entries if on_sent is not None]
+        on_sent = partial(_call_all, callbacks) if callbacks else None
+        if len(entries) == 1:
+            subject, from_address, recipient, data, _ = entries[0]
+            send_recorded(self._notify, on_sent,
+                          subject=subject,
+                          from_address=from_address,
+                          to=[recipient],
+                          template=template,
+                          data=data)
+            return
+
+        _, from_address, recipient, _, _ = entries[0]
+        data = {'entries': [
+            {'subject': subject,
+             'text': self._renderer.render_block(template + '.txt', 'content', data),
+             'html': Markup(self._renderer.render_block(template + '.html', 'content', data))}
+            for subject, _, _, data, _ in entries]}
+        logger.debug('Sending digest of {} {} emails to {}'.format(len(entries), template,
+                                                                    recipient))
+        send_recorded(self._notify, on_sent,
+                      subject='{} ({} notifications)'.format(SBJ_DIGEST, len(entries)),
+                      from_address=from_address,
+                      to=[recipient],
+                      template='digest',
+                      data=data)
+
+    def _run(self, poll_interval):
+        while not self._stopped.wait(poll_interval):
+            self.flush()
+
+
+def _describe(template, entries):
+    """Describe the emails of a digest, in place of the body of the message which failed."""
+    return json.dumps({'event_type': 'digest',
+                       'template': template,
+                       'recipient': entries[0][2],
+                       'subjects': [subject for subject, _, _, _, _ in entries]}).encode('utf-8')
+
+
+def _call_all(callbacks):
+    for callback in callbacks:
+        callback()
@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import traceback
+from .idempotency import send_recorded
+from .lanes import DEFAULT, LaneQueue
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """Send the emails for deliveries from a pool of worker threads.
+
+    The consumer thread submits the emails built for a delivery and keeps consuming. Once all the
+    emails of a delivery have been sent (or one failed) the outcome is put on a queue which the
+    consumer thread reads with `completed`, so that the channel is only ever used from its own
+    thread.
+
+    The deliveries waiting for a worker are taken from their lanes in proportion to the weights
+    of the lanes, see LaneQueue, so that urgent emails do not wait for a backlog of bulk ones.
+    """
+
+    def __init__(self, notify, workers, queue_size, lanes=None):
+        """Init the class and start the workers.
+
+        Args:
+            notify: used to send the emails, it must be safe to use from several threads
+            workers: number of threads sending emails
+            queue_size: maximum number of deliveries waiting for a worker, `submit` blocks when
+                the queue is full, it should hold all the deliveries the broker may send at once
+            lanes: {lane: weight} of the lanes of the deliveries, by default a single lane
+        """
+        self._notify = notify
+        self._jobs = LaneQueue(lanes or {}, maxsize=queue_size, name='emails')
+        self._completed = queue.Queue()
+        self._workers = [threading.Thread(target=self._work,
+                                          name='dispatcher-{}'.format(i),
+                                          daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def pending(self):
+        """The number of deliveries waiting for a worker."""
+        return self._jobs.qsize()
+
+    def submit(self, delivery_tag, body, emails, lane=DEFAULT, on_sent=None, block=True):
+        """Queue the emails for a delivery to be sent by a worker.
+
+        Args:
+            delivery_tag: the delivery the emails are for, None if nothing needs settling
+            body: the body of the delivery, reported back if the delivery fails
+            emails: the Emails to send
+            lane: the lane of the delivery
+            on_sent: the callback (or None) to call once each email is sent, see send_recorded
+            block: whether to wait for room in the queue when it is full
+
+        Raises:
+            queue.Full: if block is False and the queue is full
+        """
+        self._jobs.put(lane, (delivery_tag, body, emails, on_sent or [None] * len(emails)),
+                       block=block)
+
+    def completed(self):
+        """Yield (delivery_tag, body, traceback) for the deliveries which have been handled since
+        the last call, traceback is None if all the emails were sent.
+        """
+        while True:
+            try:
+                yield self._completed.get_nowait()
+            except queue.Empty:
+                return
+
+    def stop(self, timeout=None, wait=True):
+        """Stop the workers once they have sent the emails already queued, or once they have
+        sent the emails they are sending if wait is False, the others are then dropped.
+
+        Returns:
+            the number of deliveries dropped
+        """
+        dropped = 0
+        if not wait:
+            while True:
+                try:
+                    _, (delivery_tag, _, _, _) = self._jobs.get(block=False)
+                except queue.Empty:
+                    break
+                if delivery_tag is not None:
+                    dropped += 1
+        self._jobs.close()
+        for worker in self._workers:
+            worker.join(timeout)
+        return dropped
+
+    def _work(self):
+        while True:
+            try:
+                _, (delivery_tag, body, emails, on_sent) = self._jobs.get()
+            except queue.Empty:
+                # Stopped, and all the deliveries queued have been handled
+                return
+            trace = None
+            try:
+                for email, callback in zip(emails, on_sent):
+                    send_recorded(self._notify, callback, *email)
+            except Exception:
+                logger.exception('Error sending email for message {!s}.'.format(delivery_tag))
+                trace = traceback.format_exc()
+            if delivery_tag is not None:
+                self._completed.put((delivery_tag, body, trace))
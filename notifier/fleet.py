@@ -0,0 +1,82 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Fleet:
+    """Run several worker processes and restart them when they die."""
+
+    def __init__(self, target, workers, restart_delay=1.0, poll_interval=0.5):
+        """Init the class.
+
+        Args:
+            target: callable run by every worker, given the index of the worker
+            workers: number of worker processes
+            restart_delay: minimum number of seconds between two starts of the same worker, to
+                avoid spinning when a worker keeps crashing
+            poll_interval: number of seconds between checks of the workers
+        """
+        # Fork so that the workers inherit the config, logging and compiled templates
+        self._context = multiprocessing.get_context('fork')
+        self._target = target
+        self._restart_delay = restart_delay
+        self._poll_interval = poll_interval
+        self._processes = [None] * workers
+        self._started_at = [0.0] * workers
+        self._stopping = False
+
+    @property
+    def processes(self):
+        """The current worker processes."""
+        return list(self._processes)
+
+    def run(self):
+        """Start the workers and keep them running until `stop` is called, or an exception (e.g.
+        SystemExit on SIGTERM) is raised, in which case the workers are stopped.
+        """
+        try:
+            while not self._stopping:
+                self.check()
+                time.sleep(self._poll_interval)
+        finally:
+            self.stop()
+
+    def check(self):
+        """Start the workers which are not running."""
+        for index, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                logger.error('Worker {} (pid {}) exited with code {}'.format(
+                    index, process.pid, process.exitcode))
+                self._processes[index] = None
+            if time.monotonic() - self._started_at[index] < self._restart_delay:
+                continue
+            self._start(index)
+
+    def stop(self, timeout=10):
+        """Stop all the workers, killing those which have not exited within timeout seconds."""
+        self._stopping = True
+        running = [p for p in self._processes if p is not None and p.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in running:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning('Killing worker (pid {})'.format(process.pid))
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
+
+    def _start(self, index):
+        process = self._context.Process(target=self._target,
+                                        args=(index,),
+                                        name='worker-{}'.format(index))
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info('Started worker {} (pid {})'.format(index, process.pid))
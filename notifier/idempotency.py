@@ -0,0 +1,212 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sent (
+    uuid TEXT NOT NULL,
+    template TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    PRIMARY KEY (uuid, template, recipient)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sent_sent_at ON sent (sent_at);
+'''
+
+
+class SentCache:
+    """Remember the (event uuid, template, recipient) of the emails sent, to skip sending them
+    again when an event is redelivered.
+
+    The most recently sent are kept in memory, up to `size` of them and for `ttl` seconds, so
+    that a lookup is a single dict access. If a path is given they are also written to a SQLite
+    file, read back from it on start up so that they survive a restart. A key not in memory is
+    only looked up in the file if it could be there: when the file is shared with other
+    processes (which add the emails they send), or once entries have been dropped from memory.
+    The expired rows are deleted from the file every `purge_every` calls to `add`.
+    """
+
+    def __init__(self, size, ttl, path=None, shared=False, purge_every=1000):
+        """Init the cache, loading the entries still valid from the file if a path is given.
+
+        Args:
+            size: maximum number of entries kept, the least recently used are dropped first
+            ttl: number of seconds an entry is kept for
+            path: path of the SQLite file backing the cache, None keeps it in memory only
+            shared: whether other processes add to the file too
+            purge_every: number of calls to `add` between deletions of the expired rows
+        """
+        self._size = size
+        self._ttl = ttl
+        self._shared = shared
+        self._purge_every = purge_every
+        self._adds = 0
+        # key -> time sent, the least recently used first
+        self._entries = OrderedDict()
+        # Whether the file has entries which are not in memory
+        self._dropped = False
+        self._lock = threading.Lock()
+        # The file is used outside of the lock of the entries, so that it never holds up a
+        # lookup in memory
+        self._db = None
+        self._db_lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            # Commits are not synced to disk, only the checkpoints of the WAL: an email sent
+            # just before a power loss may be forgotten, which only means it is sent again
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(_SCHEMA)
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Whether the email with the given (uuid, template, recipient) has been sent."""
+        deadline = time.time() - self._ttl
+        with self._lock:
+            sent_at = self._entries.get(key)
+            if sent_at is None:
+                if not (self._shared or self._dropped):
+                    return False
+            elif sent_at <= deadline:
+                del self._entries[key]
+                return False
+            else:
+                self._entries.move_to_end(key)
+                return True
+        sent_at = self._lookup(key)
+        if sent_at is None or sent_at <= deadline:
+            return False
+        with self._lock:
+            self._remember(key, sent_at)
+        return True
+
+    def add(self, keys):
+        """Remember that the emails with the given (uuid, template, recipient) have been sent."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._remember(key, now)
+        with self._db_lock:
+            if self._db is not None:
+                with self._db:
+                    self._db.executemany('INSERT OR REPLACE INTO sent VALUES (?, ?, ?, ?)',
+                                         [key + (now,) for key in keys])
+                self._adds += 1
+                if self._adds % self._purge_every == 0:
+                    self._purge(now - self._ttl)
+
+    def close(self):
+        """Close the file backing the cache, if any."""
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, sent_at):
+        """Keep the key in memory, the lock must be held."""
+        self._entries[key] = sent_at
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self._dropped = True
+
+    def _lookup(self, key):
+        """Return the time the key was sent at according to the file, None if it is not there."""
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute('SELECT sent_at FROM sent WHERE uuid = ? AND template = ? AND '
+                                   'recipient = ?', key).fetchone()
+        return row[0] if row else None
+
+    def _purge(self, deadline):
+        """Delete the rows which have expired from the file."""
+        with self._db:
+            deleted = self._db.execute('DELETE FROM sent WHERE sent_at <= ?', (deadline,)).rowcount
+        logger.debug('Deleted {} expired sent emails'.format(deleted))
+
+    def _load(self):
+        self._purge(time.time() - self._ttl)
+        # One more than fits, to know whether some are left in the file only
+        rows = self._db.execute('SELECT uuid, template, recipient, sent_at FROM sent '
+                                'ORDER BY sent_at DESC LIMIT ?', (self._size + 1,)).fetchall()
+        self._dropped = len(rows) > self._size
+        for uuid, template, recipient, sent_at in reversed(rows[:self._size]):
+            self._entries[(uuid, template, recipient)] = sent_at
+        logger.debug('Loaded {} sent emails'.format(len(self._entries)))
+
+
+def call_after(count, callback):
+    """Return a function calling callback the count-th time it is called, e.g. once an email has
+    been sent to all its recipients or channels.
+    """
+    lock = threading.Lock()
+
+    def call():
+        nonlocal count
+        with lock:
+            count -= 1
+            done = count == 0
+        if done:
+            callback()
+    return call
+
+
+def send_recorded(notify, on_sent, *args, **kwargs):
+    """Send an email with notify.send_email(*args, **kwargs), calling on_sent once it has been
+    sent or stored for good (e.g. in the outbox).
+
+    A notify which only holds the email to send it later (e.g. EmailCollector or Digest) has
+    `defers_sending` set, it is given on_sent to call once it has sent the email.
+    """
+    if on_sent is not None and getattr(notify, 'defers_sending', False) is True:
+        return notify.send_email(*args, on_sent=on_sent, **kwargs)
+    result = notify.send_email(*args, **kwargs)
+    if on_sent is not None:
+        on_sent()
+    return result
+
+
+class Idempotent:
+    """Stand in for Notify which skips the recipients an event's email has already been sent to.
+
+    One is used per event. The recipients are remembered once the email has been sent or stored
+    in the outbox, not when it is only held to be sent later (e.g. by the dispatcher or for a
+    digest), so that it is sent if the process dies before.
+    """
+
+    def __init__(self, notify, sent, uuid):
+        """Init the class.
+
+        Args:
+            notify: used to send the emails
+            sent: the SentCache of the emails already sent
+            uuid: the unique identifier of the event the emails are for
+        """
+        self._notify = notify
+        self._sent = sent
+        self._uuid = uuid
+
+    def send_email(self, subject, from_address, to, template, data):
+        """Send the email to the recipients it has not been sent to yet for the event."""
+        keys = [(self._uuid, template, recipient.lower()) for recipient in to]
+        unsent = [(recipient, key) for recipient, key in zip(to, keys) if key not in self._sent]
+        if len(unsent) < len(to):
+            logger.info('Skipping {} recipients already sent {} for event {}'.format(
+                len(to) - len(unsent), template, self._uuid))
+        if not unsent:
+            return
+        send_recorded(self._notify, partial(self._sent.add, [key for _, key in unsent]),
+                      subject=subject,
+                      from_address=from_address,
+                      to=[recipient for recipient, _ in unsent],
+                      template=template,
+                      data=data)
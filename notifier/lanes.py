@@ -0,0 +1,160 @@
+"""Schedule the work of the consumer in lanes, so that urgent events (e.g. HMDMC verifications)
+and the failure alerts are not stuck behind a backlog of bulk events.
+
+Each lane has a weight, and the items waiting are taken from the lanes in proportion to their
+weights (smooth weighted round robin), in order within a lane. A lane is never starved, and the
+first item of a lane of weight w waits for at most W / w items of the other lanes, W being the
+total weight of the lanes with items waiting.
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from .metrics import LANE_WAIT_SECONDS
+from .registry import Registry
+
+# The lane of the events without a route, and of the items of lanes without a weight
+DEFAULT = 'default'
+
+# The lane of the failure alerts sent to the devs
+ALERTS = 'alerts'
+
+
+class Lanes:
+    """The lanes and the event types routed to each of them."""
+
+    def __init__(self, weights, routes=(), queues=()):
+        """Init the class.
+
+        Args:
+            weights: {lane: weight}, the default lane has a weight of 1 unless given
+            routes: (event type or pattern, lane) in order, see Registry, the first matching
+                route is used
+            queues: (lane, queue) for the lanes which also have a queue of their own, all the
+                messages consumed from it are in the lane
+        """
+        self._weights = OrderedDict(weights)
+        self._weights.setdefault(DEFAULT, 1)
+        self._routes = Registry()
+        for event_type, lane in routes:
+            if lane not in self._weights:
+                raise ValueError('Unknown lane {!r} for {}'.format(lane, event_type))
+            self._routes.register(event_type, lane)
+        for lane, _ in queues:
+            if lane not in self._weights:
+                raise ValueError('Unknown lane {!r} for a queue'.format(lane))
+        self._queues = list(queues)
+
+    @classmethod
+    def from_config(cls, lanes_config):
+        """Return the Lanes of the config, None if it has none."""
+        if not lanes_config.weights:
+            return None
+        return cls(lanes_config.weights, lanes_config.routes, lanes_config.queues)
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def queues(self):
+        """(lane, queue) for the lanes with a queue of their own."""
+        return self._queues
+
+    def for_event(self, event_type):
+        """Return the lane of event_type."""
+        lanes = self._routes.handlers(event_type)
+        return lanes[0] if lanes else DEFAULT
+
+
+class LaneQueue:
+    """A thread safe queue of items in lanes, taken from the lanes in proportion to their weights.
+
+    Items put in a lane without a weight go to the default lane. Once closed, `get` raises
+    queue.Empty as soon as no items are left, rather than waiting for more.
+    """
+
+    def __init__(self, weights, maxsize=0, name='deliveries'):
+        """Init the class.
+
+        Args:
+            weights: {lane: weight}, the default lane has a weight of 1 unless given
+            maxsize: maximum number of items waiting in all the lanes, `put` blocks when reached,
+                0 for no limit
+            name: the name of the queue in the metrics
+        """
+        self._weights = OrderedDict(weights)
+        self._weights.setdefault(DEFAULT, 1)
+        self._lanes = OrderedDict((lane, deque()) for lane in self._weights)
+        self._credits = dict.fromkeys(self._weights, 0)
+        self._maxsize = maxsize
+        self._name = name
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def __len__(self):
+        return self._size
+
+    def qsize(self):
+        return self._size
+
+    def put(self, lane, item, block=True, timeout=None):
+        """Put item at the end of its lane, waiting for room if the queue is full.
+
+        Raises:
+            queue.Full: if there was no room in time, or block is False
+        """
+        if lane not in self._lanes:
+            lane = DEFAULT
+        with self._not_full:
+            if self._maxsize:
+                if not self._not_full.wait_for(lambda: self._size < self._maxsize,
+                                               timeout if block else 0):
+                    raise queue.Full()
+            self._lanes[lane].append((time.perf_counter(), item))
+            self._size += 1
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        """Remove and return (lane, item) for the next item, waiting for one if there is none.
+
+        Raises:
+            queue.Empty: if there was no item in time, block is False or the queue is closed
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._size or self._closed,
+                                            timeout if block else 0) or not self._size:
+                raise queue.Empty()
+            lane = self._next_lane()
+            queued_at, item = self._lanes[lane].popleft()
+            if not self._lanes[lane]:
+                # A lane starts again from nothing once drained, rather than saving up
+                self._credits[lane] = 0
+            self._size -= 1
+            self._not_full.notify()
+        LANE_WAIT_SECONDS.labels(self._name, lane).observe(time.perf_counter() - queued_at)
+        return lane, item
+
+    def close(self):
+        """Stop the calls to `get` waiting for items once the queue is empty."""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+
+    def _next_lane(self):
+        """Pick the lane to take the next item from, the lock must be held."""
+        best = None
+        total = 0
+        for lane, items in self._lanes.items():
+            if not items:
+                continue
+            weight = self._weights[lane]
+            self._credits[lane] += weight
+            total += weight
+            if best is None or self._credits[lane] > self._credits[best]:
+                best = lane
+        self._credits[best] -= total
+        return best
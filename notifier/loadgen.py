@@ -0,0 +1,137 @@
+"""Replay events through the consumer callbacks at a target rate, without a broker.
+
+The deliveries are made on a MemoryChannel, which stands in for the channel of the broker and
+records when each of them is acknowledged (or nacked), so that the latency of every message can be
+reported from the time it was due to arrive until it was settled.
+"""
+import json
+import time
+from collections import namedtuple
+
+# What the consumer callbacks read from the method frame of a delivery
+MethodFrame = namedtuple('MethodFrame', 'delivery_tag routing_key')
+
+
+def read_events(stream):
+    """Yield the body (as bytes) of each event of a newline delimited JSON stream.
+
+    Blank lines are skipped, the lines are not parsed here so that invalid events reach the
+    consumer as they would from the queue.
+    """
+    for line in stream:
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        line = line.strip()
+        if line:
+            yield line
+
+
+def routing_key(body):
+    """Return the event type of the body, used as the routing key of its delivery."""
+    try:
+        return json.loads(body.decode('utf-8')).get('event_type', '')
+    except (ValueError, AttributeError):
+        return ''
+
+
+class MemoryChannel:
+    """Stand in for a broker channel, delivering bodies to a consumer callback in process."""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._next_tag = 1
+        self._due = {}
+        # delivery tag -> (acked, seconds from due to settled)
+        self.settled = {}
+
+    @property
+    def unsettled(self):
+        """The number of deliveries neither acknowledged nor nacked yet."""
+        return len(self._due)
+
+    def deliver(self, body, callback, due=None):
+        """Deliver the body to callback(channel, method_frame, header_frame, body).
+
+        Args:
+            body: the body of the delivery
+            callback: the consumer callback, e.g. on_message with its config bound
+            due: when the delivery was due according to clock, by default now
+        """
+        delivery_tag = self._next_tag
+        self._next_tag += 1
+        self._due[delivery_tag] = self._clock() if due is None else due
+        callback(self, MethodFrame(delivery_tag, routing_key(body)), None, body)
+        return delivery_tag
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self._settle(delivery_tag, multiple, True)
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        # Requeued deliveries are not redelivered, they would skew the latencies
+        self._settle(delivery_tag, multiple, False)
+
+    def _settle(self, delivery_tag, multiple, acked):
+        now = self._clock()
+        tags = [tag for tag in self._due if tag <= delivery_tag] if multiple else [delivery_tag]
+        for tag in tags:
+            self.settled[tag] = (acked, now - self._due.pop(tag))
+
+
+def replay(bodies, channel, callback, rate=0, poll=None, poll_interval=0.001,
+           clock=time.perf_counter, sleep=time.sleep):
+    """Deliver the bodies on the channel at a steady rate, returning the seconds it took.
+
+    Args:
+        bodies: the bodies to deliver
+        channel: the MemoryChannel to deliver on
+        callback: the consumer callback
+        rate: messages per second, 0 delivers them as fast as the callback returns
+        poll: called in between the deliveries and until all of them are settled, e.g. to settle
+            the deliveries handled by a Dispatcher
+        poll_interval: seconds to sleep in between calls to poll
+        clock: returns the current time in seconds
+        sleep: sleeps for the given seconds
+    """
+    interval = 1 / rate if rate else 0
+    start = clock()
+    for n, body in enumerate(bodies):
+        due = start + n * interval
+        now = clock()
+        while now < due:
+            if poll:
+                poll()
+                sleep(min(due - now, poll_interval))
+            else:
+                sleep(due - now)
+            now = clock()
+        # A delivery made late (the consumer can not keep up) counts from when it was due
+        channel.deliver(body, callback, due=due if rate else None)
+        if poll:
+            poll()
+    while poll and channel.unsettled:
+        sleep(poll_interval)
+        poll()
+    return clock() - start
+
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of the (sorted) values fall."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def report(channel, elapsed, rate=0):
+    """Return the throughput and the latencies of the deliveries settled on the channel."""
+    latencies = sorted(latency for _, latency in channel.settled.values())
+    acked = sum(1 for acked, _ in channel.settled.values() if acked)
+    return {'messages': len(latencies),
+            'acked': acked,
+            'nacked': len(latencies) - acked,
+            'elapsed_seconds': elapsed,
+            'target_rate': rate,
+            'messages_per_second': len(latencies) / elapsed if elapsed else 0.0,
+            'latency_ms': {'p50': percentile(latencies, 0.5) * 1000,
+                           'p90': percentile(latencies, 0.9) * 1000,
+                           'p99': percentile(latencies, 0.99) * 1000,
+                           'max': (latencies[-1] if latencies else 0.0) * 1000}}
@@ -0,0 +1,265 @@
+"""Counters, gauges and histograms exposed in the Prometheus text format over HTTP."""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a fraction of a millisecond (parsing) to several seconds (a slow SMTP server)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Hold the metrics to expose."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def expose(self):
+        """Return all the metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    """A metric, optionally split by the values of its labels."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self._label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self._label_names:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def labels(self, *values):
+        """Return the metric for the given values of the labels."""
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self._label_names):
+                raise ValueError('Expected values for labels {}'.format(self._label_names))
+            with self._lock:
+                return self._children.setdefault(values, self._new_child())
+
+    def samples(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            for line in child.samples(self.name, self._format_labels(values)):
+                yield line
+
+    def _format_labels(self, values):
+        return ','.join('{}="{}"'.format(name, _escape(value))
+                        for name, value in zip(self._label_names, values))
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def __getattr__(self, name):
+        # Metrics without labels behave as their only child, e.g. counter.inc()
+        if name.startswith('_') or self._label_names:
+            raise AttributeError(name)
+        return getattr(self._children[()], name)
+
+
+class Counter(_Metric):
+    """A value which only goes up, e.g. the number of emails sent."""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    """A value which goes up and down, e.g. the number of messages in flight."""
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Histogram(_Metric):
+    """Count observations (e.g. latencies) in buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS,
+                 registry=REGISTRY):
+        self._buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels, registry)
+
+    def _new_child(self):
+        return _Histogram(self._buckets)
+
+
+class _Value:
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        self._value = value
+
+    def samples(self, name, labels):
+        yield '{}{} {}'.format(name, '{' + labels + '}' if labels else '', _number(self._value))
+
+
+class _Histogram:
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return self._count
+
+    def observe(self, value):
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        """Observe the number of seconds spent in the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, labels):
+        separator = ',' if labels else ''
+        with self._lock:
+            counts, count, total = list(self._counts), self._count, self._sum
+        cumulative = 0
+        for bound, bucket_count in zip(self._buckets, counts):
+            cumulative += bucket_count
+            yield '{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, separator, _number(bound),
+                                                       cumulative)
+        yield '{}_bucket{{{}{}le="+Inf"}} {}'.format(name, labels, separator, count)
+        labels = '{' + labels + '}' if labels else ''
+        yield '{}_count{} {}'.format(name, labels, count)
+        yield '{}_sum{} {}'.format(name, labels, _number(total))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value))
+
+
+def serve(host, port, registry=REGISTRY):
+    """Serve the metrics over HTTP from a background thread, returning the server."""
+    # Only imported when the metrics are served, http.server imports much of the stdlib
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = self.server.registry.expose().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    logger.info('Serving metrics on http://{}:{}/metrics'.format(*server.server_address[:2]))
+    return server
+
+
+# The metrics of the service
+# Labelled with the registration matched by the event type (see Registry.label), not the type
+EVENTS = Counter('notifier_events_total', 'Events checked by type.', ['event_type'])
+EMAILS_SENT = Counter('notifier_emails_sent_total', 'Emails accepted by the SMTP server.')
+EMAILS_FAILED = Counter('notifier_emails_failed_total', 'Emails which failed to be sent.')
+RECIPIENTS_REFUSED = Counter('notifier_recipients_refused_total',
+                             'Recipients refused by the SMTP server.')
+ACKS = Counter('notifier_acks_total', 'Messages acknowledged.')
+NACKS = Counter('notifier_nacks_total', 'Messages nacked.')
+PARSE_SECONDS = Histogram('notifier_parse_seconds', 'Time spent parsing messages.')
+RULES_SECONDS = Histogram('notifier_rules_seconds', 'Time spent checking the rules of events.')
+RENDER_SECONDS = Histogram('notifier_render_seconds', 'Time spent rendering and building emails.')
+RENDER_CACHE_HITS = Counter('notifier_render_cache_hits_total',
+                            'Emails built from parts already rendered.')
+RENDER_CACHE_MISSES = Counter('notifier_render_cache_misses_total',
+                              'Emails whose parts had to be rendered.')
+SEND_SECONDS = Histogram('notifier_send_seconds', 'Time spent sending emails over SMTP.')
+IN_FLIGHT = Gauge('notifier_messages_in_flight', 'Messages received but not settled yet.')
+SMTP_CONNECTIONS_IN_USE = Gauge('notifier_smtp_connections_in_use',
+                                'SMTP connections checked out of the pools.')
+SMTP_CONNECTIONS_IDLE = Gauge('notifier_smtp_connections_idle',
+                              'Open SMTP connections waiting in the pools.')
+OUTBOX_PENDING = Gauge('notifier_outbox_pending', 'Emails stored in the outbox waiting to be sent.')
+CHANNEL_SENT = Counter('notifier_channel_sent_total', 'Notifications sent by channel.', ['channel'])
+CHANNEL_FAILED = Counter('notifier_channel_failed_total',
+                         'Notifications which failed to be sent by channel.', ['channel'])
+CHANNEL_DROPPED = Counter('notifier_channel_dropped_total',
+                          'Notifications dropped by channel as its queue was full.', ['channel'])
+LANE_WAIT_SECONDS = Histogram('notifier_lane_wait_seconds',
+                              'Time spent waiting in a lane by queue (deliveries or emails).',
+                              ['queue', 'lane'])
+THROTTLE_WAIT_SECONDS = Histogram('notifier_throttle_wait_seconds',
+                                  'Time spent waiting for the SMTP send rate.')
+THROTTLE_SLOW_DOWNS = Counter('notifier_throttle_slow_downs_total',
+                              'Send rate decreases after a 421 or 451 reply by scope (relay or '
+                              'domain).', ['scope'])
+THROTTLE_RELAY_RATE = Gauge('notifier_throttle_relay_rate',
+                            'SMTP transactions per second currently allowed through the relay.')
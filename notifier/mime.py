@@ -0,0 +1,88 @@
+"""Build the emails straight to the bytes sent over SMTP.
+
+The email package builds a tree of Message objects, guesses the charsets and encodings of each
+part and then serializes the whole tree again when it is sent. The emails of the notifier are
+always a multipart/alternative of a text and an HTML part, so the same RFC 5322 / MIME output is
+written here from precomputed headers and a fixed boundary.
+"""
+import base64
+import os
+import re
+from collections import namedtuple
+from email.header import Header
+from email.utils import formatdate, make_msgid
+
+# What is handed to SMTP.sendmail
+Envelope = namedtuple('Envelope', 'sender recipients message')
+
+# Can not appear in base64 and is checked against the parts sent as 7bit
+BOUNDARY = '=_notifier.{}'.format(os.urandom(12).hex())
+
+# RFC 5322 limits lines to 998 characters, and recommends folding headers at 78
+MAX_LINE = 998
+MAX_HEADER = 78
+
+_HEADERS = ('Content-Type: multipart/alternative;\r\n boundary="{}"\r\n'
+            'MIME-Version: 1.0\r\n'.format(BOUNDARY)).encode('ascii')
+_DELIMITER = '\r\n--{}\r\n'.format(BOUNDARY).encode('ascii')
+_CLOSE_DELIMITER = '\r\n--{}--\r\n'.format(BOUNDARY).encode('ascii')
+_PART_7BIT = 'Content-Type: text/{}; charset="us-ascii"\r\nContent-Transfer-Encoding: 7bit\r\n\r\n'
+_PART_BASE64 = 'Content-Type: text/{}; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+_LINE_BREAKS = re.compile(r'\r\n|\r|\n')
+_LONG_LINE = re.compile(r'[^\n]{%d}' % (MAX_LINE + 1))
+
+
+def encode_part(text, subtype):
+    """Return the bytes of a text/<subtype> part holding text, headers included.
+
+    ASCII text is sent as is (7bit), anything else as base64 encoded UTF-8, as the email package
+    does.
+    """
+    text = _LINE_BREAKS.sub('\n', text).rstrip('\n')
+    try:
+        body = text.encode('ascii')
+    except UnicodeEncodeError:
+        body = None
+    if body is None or _LONG_LINE.search(text) or BOUNDARY in text:
+        encoded = base64.encodebytes(text.encode('utf-8')).rstrip(b'\n')
+        return _PART_BASE64.format(subtype).encode('ascii') + encoded.replace(b'\n', b'\r\n')
+    return _PART_7BIT.format(subtype).encode('ascii') + body.replace(b'\n', b'\r\n')
+
+
+def build_message(subject, from_address, to, parts):
+    """Return the bytes of a multipart/alternative email made of the encoded parts.
+
+    According to RFC 2046, the last part of a multipart message is the preferred one, so the
+    HTML part goes last.
+    """
+    headers = [_HEADERS,
+               header('Subject', subject),
+               header('From', from_address),
+               header('To', ', '.join(to)),
+               header('Date', formatdate(localtime=True)),
+               header('Message-ID', make_msgid(domain=from_address.rpartition('@')[2] or None))]
+    body = [_DELIMITER[2:]]
+    for i, part in enumerate(parts):
+        if i:
+            body.append(_DELIMITER)
+        body.append(part)
+    body.append(_CLOSE_DELIMITER)
+    return b''.join(headers) + b'\r\n' + b''.join(body)
+
+
+def header(name, value):
+    """Return the bytes of a header line, folding it and encoding it (RFC 2047) if needed."""
+    value = _LINE_BREAKS.sub(' ', value)
+    line = '{}: {}\r\n'.format(name, value)
+    if len(line) <= MAX_HEADER + 2:
+        try:
+            return line.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+    try:
+        value.encode('ascii')
+        charset = 'us-ascii'
+    except UnicodeEncodeError:
+        charset = 'utf-8'
+    encoded = Header(value, charset, header_name=name).encode(linesep='\r\n')
+    return '{}: {}\r\n'.format(name, encoded).encode('ascii')
@@ -1,13 +1,24 @@
 import logging
-import os
+import threading
+from collections import OrderedDict, namedtuple
+from smtplib import SMTPException, SMTPRecipientsRefused
 from .consts import *
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from smtplib import SMTP
+from .metrics import EMAILS_FAILED, EMAILS_SENT, RECIPIENTS_REFUSED, RENDER_CACHE_HITS, \
+    RENDER_CACHE_MISSES, RENDER_SECONDS, SEND_SECONDS
+from .mime import Envelope, build_message, encode_part
+from .render import Renderer
+from .smtp_pool import SMTPPool
+from .throttle import Throttle
 
 logger = logging.getLogger(__name__)
 
+# The reply recorded for the recipients of a transaction which was not completed, so that they are
+# retried like those refused for now
+NOT_SENT_REPLY = (421, b'Not sent, the connection was closed')
+
+
+Email = namedtuple('Email', 'subject from_address to template data')
+
 
 class Notify:
     """Notify users using multiple methods of notification e.g. email, SMS, etc."""
@@ -16,40 +27,261 @@ class Notify:
         """Init the class with the environment and config for the environment."""
         self._env = env
         self._config = config
-        self._jinja_env = Environment(
-            loader=FileSystemLoader(
-                os.path.join(os.path.abspath(os.path.dirname(__file__)), 'templates')),
-            autoescape=select_autoescape(['html', ]))
+        # Templates are compiled once and shared by every Notify, as are the rendered bodies
+        self._renderer = Renderer.shared()
+        self._render_cache = RenderCache.shared()
 
     def send_email(self, subject, from_address, to, template, data):
-        """Curate and send an email."""
-        with SMTP(host=self._config.email.smtp_host,
-                  port=self._config.email.smtp_port) as smtp:
+        """Curate and send an email, returning the recipients refused for good (see send)."""
+        return self.send(self.build_email(subject, from_address, to, template, data))
 
-            # Login to SMTP server
-            if self._config.email.smtp_username:
-                smtp.login(user=self._config.email.smtp_username,
-                           password=self._config.email.smtp_password)
+    def send(self, envelope):
+        """Send an email built by build_email, to all its recipients in as few SMTP transactions
+        as the server allows.
 
-            msg = MIMEMultipart('alternative')
+        A recipient refused by the server does not stop the email from being sent to the others.
+        The recipients refused for good (5xx) are logged and returned, as {address: (code,
+        message)}. If some were only refused for now (4xx), SMTPRecipientsRefused is raised with
+        those only, once the email has been sent to all the others, so that it can be retried for
+        them alone. When the server closes the connection (421), or a later transaction fails,
+        every recipient the email was not sent to yet is raised as refused for now.
+        """
+        logger.debug('Sending email to {}'.format(', '.join(envelope.recipients)))
+        max_recipients = self._config.email.smtp_max_recipients
+        transactions = [envelope.recipients[i:i + max_recipients]
+                        for i in range(0, len(envelope.recipients), max_recipients)]
+        # Shared by every Notify sending through the same relay, as are the connections
+        throttle = Throttle.for_config(self._config.email, self._config.throttle)
+        refused = {}
+        done = 0
+        try:
+            throttle.acquire(transactions)
+            with SEND_SECONDS.time():
+                try:
+                    with SMTPPool.for_config(self._config.email).connection() as smtp:
+                        for recipients in transactions:
+                            try:
+                                rejected = smtp.sendmail(envelope.sender, recipients,
+                                                         envelope.message)
+                            except SMTPRecipientsRefused as e:
+                                # The email was not sent in this transaction: either every
+                                # recipient was refused, or the server closed the connection
+                                # (421) before the rest of the recipients were tried
+                                rejected = not_sent(recipients, e.recipients)
+                            throttle.sent(recipients, rejected)
+                            refused.update(rejected)
+                            done += 1
+                            if any(code == 421 for code, _ in rejected.values()):
+                                # The connection is closed, the email is retried for the others
+                                break
+                except (SMTPException, OSError) as e:
+                    if not any_accepted(transactions[:done], refused):
+                        raise
+                    # The email was sent to some recipients already, it is only retried for
+                    # the others
+                    throttle.failed(e)
+                    logger.warning('Sending email failed after {} of {} transactions: {!r}'
+                                   .format(done, len(transactions), e))
+            for remaining in transactions[done:]:
+                refused.update(not_sent(remaining, {}))
+        except Exception as e:
+            throttle.failed(e)
+            EMAILS_FAILED.inc()
+            raise
+        return check_refused(envelope, refused)
 
-            template_html = self._jinja_env.get_template(template + '.html')
-            template_txt = self._jinja_env.get_template(template + '.txt')
+    def build_email(self, subject, from_address, to, template, data):
+        """Render the templates and build the email, returning the Envelope to send."""
+        with RENDER_SECONDS.time():
+            message = build_message(subject, from_address, to, self._render_parts(template, data))
+        return Envelope(sender=from_address, recipients=list(to), message=message)
 
+    def _render_parts(self, template, data):
+        """Return the encoded text and HTML parts of the email, rendering them only if the same
+        template has not been rendered with the same data recently.
+        """
+        key = self._render_cache.key(template, data)
+        parts = self._render_cache.get(key)
+        if parts is None:
             # Record the MIME types of both parts - text/plain and text/html.
-            part1 = MIMEText(template_txt.render(data), 'plain')
-            part2 = MIMEText(template_html.render(data), 'html')
-
-            # Attach parts into message container.
-            # According to RFC 2046, the last part of a multipart message, in this case
-            # the HTML message, is best and preferred.
-            msg.attach(part1)
-            msg.attach(part2)
-
-            msg['Subject'] = subject
-            msg['From'] = from_address
-            msg['To'] = ', '.join(to)
-
-            logger.debug('Sending email to {}'.format(msg['To']))
-            smtp.send_message(msg)
-            smtp.quit()
+            parts = (encode_part(self._renderer.render(template + '.txt', data), 'plain'),
+                     encode_part(self._renderer.render(template + '.html', data), 'html'))
+            self._render_cache.put(key, parts)
+        return parts
+
+
+class RenderCache:
+    """Keep the encoded MIME parts rendered for the most recently used (template, data).
+
+    The parts are shared by every email built from the same template and data, e.g. the catalogue
+    notifications sent to the dev team.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, size=256):
+        """Init the cache.
+
+        Args:
+            size: maximum number of rendered (template, data) kept, 0 disables the cache
+        """
+        self._size = size
+        # key -> parts, the least recently used first
+        self._parts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, templates_config):
+        """Replace the shared cache with one sized from the config.
+
+        Nothing is cached if the templates are reloaded when they change.
+        """
+        cache = cls(0 if templates_config.auto_reload else templates_config.render_cache_size)
+        with cls._shared_lock:
+            cls._shared = cache
+        return cache
+
+    @classmethod
+    def shared(cls):
+        """Return the shared cache, creating one with the defaults if it is not configured."""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def __len__(self):
+        return len(self._parts)
+
+    def key(self, template, data):
+        """Return the key for the template rendered with data, None if data can not be hashed."""
+        if not self._size:
+            return None
+        try:
+            key = (template, _freeze(data))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """Return the parts cached for the key, None if there are none."""
+        if key is None:
+            return None
+        with self._lock:
+            parts = self._parts.get(key)
+            if parts is not None:
+                self._parts.move_to_end(key)
+        if parts is None:
+            RENDER_CACHE_MISSES.inc()
+        else:
+            RENDER_CACHE_HITS.inc()
+        return parts
+
+    def put(self, key, parts):
+        """Cache the parts for the key, dropping the least recently used if the cache is full."""
+        if key is None:
+            return
+        with self._lock:
+            self._parts[key] = parts
+            while len(self._parts) > self._size:
+                self._parts.popitem(last=False)
+
+
+def _freeze(value):
+    """Turn the data of an email into a hashable value which only equals the same data.
+
+    The types are kept, so that e.g. Markup does not equal the same str, which is escaped.
+    """
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((key, _freeze(item)) for key, item in value.items())))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(item) for item in value))
+    return (type(value), value)
+
+
+class EmailCollector:
+    """Stand in for Notify which keeps the emails instead of sending them.
+
+    Used to evaluate the rules for an event without blocking on SMTP, the collected emails are
+    then sent by someone else, who calls the on_sent callback of each email once it is sent.
+    """
+
+    # The emails are only sent later, see send_recorded
+    defers_sending = True
+
+    def __init__(self):
+        self._emails = []
+        self._on_sent = []
+
+    @property
+    def emails(self):
+        """The emails collected so far."""
+        return self._emails
+
+    @property
+    def on_sent(self):
+        """The callback to call once each of the emails is sent, None for those without one."""
+        return self._on_sent
+
+    def send_email(self, subject, from_address, to, template, data, on_sent=None):
+        """Keep the email to be sent later, with a copy of data as the caller may change it."""
+        self._emails.append(Email(subject=subject,
+                                  from_address=from_address,
+                                  to=list(to),
+                                  template=template,
+                                  data=dict(data)))
+        self._on_sent.append(on_sent)
+
+
+def check_refused(envelope, refused):
+    """Report the recipients refused when sending the envelope, as {address: (code, message)}.
+
+    Returns the recipients refused for good (5xx), raises SMTPRecipientsRefused with the ones
+    which were only refused for now (4xx), to be retried.
+    """
+    if len(refused) < len(envelope.recipients):
+        EMAILS_SENT.inc()
+    if not refused:
+        return refused
+
+    RECIPIENTS_REFUSED.inc(len(refused))
+    permanent = {address: reply for address, reply in refused.items() if reply[0] >= 500}
+    temporary = {address: reply for address, reply in refused.items() if reply[0] < 500}
+    for address, (code, message) in sorted(refused.items()):
+        logger.error('Recipient {} refused by the SMTP server: {} {!r}'.format(address, code,
+                                                                             message))
+    if temporary:
+        if len(temporary) == len(envelope.recipients):
+            EMAILS_FAILED.inc()
+        raise SMTPRecipientsRefused(temporary)
+    if len(permanent) == len(envelope.recipients):
+        EMAILS_FAILED.inc()
+    return permanent
+
+
+def not_sent(recipients, refused):
+    """Return the refused recipients of a transaction which sent nothing, adding the recipients
+    which were not refused (or not tried) as refused for now, so that they are retried.
+    """
+    replies = dict.fromkeys(recipients, NOT_SENT_REPLY)
+    replies.update(refused)
+    return replies
+
+
+def any_accepted(transactions, refused):
+    """Return whether any recipient of the completed transactions was sent the email."""
+    return any(address not in refused for recipients in transactions for address in recipients)
+
+
+def unique_addresses(addresses):
+    """Remove the duplicated email addresses (ignoring case), keeping the first of each."""
+    seen = set()
+    unique = []
+    for address in addresses:
+        key = address.lower()
+        if key not in seen:
+            seen.add(key)
+            unique.append(address)
+    return unique
@@ -0,0 +1,217 @@
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import time
+from smtplib import SMTPRecipientsRefused
+from .metrics import OUTBOX_PENDING
+from .mime import Envelope
+from .retry import backoff
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender TEXT NOT NULL,
+    -- One address per line
+    recipients TEXT NOT NULL,
+    message BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    -- NULL once the email has been given up on
+    next_attempt_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_next_attempt_at ON outbox (next_attempt_at);
+'''
+
+
+class Outbox:
+    """Stand in for Notify which stores the rendered emails in a local SQLite file, from which a
+    background thread sends them.
+
+    An email is stored (and committed) before `send_email` returns, so the delivery it is for can
+    be acknowledged straight away: a temporary SMTP outage delays the emails instead of losing the
+    messages. Failed emails are retried with an exponential backoff and jitter, only to the
+    recipients refused for now if the others got them, and the emails left in the file are sent
+    once the service restarts. Emails which still fail after `max_attempts` are kept in the file,
+    but no longer retried.
+    """
+
+    def __init__(self, notify, path, base_delay=1.0, max_delay=300.0, max_attempts=10,
+                 poll_interval=1.0, batch_size=100):
+        """Init the class, open (or create) the outbox and start the thread sending the emails.
+
+        Args:
+            notify: used to build and send the emails
+            path: path of the SQLite file
+            base_delay: number of seconds to wait before retrying an email the first time, doubled
+                for every failed attempt
+            max_delay: maximum number of seconds to wait before retrying an email
+            max_attempts: number of attempts after which an email is given up on
+            poll_interval: maximum number of seconds between checks for emails to send
+            batch_size: maximum number of emails read from the outbox at once
+        """
+        self._notify = notify
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._max_attempts = max_attempts
+        self._batch_size = batch_size
+        # The connection is shared by the consumer and the sender, one at a time
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        OUTBOX_PENDING.set(self.pending)
+        self._thread = threading.Thread(target=self._run,
+                                        args=(poll_interval,),
+                                        name='outbox',
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """The number of emails waiting to be sent."""
+        return self._count('next_attempt_at IS NOT NULL')
+
+    @property
+    def failed(self):
+        """The number of emails given up on."""
+        return self._count('next_attempt_at IS NULL')
+
+    def send_email(self, subject, from_address, to, template, data):
+        """Render the email and store it to be sent by the background thread."""
+        envelope = self._notify.build_email(subject, from_address, to, template, data)
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO outbox (sender, recipients, message, created_at, '
+                             'next_attempt_at) VALUES (?, ?, ?, ?, ?)',
+                             (envelope.sender, '\n'.join(envelope.recipients), envelope.message,
+                              time.time(), 0))
+        OUTBOX_PENDING.inc()
+        self._wakeup.set()
+
+    def flush(self):
+        """Send the emails which are due, returning the number sent."""
+        sent = 0
+        while not self._stopped.is_set():
+            with self._lock:
+                rows = self._db.execute('SELECT id, sender, recipients, message, attempts '
+                                        'FROM outbox '
+                                        'WHERE next_attempt_at <= ? '
+                                        'ORDER BY next_attempt_at, id LIMIT ?',
+                                        (time.time(), self._batch_size)).fetchall()
+            if not rows:
+                break
+            for id_, sender, recipients, message, attempts in rows:
+                envelope = Envelope(sender=sender, recipients=recipients.split('\n'),
+                                    message=message)
+                if self._send(id_, envelope, attempts):
+                    sent += 1
+            if len(rows) < self._batch_size:
+                break
+        return sent
+
+    def adopt(self, path):
+        """Move the emails of another outbox file (e.g. of a worker process which no longer runs)
+        into this one and remove the file, returning the number of emails moved.
+
+        The emails are removed from the other file once stored in this one, if the process dies
+        in between they are sent twice rather than lost.
+        """
+        other = sqlite3.connect(path)
+        try:
+            other.executescript(_SCHEMA)
+            rows = other.execute('SELECT sender, recipients, message, created_at, attempts, '
+                                 'next_attempt_at, last_error FROM outbox ORDER BY id').fetchall()
+            with self._lock, self._db:
+                self._db.executemany('INSERT INTO outbox (sender, recipients, message, '
+                                     'created_at, attempts, next_attempt_at, last_error) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            with other:
+                other.execute('DELETE FROM outbox')
+        finally:
+            other.close()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        OUTBOX_PENDING.inc(sum(1 for row in rows if row[5] is not None))
+        logger.info('Moved {} emails from {}'.format(len(rows), path))
+        self._wakeup.set()
+        return len(rows)
+
+    def close(self):
+        """Stop the thread and close the outbox, the emails not sent yet stay in the file."""
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        with self._lock:
+            self._db.close()
+
+    def _send(self, id_, envelope, attempts):
+        try:
+            self._notify.send(envelope)
+        except Exception as e:
+            attempts += 1
+            if attempts >= self._max_attempts:
+                logger.exception('Giving up on email {} after {} attempts'.format(id_, attempts))
+                next_attempt_at = None
+            else:
+                delay = self.backoff(attempts)
+                logger.warning('Failed to send email {}, retrying in {:.1f}s: {!r}'.format(
+                    id_, delay, e))
+                next_attempt_at = time.time() + delay
+            recipients = envelope.recipients
+            if isinstance(e, SMTPRecipientsRefused):
+                # The email has been sent to the other recipients
+                recipients = [address for address in recipients if address in e.recipients]
+            with self._lock, self._db:
+                self._db.execute('UPDATE outbox SET recipients = ?, attempts = ?, '
+                                 'next_attempt_at = ?, last_error = ? WHERE id = ?',
+                                 ('\n'.join(recipients), attempts, next_attempt_at, repr(e),
+                                  id_))
+            if next_attempt_at is None:
+                OUTBOX_PENDING.dec()
+            return False
+
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM outbox WHERE id = ?', (id_,))
+        OUTBOX_PENDING.dec()
+        return True
+
+    def backoff(self, attempts):
+        """Return the number of seconds to wait after the given number of failed attempts."""
+        return backoff(attempts, self._base_delay, self._max_delay)
+
+    def _count(self, where):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM outbox WHERE ' + where).fetchone()[0]
+
+    def _run(self, poll_interval):
+        while not self._stopped.is_set():
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to send emails from the outbox')
+            self._wakeup.wait(poll_interval)
+            self._wakeup.clear()
+
+
+def orphaned_paths(path, workers=1):
+    """Return the paths of the outbox files no consumer owns, given the number of worker
+    processes: a single process uses the file at path, worker n of a fleet path.n.
+    """
+    suffixed = {}
+    for candidate in glob.glob(glob.escape(path) + '.*'):
+        suffix = candidate[len(path) + 1:]
+        if suffix.isdigit():
+            suffixed[int(suffix)] = candidate
+    if workers <= 1:
+        return [suffixed[n] for n in sorted(suffixed)]
+    orphans = [path] if os.path.exists(path) else []
+    return orphans + [suffixed[n] for n in sorted(suffixed) if n >= workers]
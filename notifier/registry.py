@@ -0,0 +1,104 @@
+import importlib
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The label of the event types no handler is registered for
+OTHER = 'other'
+
+
+class Registry:
+    """Map event types to the handlers to run for them.
+
+    Handlers are registered either for an exact event type or for a pattern using the AMQP topic
+    wildcards: `*` matches exactly one word and `#` matches zero or more words, e.g.
+    `aker.events.work_order.*`. An event type can match several registrations, the handlers are
+    run in the order they were registered.
+    """
+
+    def __init__(self):
+        self._registrations = []
+        self._exact = {}
+        self._patterns = []
+        # The handlers and label resolved for each event type seen so far which has handlers
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def register(self, event_type, handler=None):
+        """Register handler to be run for event_type, which may be a pattern.
+
+        Can be used as a decorator when handler is not given.
+        """
+        if handler is None:
+            def decorator(func):
+                self.register(event_type, func)
+                return func
+            return decorator
+
+        with self._lock:
+            index = len(self._registrations)
+            self._registrations.append(handler)
+            if self._is_pattern(event_type):
+                self._patterns.append((self._compile(event_type), index, event_type))
+            else:
+                self._exact.setdefault(event_type, []).append(index)
+            self._resolved = {}
+        return handler
+
+    def handlers(self, event_type):
+        """Return the handlers registered for event_type, in order of registration."""
+        return self._resolve(event_type)[0]
+
+    def label(self, event_type):
+        """Return the label to count event_type under in the metrics: the event type itself if
+        handlers are registered for it exactly, else the first pattern it matches, else OTHER.
+
+        The labels are bounded by the registrations, whatever the event types received.
+        """
+        return self._resolve(event_type)[1]
+
+    def _resolve(self, event_type):
+        try:
+            return self._resolved[event_type]
+        except KeyError:
+            pass
+
+        indexes = list(self._exact.get(event_type, ()))
+        label = event_type if indexes else None
+        # Prefixing with a dot lets every word of a pattern be matched as `.word`
+        dotted = '.' + event_type
+        for regex, index, pattern in self._patterns:
+            if regex.match(dotted):
+                indexes.append(index)
+                label = label or pattern
+        handlers = tuple(self._registrations[index] for index in sorted(indexes))
+        if not handlers:
+            # Not cached, so that unknown event types do not grow the cache either
+            return handlers, OTHER
+        self._resolved[event_type] = (handlers, label)
+        return handlers, label
+
+    def load_plugins(self, module_names):
+        """Import the plugin modules, which register their handlers when imported."""
+        for name in module_names:
+            logger.info('Loading rules from {}'.format(name))
+            importlib.import_module(name)
+
+    @staticmethod
+    def _is_pattern(event_type):
+        return any(word in ('*', '#') for word in event_type.split('.'))
+
+    @staticmethod
+    def _compile(pattern):
+        """Compile a topic pattern into a regex matching event types prefixed with a dot."""
+        regex = ''
+        for word in pattern.split('.'):
+            if word == '#':
+                regex += r'(?:\.[^.]+)*'
+            elif word == '*':
+                regex += r'\.[^.]+'
+            else:
+                regex += r'\.' + re.escape(word)
+        return re.compile(regex + r'\Z')
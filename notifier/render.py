@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+
+logger = logging.getLogger(__name__)
+
+PATH_TEMPLATES = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'templates')
+
+
+class Renderer:
+    """Render the email templates from a single, process-wide, Jinja environment."""
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, auto_reload=False, bytecode_cache_dir=None, path=PATH_TEMPLATES):
+        """Init the class.
+
+        Args:
+            auto_reload: check the template files for changes before every render (development)
+            bytecode_cache_dir: directory to keep compiled templates in between restarts
+            path: directory holding the templates
+        """
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+
+        self._auto_reload = auto_reload
+        self._env = Environment(loader=FileSystemLoader(path),
+                                autoescape=select_autoescape(['html', ]),
+                                auto_reload=auto_reload,
+                                bytecode_cache=bytecode_cache,
+                                cache_size=-1)
+        self._templates = {}
+
+    @classmethod
+    def configure(cls, templates_config):
+        """Replace the shared renderer with one built from the config and compile every template.
+
+        Args:
+            templates_config: the Templates section of the config
+        """
+        renderer = cls(auto_reload=templates_config.auto_reload,
+                       bytecode_cache_dir=templates_config.bytecode_cache_dir)
+        renderer.compile_all()
+        with cls._shared_lock:
+            cls._shared = renderer
+        return renderer
+
+    @classmethod
+    def shared(cls):
+        """Return the shared renderer, creating one with the defaults if it is not configured."""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def compile_all(self):
+        """Load and compile all the templates so that none are compiled while handling events."""
+        for name in self._env.list_templates():
+            self._templates[name] = self._env.get_template(name)
+        logger.debug('Compiled {} templates'.format(len(self._templates)))
+
+    def get_template(self, name):
+        """Return the compiled template with the given name."""
+        if self._auto_reload:
+            # Jinja checks the file for changes and reloads it if needed
+            return self._env.get_template(name)
+        try:
+            return self._templates[name]
+        except KeyError:
+            template = self._templates[name] = self._env.get_template(name)
+            return template
+
+    def render(self, name, data):
+        """Render the template with the given name using data."""
+        return self.get_template(name).render(data)
+
+    def render_block(self, name, block, data):
+        """Render a single block (e.g. content) of the template with the given name using data."""
+        template = self.get_template(name)
+        return ''.join(template.blocks[block](template.new_context(data)))
@@ -0,0 +1,186 @@
+"""Replay the events of an archive through the rules, e.g. to send the notifications again after a
+template bug or an outage of the SMTP server.
+
+The archive (newline delimited JSON, as read by the load test) is streamed one line at a time and
+only a bounded number of events are in flight, so that the memory used does not grow with the
+size of the archive.
+"""
+import gzip
+import logging
+import mmap
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timezone
+from .loadgen import read_events
+from .message import Message
+from .registry import Registry
+from .rule import Rule
+
+logger = logging.getLogger(__name__)
+
+# The first bytes of a gzip file
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+@contextmanager
+def open_archive(path, use_mmap=False):
+    """Open the archive at path (- for stdin), yielding the bodies of its events.
+
+    Gzip compressed archives are decompressed as they are read. With use_mmap, an uncompressed
+    archive is memory-mapped rather than read through a buffer, its pages are then shared with
+    the page cache instead of copied (they count towards the resident size of the process, but
+    are reclaimed by the OS when short of memory).
+    """
+    if path == '-':
+        yield read_events(sys.stdin.buffer)
+        return
+    with open(path, 'rb') as stream:
+        if stream.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+            stream.seek(0)
+            with gzip.open(stream) as lines:
+                yield read_events(lines)
+        elif use_mmap and os.fstat(stream.fileno()).st_size:
+            # An empty file can not be mapped
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield read_events(iter(mapped.readline, b''))
+        else:
+            stream.seek(0)
+            yield read_events(stream)
+
+
+class EventFilter:
+    """Select the events to replay and the recipients to send them to."""
+
+    def __init__(self, event_types=(), since=None, until=None, recipients=()):
+        """Init the class.
+
+        Args:
+            event_types: the event types (or patterns, see Registry) to replay, all if empty
+            since: replay the events from this time on, naive times are taken as UTC
+            until: replay the events before this time
+            recipients: addresses (or @domain for all the addresses of a domain) to send to,
+                all if empty
+        """
+        self._event_types = None
+        if event_types:
+            self._event_types = Registry()
+            for event_type in event_types:
+                self._event_types.register(event_type, True)
+        self._since = _utc(since)
+        self._until = _utc(until)
+        self._recipients = {recipient.lower() for recipient in recipients}
+
+    def matches(self, message):
+        """Return whether the message (event) is replayed."""
+        if self._event_types and not self._event_types.handlers(message.event_type):
+            return False
+        if self._since or self._until:
+            timestamp = _utc(message.timestamp)
+            if self._since and timestamp < self._since:
+                return False
+            if self._until and timestamp >= self._until:
+                return False
+        return True
+
+    def recipients(self, to):
+        """Return the addresses of to which are sent to."""
+        if not self._recipients:
+            return list(to)
+        return [address for address in to
+                if address.lower() in self._recipients or
+                '@' + address.rpartition('@')[2].lower() in self._recipients]
+
+
+class ReplayNotify:
+    """Stand in for Notify, sending only to the recipients selected by the filter, or only
+    rendering the emails in a dry run. Counts the emails sent (or rendered).
+    """
+
+    def __init__(self, notify, event_filter, dry_run=False):
+        """Init the class.
+
+        Args:
+            notify: the Notify used to render and send the emails
+            event_filter: the EventFilter selecting the recipients
+            dry_run: only render the emails, without sending them
+        """
+        self._notify = notify
+        self._filter = event_filter
+        self._dry_run = dry_run
+        self._lock = threading.Lock()
+        self.emails = 0
+
+    def send_email(self, subject, from_address, to, template, data):
+        to = self._filter.recipients(to)
+        if not to:
+            return {}
+        if self._dry_run:
+            self._notify.build_email(subject, from_address, to, template, data)
+            logger.info('Would send {!r} to {}'.format(subject, ', '.join(to)))
+            refused = {}
+        else:
+            refused = self._notify.send_email(subject, from_address, to, template, data)
+        with self._lock:
+            self.emails += 1
+        return refused
+
+
+def replay(bodies, env, config, notify, event_filter, workers=1):
+    """Check the rules for the events of bodies selected by event_filter, in parallel.
+
+    An event which can not be parsed or fails is logged (with its number) and skipped.
+
+    Args:
+        bodies: the bodies of the events, e.g. from open_archive
+        env: the environment
+        config: the config for the environment
+        notify: used to send the emails, e.g. a ReplayNotify
+        event_filter: the EventFilter selecting the events
+        workers: number of events checked (and their emails sent) at the same time
+
+    Returns:
+        {'events': read, 'replayed': selected and checked, 'failed': could not be replayed}
+    """
+    stats = {'events': 0, 'replayed': 0, 'failed': 0}
+
+    def check(number, message):
+        try:
+            Rule(env=env, config=config, message=message, notify=notify).check_rules()
+        except Exception:
+            logger.exception('Failed to replay event {} of the archive'.format(number))
+            return False
+        return True
+
+    def settle(future):
+        stats['replayed' if future.result() else 'failed'] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Bounds the events read ahead of the workers
+        in_flight = deque()
+        for number, body in enumerate(bodies, 1):
+            stats['events'] += 1
+            try:
+                message = Message.from_json(body)
+            except Exception:
+                logger.exception('Failed to parse event {} of the archive'.format(number))
+                stats['failed'] += 1
+                continue
+            if not event_filter.matches(message):
+                continue
+            in_flight.append(executor.submit(check, number, message))
+            if len(in_flight) >= 2 * workers:
+                settle(in_flight.popleft())
+        while in_flight:
+            settle(in_flight.popleft())
+    return stats
+
+
+def _utc(timestamp):
+    """Make the timestamp comparable with any other, a naive one being taken as UTC."""
+    if timestamp is not None and timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
@@ -0,0 +1,11 @@
+import random
+
+
+def backoff(attempts, base_delay, max_delay):
+    """Return the number of seconds to wait after the given number of failed attempts.
+
+    The delay doubles with every attempt, up to max_delay, and a random half of it is taken off
+    so that the work failed by the same outage is not all retried at once.
+    """
+    delay = min(max_delay, base_delay * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
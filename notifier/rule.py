@@ -1,37 +1,56 @@
 import logging
+from operator import methodcaller
 
 from .consts import *
-from .notify import Notify
+from .metrics import EVENTS, RULES_SECONDS
+from .notify import Notify, unique_addresses
+from .registry import Registry
 
 logger = logging.getLogger(__name__)
 
+# The handlers to run for each type of event, plugins register theirs with `registry.register`
+registry = Registry()
+
 
 class Rule:
     """Class containing the rules to be executed for each type of event."""
 
-    def __init__(self, env, config, message):
-        """Init the class with the environment, config and message (event) to be checked."""
+    def __init__(self, env, config, message, notify=None):
+        """Init the class with the environment, config and message (event) to be checked.
+
+        The emails are sent using notify, by default a new Notify for the environment.
+        """
         self._env = env
         self._config = config
         self._message = message
-        self._notify = Notify(self._env, self._config)
+        self._notify = notify or Notify(self._env, self._config)
+
+    @property
+    def env(self):
+        """The environment the rules are checked in."""
+        return self._env
+
+    @property
+    def config(self):
+        """The config for the environment."""
+        return self._config
+
+    @property
+    def message(self):
+        """The message (event) being checked."""
+        return self._message
+
+    @property
+    def notify(self):
+        """Used to send the notifications."""
+        return self._notify
 
     def check_rules(self):
         """Check all the rules for the current message (event)."""
-        if self._message.event_type == EVENT_MAN_CREATED:
-            self._on_manifest_create()
-        elif self._message.event_type == EVENT_MAN_RECEIVED:
-            self._on_manifest_received()
-        elif self._message.event_type in [EVENT_WO_DISPATCHED, EVENT_WO_CONCLUDED]:
-            self._on_work_order_event()
-        elif self._message.event_type == EVENT_CAT_NEW:
-            self._on_catalogue_new()
-        elif self._message.event_type == EVENT_CAT_PROCESSED:
-            self._on_catalogue_processed()
-        elif self._message.event_type == EVENT_CAT_REJECTED:
-            self._on_catalogue_rejected()
-        else:
-            pass
+        EVENTS.labels(registry.label(self._message.event_type)).inc()
+        with RULES_SECONDS.time():
+            for handler in registry.handlers(self._message.event_type):
+                handler(self)
 
     def _on_manifest_create(self):
         """Notify once a manifest has been created."""
@@ -49,7 +68,7 @@ class Rule:
 
         # Send an email to the ethics officer
         if self._message.metadata.get('hmdmc'):
-            data['hmdmc_list'] = self._message.metadata['hmdmc']
+            data = dict(data, hmdmc_list=self._message.metadata['hmdmc'])
             subject = "{0} {1}".format(SBJ_MAN_CREATED_HMDMC, self._message.metadata['manifest_id'])
             # Use the same link we have already created for the manifest
             self._notify.send_email(subject=subject,
@@ -148,7 +167,8 @@ class Rule:
         if self._message.metadata.get('deputies'):
             for dep in self._message.metadata['deputies']:
                 to.append(dep)
-        return to, data
+        # The user may also be the custodian or a deputy
+        return unique_addresses(to), data
 
     def _common_work_order(self):
         """Extract the common info for work order events."""
@@ -183,3 +203,13 @@ class Rule:
                                             PATH_WORK_ORDER_BEGIN,
                                             work_plan_id,
                                             PATH_WORK_ORDER_END)
+
+
+# The handlers are looked up on the instance when called so that they can be replaced
+registry.register(EVENT_MAN_CREATED, methodcaller('_on_manifest_create'))
+registry.register(EVENT_MAN_RECEIVED, methodcaller('_on_manifest_received'))
+registry.register(EVENT_WO_DISPATCHED, methodcaller('_on_work_order_event'))
+registry.register(EVENT_WO_CONCLUDED, methodcaller('_on_work_order_event'))
+registry.register(EVENT_CAT_NEW, methodcaller('_on_catalogue_new'))
+registry.register(EVENT_CAT_PROCESSED, methodcaller('_on_catalogue_processed'))
+registry.register(EVENT_CAT_REJECTED, methodcaller('_on_catalogue_rejected'))
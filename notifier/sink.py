@@ -0,0 +1,120 @@
+import logging
+import socketserver
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPSink:
+    """A minimal in-process SMTP server accepting (and counting) every email sent to it.
+
+    Used to benchmark and load test the service without a real mail server. Recipients can be
+    refused with a given reply, to exercise the error handling.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, keep=False):
+        """Init the class and start serving on a background thread.
+
+        Args:
+            host: interface to listen on
+            port: port to listen on, 0 picks a free one
+            keep: keep the emails received (envelope sender, recipients and data)
+        """
+        self._keep = keep
+        self._lock = threading.Lock()
+        self.received = 0
+        self.emails = []
+        # Address -> (code, message) to reply to RCPT TO with
+        self.refused = {}
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05},
+                                        name='smtp-sink',
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def close(self):
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _deliver(self, sender, recipients, data):
+        with self._lock:
+            self.received += 1
+            if self._keep:
+                self.emails.append((sender, recipients, data))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        sink = self.server.sink
+        sender, recipients = None, []
+        self._reply(220, 'smtp-sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            argument = line[4:].strip().decode('utf-8', 'replace')
+            if command in (b'EHLO', b'HELO'):
+                self._reply(250, 'smtp-sink')
+            elif command == b'MAIL':
+                sender, recipients = _address(argument), []
+                self._reply(250, 'OK')
+            elif command == b'RCPT':
+                address = _address(argument)
+                code, message = sink.refused.get(address, (250, 'OK'))
+                if code == 250:
+                    recipients.append(address)
+                self._reply(code, message)
+            elif command == b'DATA':
+                self._reply(354, 'End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in self.rfile:
+                    if line == b'.\r\n':
+                        break
+                    data.append(line[1:] if line.startswith(b'..') else line)
+                sink._deliver(sender, recipients, b''.join(data))
+                self._reply(250, 'OK')
+            elif command in (b'RSET', b'NOOP'):
+                if command == b'RSET':
+                    sender, recipients = None, []
+                self._reply(250, 'OK')
+            elif command == b'QUIT':
+                self._reply(221, 'Bye')
+                return
+            else:
+                self._reply(502, 'Command not implemented')
+
+    def _reply(self, code, message):
+        self.wfile.write('{} {}\r\n'.format(code, message).encode('utf-8'))
+
+
+def _address(argument):
+    """Extract the address from the argument of MAIL FROM:<...> or RCPT TO:<...>."""
+    start, end = argument.find('<'), argument.find('>')
+    if start == -1 or end == -1:
+        return argument.split(':', 1)[-1].strip()
+    return argument[start + 1:end]
@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from smtplib import SMTP, SMTPException
+from .metrics import SMTP_CONNECTIONS_IDLE, SMTP_CONNECTIONS_IN_USE
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPPool:
+    """Keep a bounded pool of open (and authenticated) SMTP connections to a single server.
+
+    While there are idle connections, a background thread closes them once they have been idle
+    for longer than the idle timeout, even if the pool is not used in the meantime.
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, host, port, username=None, password=None, size=1, idle_timeout=60,
+                 smtp_class=SMTP):
+        """Init the pool.
+
+        Args:
+            host: host name of the SMTP server
+            port: port of the SMTP server
+            username: user to login with, no login is done if this is empty
+            password: password to login with
+            size: maximum number of connections open at the same time
+            idle_timeout: seconds after which an unused connection is closed
+            smtp_class: class used to create new connections
+        """
+        self._host = host
+        self._port = port
+        self._username = username
+        self._password = password
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._smtp_class = smtp_class
+        # Idle connections as (smtp, time of last use), the most recently used on the right
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._in_use = 0
+        # Only runs while there are idle connections
+        self._pruner = None
+        self._wakeup = threading.Event()
+
+    @classmethod
+    def for_config(cls, email_config):
+        """Return the pool shared by everyone using the same SMTP server and credentials."""
+        key = (email_config.smtp_host, email_config.smtp_port, email_config.smtp_username)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls(host=email_config.smtp_host,
+                           port=email_config.smtp_port,
+                           username=email_config.smtp_username,
+                           password=email_config.smtp_password,
+                           size=email_config.smtp_pool_size,
+                           idle_timeout=email_config.smtp_idle_timeout)
+                cls._pools[key] = pool
+            return pool
+
+    @classmethod
+    def close_all(cls):
+        """Close every shared pool."""
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    @property
+    def size(self):
+        """The maximum number of connections in the pool."""
+        return self._size
+
+    @property
+    def in_use(self):
+        """The number of connections currently checked out."""
+        return self._in_use
+
+    @property
+    def idle(self):
+        """The number of open connections waiting to be used."""
+        return len(self._idle)
+
+    @contextmanager
+    def connection(self):
+        """Check out a live connection, returning it to the pool once done.
+
+        The connection is discarded instead of returned if an SMTP or socket error is raised while
+        it is in use.
+        """
+        self._slots.acquire()
+        try:
+            smtp = self._checkout()
+            with self._lock:
+                self._in_use += 1
+            SMTP_CONNECTIONS_IN_USE.inc()
+            try:
+                yield smtp
+            except (SMTPException, OSError):
+                self._discard(smtp)
+                raise
+            except BaseException:
+                self._checkin(smtp)
+                raise
+            else:
+                self._checkin(smtp)
+            finally:
+                with self._lock:
+                    self._in_use -= 1
+                SMTP_CONNECTIONS_IN_USE.dec()
+        finally:
+            self._slots.release()
+
+    def prune(self):
+        """Close the connections which have been idle for longer than the idle timeout."""
+        expired = []
+        deadline = time.monotonic() - self._idle_timeout
+        with self._lock:
+            # The oldest connections are on the left
+            while self._idle and self._idle[0][1] < deadline:
+                expired.append(self._idle.popleft()[0])
+        SMTP_CONNECTIONS_IDLE.dec(len(expired))
+        for smtp in expired:
+            logger.debug('Closing idle SMTP connection')
+            self._quit(smtp)
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            idle = [smtp for smtp, _ in self._idle]
+            self._idle.clear()
+        SMTP_CONNECTIONS_IDLE.dec(len(idle))
+        self._wakeup.set()
+        for smtp in idle:
+            self._quit(smtp)
+
+    def _checkout(self):
+        """Return an open connection, reusing an idle one if it still answers a NOOP."""
+        self.prune()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                smtp, _ = self._idle.pop()
+            SMTP_CONNECTIONS_IDLE.dec()
+            if self._is_alive(smtp):
+                return smtp
+            logger.debug('Discarding stale SMTP connection')
+            self._discard(smtp)
+        return self._connect()
+
+    def _checkin(self, smtp):
+        with self._lock:
+            self._idle.append((smtp, time.monotonic()))
+            if self._pruner is None:
+                self._pruner = threading.Thread(target=self._run,
+                                                name='smtp-pool-{}'.format(self._host),
+                                                daemon=True)
+                self._pruner.start()
+        SMTP_CONNECTIONS_IDLE.inc()
+        self.prune()
+
+    def _run(self):
+        # A connection is closed at most half the idle timeout late
+        while True:
+            self._wakeup.wait(self._idle_timeout / 2)
+            self._wakeup.clear()
+            self.prune()
+            with self._lock:
+                if not self._idle:
+                    self._pruner = None
+                    return
+
+    def _connect(self):
+        logger.debug('Opening SMTP connection to {}:{}'.format(self._host, self._port))
+        smtp = self._smtp_class(host=self._host, port=self._port)
+        try:
+            if self._username:
+                smtp.login(user=self._username, password=self._password)
+        except Exception:
+            self._discard(smtp)
+            raise
+        return smtp
+
+    def _discard(self, smtp):
+        try:
+            smtp.close()
+        except Exception:
+            logger.debug('Failed to close SMTP connection', exc_info=True)
+
+    def _quit(self, smtp):
+        try:
+            smtp.quit()
+        except (SMTPException, OSError):
+            self._discard(smtp)
+
+    @staticmethod
+    def _is_alive(smtp):
+        try:
+            code, _ = smtp.noop()
+        except (SMTPException, OSError):
+            return False
+        return code == 250
@@ -0,0 +1,75 @@
+"""Time the startup of the consumer and cache what it reads from files at every start."""
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Record how long each phase of the startup took, from the creation of the timer."""
+
+    def __init__(self, start=None, clock=time.perf_counter):
+        """Init the class.
+
+        Args:
+            start: when the startup began according to clock, by default now
+            clock: returns the current time in seconds
+        """
+        self._clock = clock
+        self._start = self._last = clock() if start is None else start
+        self.phases = OrderedDict()
+
+    @property
+    def elapsed(self):
+        """Seconds since the startup began."""
+        return self._clock() - self._start
+
+    def mark(self, phase):
+        """Record the time spent since the previous phase (or the start) as phase."""
+        now = self._clock()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def summary(self):
+        """Describe the time spent in total and in each phase, e.g. to be logged."""
+        phases = ', '.join('{} {:.1f} ms'.format(phase, seconds * 1000)
+                           for phase, seconds in self.phases.items())
+        return 'Started in {:.1f} ms ({})'.format(self.elapsed * 1000, phases)
+
+
+def load_cached(path, load, cache_path=None):
+    """Return load(stream) for the file at path, cached as JSON at cache_path if given.
+
+    The cache is used as long as the size and modification time of the file are unchanged, so
+    what load returns must be made of JSON types only. A cache which can not be read or written
+    is logged and otherwise ignored.
+    """
+    stat = os.stat(path)
+    key = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+    if cache_path:
+        try:
+            with open(cache_path) as stream:
+                cached = json.load(stream)
+            if cached['key'] == key:
+                return cached['value']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning('Ignoring the startup cache {}'.format(cache_path), exc_info=True)
+
+    with open(path) as stream:
+        value = load(stream)
+
+    if cache_path:
+        try:
+            # Written next to the cache and renamed, so that a worker never reads half of it
+            temporary = '{}.{}'.format(cache_path, os.getpid())
+            with open(temporary, 'w') as stream:
+                json.dump({'key': key, 'value': value}, stream)
+            os.replace(temporary, cache_path)
+        except (OSError, TypeError, ValueError):
+            logger.warning('Could not write the startup cache {}'.format(cache_path), exc_info=True)
+    return value
@@ -0,0 +1,107 @@
+"""Build synthetic events with the shapes the rules expect, for benchmarks and load tests."""
+import json
+import random
+import uuid
+from datetime import datetime, timezone
+from .consts import *
+
+
+def _manifest_created(n, rng):
+    return EVENT_MAN_CREATED, {'manifest_id': n,
+                               'sample_custodian': 'custodian{}@sanger.ac.uk'.format(n % 50),
+                               'deputies': ['deputy{}@sanger.ac.uk'.format(n % 7)]}
+
+
+def _manifest_created_hmdmc(n, rng):
+    event_type, metadata = _manifest_created(n, rng)
+    metadata['hmdmc'] = ['17/{:03d}'.format(rng.randint(0, 999))]
+    return event_type, metadata
+
+
+def _manifest_received(n, rng):
+    return EVENT_MAN_RECEIVED, {'manifest_id': n,
+                                'barcode': 'AKER-{}'.format(n),
+                                'created_at': '2018-03-20T10:01:02.000Z',
+                                'sample_custodian': 'custodian{}@sanger.ac.uk'.format(n % 50),
+                                'deputies': [],
+                                'all_received': rng.random() < 0.2}
+
+
+def _work_order_dispatched(n, rng):
+    return EVENT_WO_DISPATCHED, {'work_order_id': n}
+
+
+def _work_order_concluded(n, rng):
+    return EVENT_WO_CONCLUDED, {'work_order_id': n}
+
+
+def _catalogue_new(n, rng):
+    return EVENT_CAT_NEW, {}
+
+
+def _catalogue_processed(n, rng):
+    return EVENT_CAT_PROCESSED, {}
+
+
+def _catalogue_rejected(n, rng):
+    return EVENT_CAT_REJECTED, {'error': 'Invalid catalogue {}'.format(n)}
+
+
+# The kinds of events which can be generated, with the default weight of each in a mix
+KINDS = {
+    'manifest_created': (_manifest_created, 20),
+    'manifest_created_hmdmc': (_manifest_created_hmdmc, 5),
+    'manifest_received': (_manifest_received, 40),
+    'work_order_dispatched': (_work_order_dispatched, 15),
+    'work_order_concluded': (_work_order_concluded, 15),
+    'catalogue_new': (_catalogue_new, 2),
+    'catalogue_processed': (_catalogue_processed, 2),
+    'catalogue_rejected': (_catalogue_rejected, 1),
+}
+
+
+def parse_mix(mix):
+    """Parse a mix such as 'manifest_received=3,catalogue_new=1' into {kind: weight}.
+
+    An empty mix returns the default weights.
+    """
+    if not mix:
+        return {kind: weight for kind, (_, weight) in KINDS.items()}
+    weights = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError('Unknown kind of event: {!r}'.format(kind))
+        weights[kind] = float(weight) if weight else 1.0
+    return weights
+
+
+def event(kind, n, rng=random):
+    """Return the JSON body (as bytes) of a synthetic event of the given kind."""
+    build, _ = KINDS[kind]
+    event_type, metadata = build(n, rng)
+    return json.dumps({
+        'event_type': event_type,
+        'lims_id': 'aker',
+        'uuid': str(uuid.UUID(int=rng.getrandbits(128))),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'user_identifier': 'user{}@sanger.ac.uk'.format(n % 100),
+        'roles': [],
+        'metadata': metadata,
+        'notifier_info': {'work_plan_id': n, 'drs_study_code': 1000 + n % 10},
+    }).encode('utf-8')
+
+
+def events(weights, count, seed=None):
+    """Yield (kind, body) for count synthetic events mixed according to the weights."""
+    rng = random.Random(seed)
+    kinds = list(weights)
+    cumulative = []
+    total = 0
+    for kind in kinds:
+        total += weights[kind]
+        cumulative.append(total)
+    for n in range(1, count + 1):
+        kind = rng.choices(kinds, cum_weights=cumulative)[0]
+        yield kind, event(kind, n, rng)
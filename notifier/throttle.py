@@ -0,0 +1,227 @@
+"""Pace the emails sent to the SMTP relay, per relay and per recipient domain.
+
+The rates adapt to the relay (additive increase, multiplicative decrease): a 421 or 451 reply
+cuts the rate, and every email accepted afterwards gives some of it back, up to the configured
+rate. The relay keeps accepting emails at close to the highest rate it allows, instead of
+throttling a burst and failing what follows.
+"""
+import logging
+import threading
+import time
+from .metrics import THROTTLE_RELAY_RATE, THROTTLE_SLOW_DOWNS, THROTTLE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Replies of a relay asking to slow down: service not available (421) and local error in
+# processing (451), e.g. "4.7.0 Too many messages, try again later"
+SLOW_DOWN_CODES = (421, 451)
+
+
+class TokenBucket:
+    """Allow `rate` units per second on average, in bursts of up to `burst` units.
+
+    The units are reserved up front, so that the callers sharing the bucket wait their turn in
+    order. A request for more than the burst is allowed, once the bucket is full, and is paid
+    back by the requests which follow.
+    """
+
+    def __init__(self, rate, burst=0, decrease=0.5, increase=0.05, min_fraction=0.05,
+                 cooldown=1.0, clock=time.monotonic):
+        """Init the bucket, full.
+
+        Args:
+            rate: units per second at most
+            burst: units which can be taken at once, by default a second worth of the rate
+            decrease: the rate is multiplied by this when slowing down
+            increase: fraction of the configured rate given back when speeding up
+            min_fraction: fraction of the configured rate the bucket never slows down below
+            cooldown: seconds after slowing down during which it does not slow down again, the
+                replies to the emails already on their way are not a sign to slow down further
+            clock: returns the current time in seconds
+        """
+        self._max_rate = rate
+        self._rate = rate
+        self._burst = burst or max(rate, 1)
+        self._decrease = decrease
+        self._increase = increase
+        self._min_rate = rate * min_fraction
+        self._cooldown = cooldown
+        self._clock = clock
+        self._tokens = self._burst
+        self._updated = clock()
+        self._slowed_down = None
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """The current rate, in units per second."""
+        return self._rate
+
+    def reserve(self, amount=1):
+        """Take amount units, returning the number of seconds to wait before using them."""
+        with self._lock:
+            self._refill()
+            wait = max(0.0, min(amount, self._burst) - self._tokens) / self._rate
+            self._tokens -= amount
+        return wait
+
+    def slow_down(self):
+        """Decrease the rate, returning whether it did (it does not during the cooldown)."""
+        with self._lock:
+            now = self._clock()
+            if self._slowed_down is not None and now - self._slowed_down < self._cooldown:
+                return False
+            self._refill()
+            self._slowed_down = now
+            self._rate = max(self._min_rate, self._rate * self._decrease)
+            # No more bursts until the bucket refills at the new rate
+            self._tokens = min(self._tokens, 0)
+        return True
+
+    def speed_up(self):
+        """Increase the rate, up to the configured one."""
+        with self._lock:
+            if self._rate < self._max_rate:
+                self._refill()
+                self._rate = min(self._max_rate, self._rate + self._max_rate * self._increase)
+
+    def _refill(self):
+        """Add the units earned since the last update, the lock must be held."""
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class Throttle:
+    """Pace the emails sent through a relay: the relay counts SMTP transactions and each
+    recipient domain counts recipients, in buckets of their own.
+    """
+
+    _throttles = {}
+    _throttles_lock = threading.Lock()
+
+    def __init__(self, throttle_config, name='smtp', clock=time.monotonic, sleep=time.sleep):
+        """Init the class.
+
+        Args:
+            throttle_config: the rates of the relay and of the domains, 0 for no limit
+            name: the name of the relay in the logs
+            clock: returns the current time in seconds
+            sleep: waits for a number of seconds
+        """
+        self._config = throttle_config
+        self._name = name
+        self._clock = clock
+        self._sleep = sleep
+        self._relay = self._bucket(throttle_config.relay_rate, throttle_config.relay_burst)
+        # Domain -> TokenBucket, None for the domains without a limit
+        self._domains = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_config(cls, email_config, throttle_config):
+        """Return the throttle shared by everyone sending through the same relay."""
+        key = (email_config.smtp_host, email_config.smtp_port)
+        with cls._throttles_lock:
+            throttle = cls._throttles.get(key)
+            if throttle is None:
+                throttle = cls(throttle_config, name='{}:{}'.format(*key))
+                cls._throttles[key] = throttle
+            return throttle
+
+    @property
+    def relay_rate(self):
+        """The current rate of the relay in transactions per second, None for no limit."""
+        return self._relay.rate if self._relay else None
+
+    def domain_rate(self, domain):
+        """The current rate of the domain in recipients per second, None for no limit."""
+        bucket = self._domain(domain)
+        return bucket.rate if bucket else None
+
+    def reserve(self, transactions):
+        """Reserve the sending of the transactions (lists of recipients), returning the number
+        of seconds to wait before sending them.
+        """
+        waits = [0.0]
+        if self._relay:
+            waits.append(self._relay.reserve(len(transactions)))
+        counts = {}
+        for recipients in transactions:
+            for address in recipients:
+                domain = _domain(address)
+                counts[domain] = counts.get(domain, 0) + 1
+        for domain, count in counts.items():
+            bucket = self._domain(domain)
+            if bucket:
+                waits.append(bucket.reserve(count))
+        return max(waits)
+
+    def acquire(self, transactions):
+        """Wait until the transactions (lists of recipients) can be sent."""
+        wait = self.reserve(transactions)
+        THROTTLE_WAIT_SECONDS.observe(wait)
+        if wait:
+            logger.debug('Waiting {:.3f}s for the SMTP send rate'.format(wait))
+            self._sleep(wait)
+
+    def sent(self, recipients, refused):
+        """Adapt the rates to the outcome of a transaction.
+
+        Args:
+            recipients: the recipients of the transaction
+            refused: the recipients refused, {address: (code, message)}
+        """
+        accepted = [address for address in recipients if address not in refused]
+        if accepted:
+            if self._relay:
+                self._relay.speed_up()
+                THROTTLE_RELAY_RATE.set(self._relay.rate)
+            for domain in {_domain(address) for address in accepted}:
+                bucket = self._domain(domain)
+                if bucket:
+                    bucket.speed_up()
+        codes = {}
+        for address, (code, _) in refused.items():
+            codes.setdefault(_domain(address), set()).add(code)
+        for domain, domain_codes in sorted(codes.items()):
+            if domain_codes & set(SLOW_DOWN_CODES):
+                self._slow_down('domain', domain, self._domain(domain))
+            if 421 in domain_codes:
+                self._slow_down('relay', self._name, self._relay)
+
+    def failed(self, error):
+        """Adapt the rates to a transaction which failed with error, e.g. SMTPSenderRefused."""
+        # smtplib names the reply code smtp_code, aiosmtplib code
+        code = getattr(error, 'smtp_code', getattr(error, 'code', None))
+        if code in SLOW_DOWN_CODES:
+            self._slow_down('relay', self._name, self._relay)
+
+    def _slow_down(self, scope, name, bucket):
+        if bucket and bucket.slow_down():
+            THROTTLE_SLOW_DOWNS.labels(scope).inc()
+            if bucket is self._relay:
+                THROTTLE_RELAY_RATE.set(bucket.rate)
+            logger.warning('Slowing down {} {} to {:.2f}/s after the SMTP relay pushed '
+                           'back'.format(scope, name, bucket.rate))
+
+    def _domain(self, domain):
+        """Return the bucket of the domain, None if it has no limit."""
+        try:
+            return self._domains[domain]
+        except KeyError:
+            rate, burst = self._config.domains.get(
+                domain, (self._config.domain_rate, self._config.domain_burst))
+            with self._lock:
+                return self._domains.setdefault(domain, self._bucket(rate, burst))
+
+    def _bucket(self, rate, burst):
+        if not rate:
+            return None
+        return TokenBucket(rate, burst, decrease=self._config.decrease,
+                           increase=self._config.increase, min_fraction=self._config.min_fraction,
+                           clock=self._clock)
+
+
+def _domain(address):
+    return address.rpartition('@')[2].lower()
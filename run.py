@@ -2,34 +2,50 @@
 """Subscribes to an events_notifications queue and sends notifications when receiving messages."""
 
 import argparse
-import json
 import logging
 import logging.config
 import os
-import pika
+import queue
 import sys
+import time
 import traceback
-import yaml
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from contextlib import closing
-from daemon import DaemonContext, pidfile
 from functools import partial
-from notifier import consts
-from notifier import Config, Message, Notify, Rule
+from notifier import consts, metrics
+from notifier.alerts import Alerts
+from notifier.channels import Channels
+from notifier.config import Config
+from notifier.idempotency import Idempotent, SentCache
+from notifier.lanes import ALERTS, DEFAULT, LaneQueue, Lanes
+from notifier.message import Message
+from notifier.notify import Email, EmailCollector, Notify, RenderCache
+from notifier.render import Renderer
+from notifier.retry import backoff
+from notifier.rule import Rule, registry as rule_registry
+from notifier.startup import StartupTimer, load_cached
 
 logger = logging.getLogger(__name__)
 
 
-def configure_logging(env):
+def load_logging_config(stream):
+    """Parse the YAML logging config, yaml is only imported when the config is not cached."""
+    import yaml
+    try:
+        return yaml.safe_load(stream)
+    except yaml.YAMLError as e:
+        print(e)
+
+
+def configure_logging(env, cache_path=None):
+    """Configure logging for the environment, keeping the parsed config at cache_path if given."""
     logging_config_path = '{!s}/{!s}/logging_{!s}.yml'.format(
         os.path.dirname(os.path.realpath(__file__)),
         consts.PATH_CONFIG,
         env)
-    with open(logging_config_path) as stream:
-        try:
-            config_file = yaml.load(stream)
-            logging.config.dictConfig(config_file)
-        except yaml.YAMLError as e:
-            print(e)
+    config_file = load_cached(logging_config_path, load_logging_config, cache_path)
+    if config_file is not None:
+        logging.config.dictConfig(config_file)
 
     if env in (consts.ENV_DEV, consts.ENV_TEST):
         logger.setLevel('DEBUG')
@@ -37,56 +53,558 @@ def configure_logging(env):
         logger.setLevel('INFO')
 
 
-def on_message(channel, method_frame, header_frame, body, env, config):
+def process_message(body, env, config, notify=None, sent=None, channels=None):
+    """Check the rules for the message (event), raising if it could not be processed.
+
+    The emails are sent using notify, by default a new Notify for the environment. If the
+    SentCache sent is given, the emails already sent for the event are skipped. If channels are
+    given, the notifications are sent to the channels routed to for the event type.
+    """
+    # The JSON is parsed straight from the bytes of the body
+    with metrics.PARSE_SECONDS.time():
+        message = Message.from_json(body)
+    notify = notify or Notify(env, config)
+    if channels is not None:
+        notify = channels.notify(message.event_type, notify)
+    # Outside of the channels, so that a redelivered event is not sent to them again either
+    if sent is not None and message.uuid:
+        notify = Idempotent(notify, sent, message.uuid)
+    rule = Rule(env=env, config=config, message=message, notify=notify)
+    rule.check_rules()
+
+
+def dev_email(subject, body, trace, config):
+    """Build the email notifying the devs that a message failed."""
+    return Email(subject=subject,
+                 from_address=config.email.from_address,
+                 to=[config.contact.email_dev_team],
+                 template='notification_dev',
+                 data={'message': body, 'traceback': trace})
+
+
+def notify_devs(subject, body, trace, env, config):
+    """Notify the devs that a message failed."""
+    notify = Notify(env, config)
+    notify.send_email(*dev_email(subject, body, trace, config))
+
+
+def send_now(notify, email):
+    """Send the email straight away."""
+    notify.send_email(*email)
+
+
+def send_dispatched(dispatcher, email):
+    """Send the email from one of the workers of the dispatcher, ahead of the bulk emails.
+
+    The queue of the dispatcher only has room for the deliveries (see check_dispatch), the email
+    is dropped rather than blocking the consumer thread when it is full.
+    """
+    try:
+        dispatcher.submit(None, None, [email], lane=ALERTS, block=False)
+    except queue.Full:
+        logger.error('Dropping email {!r}, the dispatcher queue is full'.format(email.subject))
+
+
+def check_dispatch(config, lanes):
+    """Raise ValueError if the deliveries the broker may send at once do not fit in the queue of
+    the dispatcher, handing them over would then block the consumer thread and its heartbeats.
+
+    Batches are not dispatched, a batch_size above 1 is rejected rather than ignored.
+    """
+    if not config.dispatch.workers:
+        return
+    if config.broker.batch_size > 1:
+        raise ValueError('The broker batch_size ({}) can not be used with dispatch workers ({}), '
+                         'set one of them to 1 or 0'.format(config.broker.batch_size,
+                                                             config.dispatch.workers))
+    # Each consumer gets its own prefetch window
+    consumers = 1 + (len(lanes.queues) if lanes else 0)
+    if not config.broker.prefetch_count or \
+            config.dispatch.queue_size < config.broker.prefetch_count * consumers:
+        raise ValueError('The dispatch queue_size ({}) must be at least the prefetch_count ({}) '
+                         'of each of the {} consumers'.format(config.dispatch.queue_size,
+                                                              config.broker.prefetch_count,
+                                                              consumers))
+
+
+def is_connection_error(error):
+    """Whether error comes from the connection to the broker, e.g. it was closed while waiting
+    for the emails of a message.
+    """
+    # Only imported by consume, see there
+    import pika
+    return isinstance(error, pika.exceptions.AMQPError)
+
+
+def call_now(func, *args, **kwargs):
+    """Call func from this thread."""
+    return func(*args, **kwargs)
+
+
+def call_in_thread(executor, connection, poll_interval, func, *args, **kwargs):
+    """Call func from the thread of the executor and return (or raise) what it does.
+
+    The events of the connection, e.g. heartbeats, are processed every poll_interval seconds
+    until func returns, so that a slow SMTP server does not get the connection closed by the
+    broker. The consumer callbacks are not called again while waiting, pika does not nest them.
+    """
+    future = executor.submit(func, *args, **kwargs)
+    while True:
+        try:
+            return future.result(timeout=poll_interval)
+        except FutureTimeoutError:
+            connection.process_data_events(time_limit=0)
+
+
+def on_message(channel, method_frame, header_frame, body, env, config, notify=None, alerts=None,
+               sent=None, channels=None, offload=call_now):
     """Check the rules for the message (event) and acknowledge (or nack) if the message has been
     processed or not.
+
+    The devs are notified about failures through alerts, or with an email per failure if None.
+    The message is processed, and the devs notified, through offload, e.g. call_in_thread.
     """
-    notify = Notify(env, config)
+    on_failure = partial(offload,
+                         alerts.failure if alerts else partial(notify_devs, env=env, config=config))
+    metrics.IN_FLIGHT.inc()
     try:
         logger.info('Processing message: {!s}'.format(method_frame.delivery_tag))
         logger.debug('Message body: {!s}'.format(body))
-        # We need to decode the body to be able to read the JSON
-        decoded_body = body.decode('utf-8')
-        message = Message.from_json(decoded_body)
-        rule = Rule(env=env, config=config, message=message)
-        rule.check_rules()
+        offload(process_message, body, env, config, notify=notify, sent=sent, channels=channels)
         channel.basic_ack(delivery_tag=method_frame.delivery_tag)
-    except Exception:
+        metrics.ACKS.inc()
+    except Exception as e:
+        if is_connection_error(e):
+            # The message did not fail, consume reconnects and it is redelivered
+            raise
         traceback.print_exc(file=sys.stderr)
         try:
             # Nack the message and try to requeue it
             channel.basic_nack(delivery_tag=method_frame.delivery_tag, requeue=False)
+            metrics.NACKS.inc()
 
             logger.exception('Error processing message. Not acknowledging.')
 
             # Notify the devs that a message failed
-            notify.send_email(subject=consts.SBJ_MSG_FAILED,
-                              to=[config.contact.email_dev_team],
-                              from_address=config.email.from_address,
-                              template='notification_dev',
-                              data={'message': body, 'traceback': traceback.format_exc()})
+            on_failure(consts.SBJ_MSG_FAILED, body, traceback.format_exc())
         except Exception:
             traceback.print_exc(file=sys.stderr)
             logger.exception('Failed to nack message.')
 
             # Notify devs that nack failed
-            notify.send_email(subject=consts.SBJ_NACK_FAILED,
-                              to=[config.contact.email_dev_team],
-                              from_address=config.email.from_address,
-                              template='notification_dev',
-                              data={'message': body, 'traceback': traceback.format_exc()})
+            on_failure(consts.SBJ_NACK_FAILED, body, traceback.format_exc())
+    finally:
+        metrics.IN_FLIGHT.dec()
+
+
+def on_message_batch(channel, method_frame, header_frame, body, batch):
+    """Add the message (event) to the batch, which is processed and settled once full or after
+    its timeout.
+    """
+    logger.debug('Batching message: {!s}'.format(method_frame.delivery_tag))
+    batch.add(method_frame.delivery_tag, body)
+
+
+def on_message_dispatch(channel, method_frame, header_frame, body, env, config, dispatcher,
+                        alerts=None, sent=None, channels=None, lane=DEFAULT):
+    """Check the rules for the message (event) and hand its emails over to the dispatcher, in the
+    lane of the message. The message is acknowledged (or nacked) by `settle_dispatched` once the
+    emails have been sent.
+    """
+    logger.info('Processing message: {!s}'.format(method_frame.delivery_tag))
+    logger.debug('Message body: {!s}'.format(body))
+    metrics.IN_FLIGHT.inc()
+    collector = EmailCollector()
+    try:
+        process_message(body, env, config, notify=collector, sent=sent, channels=channels)
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        logger.exception('Error processing message. Not acknowledging.')
+        metrics.IN_FLIGHT.dec()
+        channel.basic_nack(delivery_tag=method_frame.delivery_tag, requeue=False)
+        metrics.NACKS.inc()
+        alert_devs(consts.SBJ_MSG_FAILED, body, traceback.format_exc(), config, dispatcher,
+                   alerts)
+    else:
+        dispatcher.submit(method_frame.delivery_tag, body, collector.emails, lane=lane,
+                          on_sent=collector.on_sent)
+
+
+def alert_devs(subject, body, trace, config, dispatcher, alerts=None):
+    """Notify the devs that a dispatched message failed, through alerts if given."""
+    if alerts:
+        alerts.failure(subject, body, trace)
+    else:
+        send_dispatched(dispatcher, dev_email(subject, body, trace, config))
+
+
+def settle_dispatched(channel, dispatcher, config, alerts=None):
+    """Acknowledge (or nack) the messages whose emails have been handled by the dispatcher."""
+    for delivery_tag, body, trace in dispatcher.completed():
+        metrics.IN_FLIGHT.dec()
+        if trace is None:
+            channel.basic_ack(delivery_tag=delivery_tag)
+            metrics.ACKS.inc()
+            continue
+        try:
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            metrics.NACKS.inc()
+            logger.error('Error sending emails for message {!s}. Not acknowledging.'.format(
+                delivery_tag))
+            alert_devs(consts.SBJ_MSG_FAILED, body, trace, config, dispatcher, alerts)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            logger.exception('Failed to nack message.')
+            alert_devs(consts.SBJ_NACK_FAILED, body, traceback.format_exc(), config, dispatcher,
+                       alerts)
+
+
+def on_message_lane(channel, method_frame, header_frame, body, lanes, pending, handles,
+                    lane=None):
+    """Put the message (event) in its lane, to be handled by `consume_lanes` in turn.
+
+    Args:
+        lanes: the Lanes the message is routed to, by its routing key (the event type)
+        pending: the LaneQueue of the messages waiting to be handled
+        handles: {lane: consumer callback handling the messages of the lane}
+        lane: the lane of the message if known, e.g. consumed from the queue of the lane
+    """
+    lane = lane or lanes.for_event(method_frame.routing_key)
+    logger.debug('Queueing message {!s} in lane {}'.format(method_frame.delivery_tag, lane))
+    pending.put(lane, partial(handles[lane], channel, method_frame, header_frame, body))
+
+
+def consume_lanes(connection, channel, pending, poll_interval, settle=None):
+    """Consume messages, handling those received (see `on_message_lane`) in the order of their
+    lanes. settle is called in between, e.g. to settle the messages handled by a dispatcher.
+
+    Returns once the channel has no consumers left, e.g. cancelled by the broker, the messages
+    still pending are then redelivered once the channel is closed.
+    """
+    while channel.consumer_tags:
+        connection.process_data_events(time_limit=0 if len(pending) else poll_interval)
+        if settle:
+            settle()
+        try:
+            _, handle = pending.get(block=False)
+        except queue.Empty:
+            continue
+        handle()
+
+
+def consume_dispatched(connection, channel, dispatcher, config, alerts=None):
+    """Consume messages, settling those handled by the dispatcher in between the broker events.
+
+    Returns once the channel has no consumers left, e.g. cancelled by the broker.
+    """
+    while channel.consumer_tags:
+        connection.process_data_events(time_limit=config.dispatch.poll_interval_ms / 1000)
+        settle_dispatched(channel, dispatcher, config, alerts)
+
+
+def listen(connection, env, config, notify, sent, channels, lanes, executor, consumer_tag,
+           on_listening):
+    """Consume messages on the connection until it is closed or the consumer is stopped.
+
+    Args:
+        connection: the BlockingConnection to the broker
+        env: the environment
+        config: the config for the environment
+        notify: used to send the emails
+        sent: the SentCache of the emails already sent, if any
+        channels: the Channels the notifications are routed to
+        lanes: the Lanes of the messages, None to handle them in the order they are received
+        executor: the single thread executor the emails are sent from, unless dispatched
+        consumer_tag: the tag of the consumer
+        on_listening: called once the consumer has been registered
+    """
+    channel = connection.channel()
+    if config.broker.prefetch_count:
+        channel.basic_qos(prefetch_count=config.broker.prefetch_count)
+
+    # The connection keeps processing heartbeats while the emails are sent
+    poll_interval = config.dispatch.poll_interval_ms / 1000
+    offload = partial(call_in_thread, executor, connection, poll_interval)
+
+    dispatcher = None
+    if config.dispatch.workers:
+        # Emails are sent by the workers while this thread keeps talking to the broker
+        from notifier.dispatch import Dispatcher
+        dispatcher = Dispatcher(notify=notify,
+                                workers=config.dispatch.workers,
+                                queue_size=config.dispatch.queue_size,
+                                lanes=lanes.weights if lanes else None)
+        send_alert = partial(send_dispatched, dispatcher)
+    else:
+        # The alerts are never held back in a digest
+        send_alert = partial(send_now, Notify(env, config))
+    alerts = Alerts(send=send_alert,
+                    config=config,
+                    threshold=config.alerts.threshold,
+                    window=config.alerts.window_seconds,
+                    cooldown=config.alerts.cooldown_seconds)
+
+    def handler(lane=DEFAULT):
+        """Return the consumer callback handling the messages of the lane."""
+        if dispatcher:
+            return partial(on_message_dispatch, env=env, config=config, dispatcher=dispatcher,
+                           alerts=alerts, sent=sent, channels=channels, lane=lane)
+        return partial(on_message, env=env, config=config, notify=notify, alerts=alerts,
+                       sent=sent, channels=channels, offload=offload)
+
+    pending = None
+    if config.broker.batch_size > 1 and not dispatcher:
+        # The batches are settled in the order they are received, without lanes
+        from notifier.batch import Batch
+        batch = Batch(connection=connection,
+                      channel=channel,
+                      process=partial(offload, partial(process_message, env=env, config=config,
+                                                       notify=notify, sent=sent,
+                                                       channels=channels)),
+                      on_failure=partial(offload, alerts.failure),
+                      size=config.broker.batch_size,
+                      timeout=config.broker.batch_timeout_ms / 1000)
+        on_message_partial = partial(on_message_batch, batch=batch)
+    elif lanes:
+        pending = LaneQueue(lanes.weights)
+        on_message_partial = partial(on_message_lane, lanes=lanes, pending=pending,
+                                     handles={lane: handler(lane) for lane in lanes.weights})
+    else:
+        on_message_partial = handler()
+
+    try:
+        # Exchanges and queues are created using configuration and not at run-time
+        # Configure a basic consumer
+        channel.basic_consume(consumer_callback=on_message_partial,
+                              queue=config.broker.queue,
+                              consumer_tag=consumer_tag)
+        if pending is not None:
+            # Each consumer gets its own prefetch window, so the events of a lane with a queue
+            # of its own are received even while the main queue has a backlog
+            for lane, queue_name in lanes.queues:
+                channel.basic_consume(consumer_callback=partial(on_message_partial, lane=lane),
+                                      queue=queue_name,
+                                      consumer_tag='{}-{}'.format(consumer_tag, lane))
+                logger.info('Listening on queue: {!s} for lane {}...'.format(queue_name, lane))
+        on_listening()
+        logger.info('Listening on queue: {!s}...'.format(config.broker.queue))
+        if pending is not None:
+            settle = partial(settle_dispatched, channel, dispatcher, config, alerts) \
+                if dispatcher else None
+            consume_lanes(connection, channel, pending, poll_interval, settle)
+        elif dispatcher:
+            consume_dispatched(connection, channel, dispatcher, config, alerts)
+        else:
+            channel.start_consuming()
+    finally:
+        if channel.is_open:
+            channel.stop_consuming()
+        # Send the summary of the suppressed alerts before the dispatcher stops
+        alerts.close()
+        if dispatcher:
+            # The deliveries can not be settled once the connection is lost, the broker
+            # redelivers them: the emails still queued are dropped rather than sent twice
+            unsettled = dispatcher.stop(wait=connection.is_open)
+            unsettled += sum(1 for _ in dispatcher.completed())
+            metrics.IN_FLIGHT.dec(unsettled)
+
+
+def consume(env, config, worker=None, timer=None, workers=1):
+    """Connect to the broker and consume messages until stopped, reconnecting with an
+    exponential backoff whenever the connection is lost.
+
+    Args:
+        env: the environment
+        config: the config for the environment
+        worker: the index of the worker process running this consumer, if any
+        timer: the StartupTimer of the process, logged once consuming
+        workers: the number of worker processes consuming, see worker
+    """
+    # Imported here rather than by every user of run.py (e.g. the load test), the optional parts
+    # only if they are configured
+    import pika
+    if timer is None:
+        timer = StartupTimer()
+    timer.mark('imports')
+
+    consumer_tag = 'aker-events-notifier'
+    if worker is not None:
+        consumer_tag = '{}-{}'.format(consumer_tag, worker)
+
+    if config.metrics.port:
+        # Each worker process serves its own metrics, on the ports following the configured one
+        metrics.serve(config.metrics.host, config.metrics.port + (worker or 0))
+
+    credentials = pika.PlainCredentials(config.broker.user, config.broker.password)
+    parameters = pika.ConnectionParameters(
+        host=config.broker.host,
+        port=config.broker.port,
+        virtual_host=config.broker.virtual_host,
+        credentials=credentials,
+        heartbeat=config.broker.heartbeat_seconds,
+        socket_timeout=config.broker.socket_timeout_seconds,
+        blocked_connection_timeout=config.broker.blocked_connection_timeout_seconds)
+
+    sent = None
+    if config.idempotency.size:
+        # The worker processes share the file, so that a worker knows about the emails sent by
+        # all of them, e.g. for the deliveries of a worker which died
+        sent = SentCache(size=config.idempotency.size,
+                         ttl=config.idempotency.ttl_seconds,
+                         path=config.idempotency.path or None,
+                         shared=worker is not None)
+
+    # Slow channels (e.g. a chat webhook) are sent to from their own threads
+    channels = Channels.from_config(config.channels)
+    lanes = Lanes.from_config(config.lanes)
+    check_dispatch(config, lanes)
+
+    notify = Notify(env, config)
+    outbox = None
+    if config.outbox.path:
+        # Deliveries are acknowledged once their emails are stored, each worker process has
+        # its own outbox
+        path = config.outbox.path
+        if worker is not None:
+            path = '{}.{}'.format(path, worker)
+        from notifier.outbox import Outbox, orphaned_paths
+        notify = outbox = Outbox(notify=notify,
+                                 path=path,
+                                 base_delay=config.outbox.base_delay_seconds,
+                                 max_delay=config.outbox.max_delay_seconds,
+                                 max_attempts=config.outbox.max_attempts)
+        if not worker:
+            # The emails left by a previous run with another number of workers would never be
+            # sent otherwise
+            for orphan in orphaned_paths(config.outbox.path, workers):
+                outbox.adopt(orphan)
+    digest = digest_alerts = None
+    if config.digest.window_seconds:
+        from notifier.digest import Digest
+        # The deliveries of the emails held are acknowledged already, the devs are alerted if
+        # their digest can not be sent (or stored in the outbox, which retries it)
+        digest_alerts = Alerts(send=partial(send_now, Notify(env, config)),
+                               config=config,
+                               threshold=config.alerts.threshold,
+                               window=config.alerts.window_seconds,
+                               cooldown=config.alerts.cooldown_seconds)
+        notify = digest = Digest(notify=notify,
+                                 templates=config.digest.templates,
+                                 window=config.digest.window_seconds,
+                                 on_failure=digest_alerts.failure)
+
+    # Sends the emails of the messages one at a time, off the thread of the connection
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    attempts = 0
+
+    def on_listening():
+        nonlocal attempts, timer
+        attempts = 0
+        if timer:
+            timer.mark('consumer')
+            logger.info(timer.summary())
+            timer = None
+
+    try:
+        while True:
+            try:
+                with closing(pika.BlockingConnection(parameters=parameters)) as connection:
+                    if timer:
+                        timer.mark('connect')
+                    listen(connection, env, config, notify, sent, channels, lanes, executor,
+                           consumer_tag, on_listening)
+                logger.warning('The consumer was cancelled by the broker')
+            except pika.exceptions.AMQPError:
+                logger.exception('Lost the connection to the broker')
+            attempts += 1
+            delay = backoff(attempts, config.broker.reconnect_base_delay_seconds,
+                            config.broker.reconnect_max_delay_seconds)
+            logger.info('Reconnecting in {:.1f}s'.format(delay))
+            time.sleep(delay)
+    finally:
+        executor.shutdown()
+        if digest:
+            digest.close()
+            digest_alerts.close()
+        if outbox:
+            outbox.close()
+        if sent is not None:
+            sent.close()
+        channels.stop()
+
+
+def get_env(arg):
+    """Return the environment given on the command line, else by the environment variable, else
+    development. Raises ValueError if it is not a known environment.
+    """
+    env = arg or os.getenv(consts.ENV_VAR_APP, default=consts.ENV_DEV)
+    if env not in (consts.ENV_DEV, consts.ENV_TEST, consts.ENV_STAGING, consts.ENV_PROD):
+        raise ValueError('Unrecognised environment: {!r}'.format(env))
+    return env
+
+
+def replay(argv):
+    """Replay the events of an archive through the rules (see notifier.replay) in the foreground,
+    returning the exit status.
+    """
+    from notifier.message import parse_timestamp
+    from notifier.replay import EventFilter, ReplayNotify, open_archive, replay as replay_events
+
+    parser = argparse.ArgumentParser(
+        prog='run.py replay',
+        description='Send the notifications of the events of an archive again, e.g. after a '
+                    'template bug or an outage of the SMTP server.')
+    parser.add_argument('archive', help='newline delimited JSON events, optionally gzip '
+                                        'compressed, - for stdin')
+    parser.add_argument('--env', help='environment (e.g. development)', default=None)
+    parser.add_argument('--config', help='config file (default: the config of the environment)')
+    parser.add_argument('--event-type', help='event type or pattern to replay (repeatable, '
+                                             'default: all)', action='append', default=[])
+    parser.add_argument('--since', help='replay the events from this time on (ISO 8601, UTC '
+                                        'unless given)', type=parse_timestamp)
+    parser.add_argument('--until', help='replay the events before this time', type=parse_timestamp)
+    parser.add_argument('--recipient', help='address, or @domain, to send to (repeatable, '
+                                            'default: all)', action='append', default=[])
+    parser.add_argument('--dry-run', help='only render the emails', action='store_true')
+    parser.add_argument('--workers', help='events replayed at the same time', type=int, default=1)
+    parser.add_argument('--mmap', help='memory-map the archive (uncompressed only)',
+                        action='store_true')
+    args = parser.parse_args(argv)
+
+    env = get_env(args.env)
+    config_file_path = args.config or '{!s}/{!s}/{!s}.cfg'.format(
+        os.path.dirname(os.path.realpath(__file__)), consts.PATH_CONFIG, env)
+    config = Config(config_file_path)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    Renderer.configure(config.templates)
+    RenderCache.configure(config.templates)
+    rule_registry.load_plugins(config.rules.plugins)
+
+    event_filter = EventFilter(args.event_type, args.since, args.until, args.recipient)
+    notify = ReplayNotify(Notify(env, config), event_filter, dry_run=args.dry_run)
+    with open_archive(args.archive, use_mmap=args.mmap) as bodies:
+        stats = replay_events(bodies, env, config, notify, event_filter, workers=args.workers)
+    logger.info('Replayed {replayed} of {events} events ({failed} failed), {emails} emails '
+                '{}'.format('rendered' if args.dry_run else 'sent', emails=notify.emails, **stats))
+    return 1 if stats['failed'] else 0
 
 
 def main():
+    if sys.argv[1:2] == ['replay']:
+        sys.exit(replay(sys.argv[2:]))
+
+    timer = StartupTimer()
+
     # Extract arguments from the CLI
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     epilog='Run "run.py replay --help" to replay an archive of '
+                                            'events instead.')
     parser.add_argument('env', help='environment (e.g. development)', nargs='?', default=None)
+    parser.add_argument('--workers', help='number of consumer processes', type=int, default=1)
     args = parser.parse_args()
 
-    env = args.env or os.getenv(consts.ENV_VAR_APP, default=consts.ENV_DEV)
-
-    if env not in (consts.ENV_DEV, consts.ENV_TEST, consts.ENV_STAGING, consts.ENV_PROD):
-        raise ValueError('Unrecognised environment: {!r}'.format(env))
+    env = get_env(args.env)
 
     # Get the config for this environment
     config_file_path = '{!s}/{!s}/{!s}.cfg'.format(os.path.dirname(os.path.realpath(__file__)),
@@ -94,37 +612,40 @@ def main():
 
     # Get the config
     config = Config(config_file_path)
+    timer.mark('config')
 
     # Daemonize the script
+    from daemon import DaemonContext, pidfile
     with DaemonContext(
             working_directory=os.getcwd(),
             stdout=open(config.process.stdout_log, 'a'),
             stderr=open(config.process.stderr_log, 'a'),
             pidfile=pidfile.PIDLockFile(config.process.pidfile)):
 
-        configure_logging(env)
+        timer.mark('daemon')
+        configure_logging(env, config.process.startup_cache or None)
+        timer.mark('logging')
 
         logger.info('Using: {!s}'.format(config_file_path))
 
-        on_message_partial = partial(on_message, env=env, config=config)
-
-        credentials = pika.PlainCredentials(config.broker.user, config.broker.password)
-        parameters = pika.ConnectionParameters(host=config.broker.host,
-                                               port=config.broker.port,
-                                               virtual_host=config.broker.virtual_host,
-                                               credentials=credentials)
-        with closing(pika.BlockingConnection(parameters=parameters)) as connection:
-            channel = connection.channel()
-            # Exchanges and queues are created using configuration and not at run-time
-            # Configure a basic consumer
-            channel.basic_consume(consumer_callback=on_message_partial,
-                                  queue=config.broker.queue,
-                                  consumer_tag='aker-events-notifier')
-            try:
-                logger.info('Listening on queue: {!s}...'.format(config.broker.queue))
-                channel.start_consuming()
-            finally:
-                channel.stop_consuming()
+        # Compile all the templates up front, rather than while handling the first messages
+        Renderer.configure(config.templates)
+        RenderCache.configure(config.templates)
+        timer.mark('templates')
+
+        rule_registry.load_plugins(config.rules.plugins)
+        timer.mark('plugins')
+
+        if args.workers > 1:
+            # Each worker consumes the same queue using its own connection and channel, and
+            # logs the time it took to start consuming
+            from notifier.fleet import Fleet
+            logger.info(timer.summary())
+            logger.info('Starting {} workers'.format(args.workers))
+            Fleet(target=partial(consume, env, config, workers=args.workers),
+                  workers=args.workers).run()
+        else:
+            consume(env, config, timer=timer)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+"""Subscribes to an events_notifications queue and sends notifications using asyncio, handling
+several messages at the same time.
+"""
+
+import aio_pika
+import argparse
+import asyncio
+import logging
+import os
+import traceback
+from notifier import consts, metrics
+from notifier import Config, EmailCollector, Message, RenderCache, Renderer, Rule
+from notifier.rule import registry as rule_registry
+from notifier.alerts import Alerts
+from notifier.async_notify import AsyncNotify
+from notifier.channels import Channels
+from notifier.idempotency import Idempotent, SentCache
+from run import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConsumer:
+    """Consume the queue from an asyncio event loop.
+
+    The rules for up to `concurrency` messages are checked, and their emails sent, at the same
+    time. A delivery is only acknowledged once all its emails have been accepted by the SMTP server
+    and its notifications sent to the other channels routed to.
+    """
+
+    def __init__(self, env, config, channels=None):
+        """Init the class with the environment and config for the environment, and the Channels
+        the notifications are routed to (by default those of the config).
+        """
+        self._env = env
+        self._config = config
+        self._notify = AsyncNotify(env, config)
+        self._channels = channels or Channels.from_config(config.channels)
+        self._sent = None
+        if config.idempotency.size:
+            self._sent = SentCache(size=config.idempotency.size,
+                                   ttl=config.idempotency.ttl_seconds,
+                                   path=config.idempotency.path or None)
+        self._semaphore = asyncio.Semaphore(config.asynchronous.concurrency)
+        self._loop = asyncio.get_event_loop()
+        # Alerts sends from the threads it is called from, the emails are sent on the loop
+        self._alerts = Alerts(send=self.send_alert,
+                              config=config,
+                              threshold=config.alerts.threshold,
+                              window=config.alerts.window_seconds,
+                              cooldown=config.alerts.cooldown_seconds)
+
+    async def consume(self):
+        """Connect to the broker and consume messages until cancelled."""
+        connection = await aio_pika.connect_robust(host=self._config.broker.host,
+                                                   port=self._config.broker.port,
+                                                   login=self._config.broker.user,
+                                                   password=self._config.broker.password,
+                                                   virtualhost=self._config.broker.virtual_host)
+        try:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=self._config.broker.prefetch_count or
+                                  self._config.asynchronous.concurrency)
+            # Exchanges and queues are created using configuration and not at run-time
+            queue = await channel.declare_queue(self._config.broker.queue, passive=True)
+            await queue.consume(self.on_message, consumer_tag='aker-events-notifier')
+
+            logger.info('Listening on queue: {!s}...'.format(self._config.broker.queue))
+            # Messages are handled by the consumer callback until we are cancelled
+            await asyncio.Future()
+        finally:
+            await self.close()
+            await connection.close()
+
+    async def close(self):
+        """Send the summary of the failures suppressed, if any, and close the connections to the
+        SMTP server and the channels.
+        """
+        await self._loop.run_in_executor(None, self._alerts.close)
+        await self._notify.close()
+        await self._loop.run_in_executor(None, self._channels.stop)
+        if self._sent is not None:
+            self._sent.close()
+
+    async def on_message(self, message):
+        """Check the rules for the message (event) and acknowledge (or nack) once its emails have
+        been sent.
+        """
+        async with self._semaphore:
+            logger.info('Processing message: {!s}'.format(message.delivery_tag))
+            logger.debug('Message body: {!s}'.format(message.body))
+            metrics.IN_FLIGHT.inc()
+            try:
+                # Nacks (without requeueing) the message if an exception is raised
+                async with message.process(requeue=False):
+                    await self.process_message(message.body)
+                metrics.ACKS.inc()
+            except Exception:
+                metrics.NACKS.inc()
+                logger.exception('Error processing message. Not acknowledging.')
+                await self.alert_devs(consts.SBJ_MSG_FAILED, message.body, traceback.format_exc())
+            finally:
+                metrics.IN_FLIGHT.dec()
+
+    async def process_message(self, body):
+        """Check the rules for the message (event) and send the resulting emails, skipping those
+        already sent for the event as run.process_message does.
+        """
+        with metrics.PARSE_SECONDS.time():
+            message = Message.from_json(body)
+        collector = EmailCollector()
+        routed = self._channels.notify(message.event_type, collector)
+        notify = routed
+        if self._sent is not None and message.uuid:
+            notify = Idempotent(routed, self._sent, message.uuid)
+        rule = Rule(env=self._env, config=self._config, message=message, notify=notify)
+        rule.check_rules()
+        # Raises if a notification could not be sent to one of the other channels
+        futures = [asyncio.wrap_future(future) for future in getattr(routed, 'futures', ())]
+        await asyncio.gather(self._notify.send_emails(collector.emails, collector.on_sent),
+                             *futures)
+
+    async def alert_devs(self, subject, body, trace):
+        """Notify the devs that a message failed, through Alerts so that a burst of failures is
+        sent as a single summary.
+        """
+        await self._loop.run_in_executor(None, self._alerts.failure, subject, body, trace)
+
+    def send_alert(self, email):
+        """Send the email from the loop, waiting for it from another thread."""
+        asyncio.run_coroutine_threadsafe(self._notify.send_email(*email), self._loop).result()
+
+
+def main():
+    # Extract arguments from the CLI
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('env', help='environment (e.g. development)', nargs='?', default=None)
+    args = parser.parse_args()
+
+    env = args.env or os.getenv(consts.ENV_VAR_APP, default=consts.ENV_DEV)
+
+    if env not in (consts.ENV_DEV, consts.ENV_TEST, consts.ENV_STAGING, consts.ENV_PROD):
+        raise ValueError('Unrecognised environment: {!r}'.format(env))
+
+    # Get the config for this environment
+    config_file_path = '{!s}/{!s}/{!s}.cfg'.format(os.path.dirname(os.path.realpath(__file__)),
+                                                   consts.PATH_CONFIG, env)
+    config = Config(config_file_path)
+
+    configure_logging(env)
+    logger.info('Using: {!s}'.format(config_file_path))
+
+    # Compile all the templates up front, rather than while handling the first messages
+    Renderer.configure(config.templates)
+    RenderCache.configure(config.templates)
+
+    rule_registry.load_plugins(config.rules.plugins)
+
+    if config.metrics.port:
+        metrics.serve(config.metrics.host, config.metrics.port)
+
+    loop = asyncio.get_event_loop()
+    consumer = AsyncConsumer(env, config)
+    try:
+        loop.run_until_complete(consumer.consume())
+    except KeyboardInterrupt:
+        logger.info('Stopping')
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
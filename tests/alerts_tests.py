@@ -0,0 +1,122 @@
+import json
+import unittest
+from mock import Mock
+from notifier.alerts import Alerts
+from notifier.consts import *
+from notifier.render import Renderer
+from tests.helper import config
+
+TRACE = '''Traceback (most recent call last):
+  File "run.py", line 1, in process_message
+KeyError: 'manifest_id'
+'''
+
+
+def body(event_type):
+    return json.dumps({'event_type': event_type}).encode('utf-8')
+
+
+class AlertsTests(unittest.TestCase):
+
+    def create_alerts(self, threshold=3, cooldown=300):
+        self.send = Mock()
+        alerts = Alerts(send=self.send, config=config, threshold=threshold, window=60,
+                        cooldown=cooldown, poll_interval=60)
+        self.addCleanup(alerts.close)
+        return alerts
+
+    def test_failures_below_the_threshold_are_sent(self):
+        alerts = self.create_alerts()
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        alerts.failure(SBJ_NACK_FAILED, body(EVENT_MAN_CREATED), TRACE)
+
+        self.assertEqual(self.send.call_count, 2)
+        email = self.send.call_args_list[0][0][0]
+        self.assertEqual(email.subject, SBJ_MSG_FAILED)
+        self.assertEqual(email.to, [config.contact.email_dev_team])
+        self.assertEqual(email.template, 'notification_dev')
+        self.assertEqual(email.data, {'message': body(EVENT_MAN_CREATED), 'traceback': TRACE})
+        self.assertFalse(alerts.is_open)
+
+    def test_circuit_opens_at_the_threshold(self):
+        alerts = self.create_alerts()
+        for _ in range(5):
+            alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+
+        self.assertEqual(self.send.call_count, 2)
+        self.assertTrue(alerts.is_open)
+        self.assertEqual(alerts.suppressed, 3)
+
+    def test_circuit_opens_when_an_alert_can_not_be_sent(self):
+        alerts = self.create_alerts()
+        self.send.side_effect = ConnectionRefusedError()
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+
+        self.send.assert_called_once()
+        self.assertTrue(alerts.is_open)
+        self.assertEqual(alerts.suppressed, 2)
+
+    def test_summary_is_sent_after_the_cooldown(self):
+        alerts = self.create_alerts(threshold=1, cooldown=0)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_WO_DISPATCHED), TRACE)
+        alerts.failure(SBJ_MSG_FAILED, b'not json', 'ValueError: bad\n')
+        self.send.assert_not_called()
+
+        alerts.check()
+
+        email = self.send.call_args[0][0]
+        self.assertEqual(email.subject, SBJ_MSG_FAILED_SUMMARY)
+        self.assertEqual(email.template, 'notification_summary')
+        self.assertEqual(email.data['total'], 4)
+        self.assertEqual(email.data['failures'], [
+            {'count': 2, 'exception': 'KeyError', 'event_type': EVENT_MAN_CREATED},
+            {'count': 1, 'exception': 'KeyError', 'event_type': EVENT_WO_DISPATCHED},
+            {'count': 1, 'exception': 'ValueError', 'event_type': 'unknown'},
+        ])
+        self.assertFalse(alerts.is_open)
+        self.assertEqual(alerts.suppressed, 0)
+
+    def test_summary_waits_for_the_cooldown(self):
+        alerts = self.create_alerts(threshold=1)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        alerts.check()
+
+        self.send.assert_not_called()
+        self.assertTrue(alerts.is_open)
+
+    def test_circuit_stays_open_if_the_summary_fails(self):
+        alerts = self.create_alerts(threshold=1, cooldown=0)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        self.send.side_effect = ConnectionRefusedError()
+        alerts.check()
+
+        self.assertTrue(alerts.is_open)
+        self.assertEqual(alerts.suppressed, 1)
+
+        self.send.side_effect = None
+        alerts.check()
+        self.assertFalse(alerts.is_open)
+
+    def test_close_sends_the_summary(self):
+        alerts = self.create_alerts(threshold=1)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        alerts.close()
+
+        self.assertEqual(self.send.call_args[0][0].template, 'notification_summary')
+
+    def test_summary_renders(self):
+        alerts = self.create_alerts(threshold=1, cooldown=0)
+        alerts.failure(SBJ_MSG_FAILED, body(EVENT_MAN_CREATED), TRACE)
+        alerts.check()
+
+        data = self.send.call_args[0][0].data
+        renderer = Renderer()
+        self.assertIn('KeyError', renderer.render('notification_summary.txt', data))
+        self.assertIn(EVENT_MAN_CREATED, renderer.render('notification_summary.html', data))
+
+
+if __name__ == '__main__':
+    unittest.main()
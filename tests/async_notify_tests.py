@@ -0,0 +1,159 @@
+import aiosmtplib
+import asyncio
+import unittest
+from mock import patch, AsyncMock, Mock
+from smtplib import SMTPRecipientsRefused
+from aiosmtplib import SMTPRecipientRefused, SMTPResponse, SMTPServerDisconnected
+from notifier import Email
+from notifier.async_notify import AsyncNotify
+from notifier.notify import NOT_SENT_REPLY
+from .helper import config
+
+
+@patch('notifier.async_notify.SMTP')
+class AsyncNotifyTests(unittest.TestCase):
+
+    _email = Email(subject='subject',
+                   from_address=config.email.from_address,
+                   to=['test@sanger.ac.uk'],
+                   template='catalogue_new',
+                   data={})
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def create_smtp(self, mocked_smtp):
+        smtp = Mock(is_connected=True)
+        smtp.connect = AsyncMock()
+        smtp.login = AsyncMock()
+        smtp.sendmail = AsyncMock(return_value=({}, SMTPResponse(250, 'OK')))
+        smtp.quit = AsyncMock()
+        mocked_smtp.return_value = smtp
+        return smtp
+
+    def test_send_email(self, mocked_smtp):
+        smtp = self.create_smtp(mocked_smtp)
+
+        async def send():
+            notify = AsyncNotify('test', config)
+            await notify.send_email(*self._email)
+            await notify.send_email(*self._email)
+
+        self.run_async(send())
+
+        # The connection is reused
+        mocked_smtp.assert_called_once_with(hostname=config.email.smtp_host,
+                                            port=int(config.email.smtp_port))
+        smtp.connect.assert_awaited_once()
+        smtp.login.assert_not_called()
+        self.assertEqual(smtp.sendmail.await_count, 2)
+        sender, recipients, message = smtp.sendmail.await_args[0]
+        self.assertEqual(sender, config.email.from_address)
+        self.assertEqual(recipients, ['test@sanger.ac.uk'])
+        self.assertIn(b'\r\nSubject: subject\r\n', message)
+
+    def test_send_emails(self, mocked_smtp):
+        smtp = self.create_smtp(mocked_smtp)
+
+        async def send():
+            notify = AsyncNotify('test', config)
+            await notify.send_emails([self._email] * 3)
+
+        self.run_async(send())
+
+        self.assertEqual(smtp.sendmail.await_count, 3)
+
+    def test_send_emails_calls_on_sent(self, mocked_smtp):
+        self.create_smtp(mocked_smtp)
+        on_sent = Mock()
+
+        async def send():
+            notify = AsyncNotify('test', config)
+            await notify.send_emails([self._email] * 2, [None, on_sent])
+
+        self.run_async(send())
+
+        on_sent.assert_called_once_with()
+
+    def test_failed_connection_is_replaced(self, mocked_smtp):
+        smtp = self.create_smtp(mocked_smtp)
+        smtp.sendmail.side_effect = [SMTPServerDisconnected('gone'), ({}, SMTPResponse(250, 'OK'))]
+
+        async def send():
+            notify = AsyncNotify('test', config)
+            with self.assertRaises(SMTPServerDisconnected):
+                await notify.send_email(*self._email)
+            await notify.send_email(*self._email)
+
+        self.run_async(send())
+
+        smtp.close.assert_called_once()
+        self.assertEqual(smtp.connect.await_count, 2)
+
+    def test_refused_recipients(self, mocked_smtp):
+        smtp = self.create_smtp(mocked_smtp)
+        smtp.sendmail.return_value = ({'bad@sanger.ac.uk': SMTPResponse(550, 'No such user')},
+                                      SMTPResponse(250, 'OK'))
+
+        async def send():
+            notify = AsyncNotify('test', config)
+            return await notify.send_email(*self._email._replace(
+                to=['test@sanger.ac.uk', 'bad@sanger.ac.uk']))
+
+        refused = self.run_async(send())
+
+        self.assertEqual(refused, {'bad@sanger.ac.uk': (550, 'No such user')})
+        smtp.close.assert_not_called()
+
+    def send_in_transactions(self, to):
+        single = config.replace(email=config.email._replace(smtp_max_recipients=1))
+
+        async def send():
+            notify = AsyncNotify('test', single)
+            return await notify.send_email(*self._email._replace(to=to))
+
+        return self.run_async(send())
+
+    def test_closed_connection_is_retried_for_the_recipients_not_sent(self, mocked_smtp):
+        smtp = self.create_smtp(mocked_smtp)
+        busy = SMTPRecipientRefused(421, 'Too many connections', 'busy@sanger.ac.uk')
+        smtp.sendmail.side_effect = [({}, SMTPResponse(250, 'OK')),
+                                     aiosmtplib.SMTPRecipientsRefused([busy])]
+
+        with self.assertRaises(SMTPRecipientsRefused) as context, \
+                self.assertLogs('notifier.throttle', 'WARNING'):
+            self.send_in_transactions(['a@sanger.ac.uk', 'busy@sanger.ac.uk', 'c@sanger.ac.uk'])
+
+        self.assertEqual(context.exception.recipients,
+                         {'busy@sanger.ac.uk': (421, 'Too many connections'),
+                          'c@sanger.ac.uk': NOT_SENT_REPLY})
+        self.assertEqual(smtp.sendmail.await_count, 2)
+
+    def test_failed_transaction_is_retried_for_its_recipients_only(self, mocked_smtp):
+        smtp = self.create_smtp(mocked_smtp)
+        smtp.sendmail.side_effect = [({}, SMTPResponse(250, 'OK')), SMTPServerDisconnected('gone')]
+
+        with self.assertRaises(SMTPRecipientsRefused) as context, \
+                self.assertLogs('notifier.async_notify', 'WARNING'):
+            self.send_in_transactions(['a@sanger.ac.uk', 'b@sanger.ac.uk', 'c@sanger.ac.uk'])
+
+        self.assertEqual(context.exception.recipients, {'b@sanger.ac.uk': NOT_SENT_REPLY,
+                                                        'c@sanger.ac.uk': NOT_SENT_REPLY})
+        smtp.close.assert_called_once()
+
+    def test_close(self, mocked_smtp):
+        smtp = self.create_smtp(mocked_smtp)
+
+        async def send():
+            notify = AsyncNotify('test', config)
+            await notify.send_email(*self._email)
+            await notify.close()
+
+        self.run_async(send())
+
+        smtp.quit.assert_awaited_once()
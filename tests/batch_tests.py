@@ -0,0 +1,94 @@
+import unittest
+from mock import Mock, call
+from notifier.batch import Batch
+from notifier.consts import *
+
+
+class BatchTests(unittest.TestCase):
+
+    def create_batch(self, size=3, process=None):
+        self.connection = Mock()
+        self.channel = Mock()
+        self.process = process or Mock()
+        self.on_failure = Mock()
+        return Batch(connection=self.connection,
+                     channel=self.channel,
+                     process=self.process,
+                     on_failure=self.on_failure,
+                     size=size,
+                     timeout=0.5)
+
+    def test_timeout_scheduled_on_first_delivery(self):
+        batch = self.create_batch()
+        batch.add(1, b'one')
+        batch.add(2, b'two')
+
+        self.connection.add_timeout.assert_called_once_with(0.5, batch._on_timeout)
+        self.process.assert_not_called()
+        self.assertEqual(len(batch), 2)
+
+    def test_flush_when_full(self):
+        batch = self.create_batch(size=2)
+        batch.add(1, b'one')
+        batch.add(2, b'two')
+
+        self.process.assert_has_calls([call(b'one'), call(b'two')])
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=2, multiple=True)
+        self.channel.basic_nack.assert_not_called()
+        self.connection.remove_timeout.assert_called_once_with(
+            self.connection.add_timeout.return_value)
+        self.assertEqual(len(batch), 0)
+
+    def test_flush_on_timeout(self):
+        batch = self.create_batch()
+        batch.add(1, b'one')
+        batch._on_timeout()
+
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=True)
+        self.connection.remove_timeout.assert_not_called()
+
+    def test_only_failures_are_nacked(self):
+        def process(body):
+            if body == b'bad':
+                raise ValueError('bad message')
+
+        batch = self.create_batch(process=process)
+        batch.add(1, b'good')
+        batch.add(2, b'bad')
+        batch.add(3, b'good')
+
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=2, requeue=False)
+        self.channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
+        self.assertEqual(self.on_failure.call_count, 1)
+        subject, body, trace = self.on_failure.call_args[0]
+        self.assertEqual(subject, SBJ_MSG_FAILED)
+        self.assertEqual(body, b'bad')
+        self.assertIn('bad message', trace)
+
+    def test_no_ack_when_everything_failed(self):
+        batch = self.create_batch(size=2, process=Mock(side_effect=ValueError()))
+        batch.add(1, b'one')
+        batch.add(2, b'two')
+
+        self.assertEqual(self.channel.basic_nack.call_count, 2)
+        self.channel.basic_ack.assert_not_called()
+
+    def test_failed_nack_is_reported(self):
+        batch = self.create_batch(size=1, process=Mock(side_effect=ValueError()))
+        self.channel.basic_nack.side_effect = Exception()
+        batch.add(1, b'one')
+
+        self.assertEqual(self.on_failure.call_args[0][0], SBJ_NACK_FAILED)
+
+    def test_failed_alert_does_not_stop_the_batch(self):
+        batch = self.create_batch(size=1, process=Mock(side_effect=ValueError()))
+        self.on_failure.side_effect = Exception()
+        batch.add(1, b'one')
+
+        self.channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+
+    def test_flush_empty_batch(self):
+        batch = self.create_batch()
+        batch.flush()
+
+        self.channel.basic_ack.assert_not_called()
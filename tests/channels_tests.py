@@ -0,0 +1,214 @@
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from mock import Mock, patch
+import run
+from notifier.channels import EMAIL, Channel, ChannelPool, Channels, LogChannel, WebhookChannel
+from notifier.consts import *
+from notifier.idempotency import SentCache
+from notifier.notify import Email
+from tests.helper import config
+
+EMAIL_CATALOGUE_NEW = Email(subject=SBJ_CAT_NEW,
+                            from_address='no-reply@sanger.ac.uk',
+                            to=['dev@sanger.ac.uk'],
+                            template='catalogue_new',
+                            data={})
+
+
+def event_body(event_type, **fields):
+    """Return the body of a message for an event of event_type, without metadata."""
+    event = dict(event_type=event_type, timestamp='2018-03-23T10:00:00Z',
+                 user_identifier='user@sanger.ac.uk', metadata={}, notifier_info={}, **fields)
+    return json.dumps(event).encode()
+
+
+class FakeChannel(Channel):
+
+    def __init__(self, name, send=None):
+        self.name = name
+        self.send = Mock(side_effect=send)
+
+
+class WebhookChannelTests(unittest.TestCase):
+
+    @patch('urllib.request.urlopen')
+    def test_send(self, mocked_urlopen):
+        WebhookChannel('http://chat.localhost/hooks/1').send(EMAIL_CATALOGUE_NEW)
+
+        request = mocked_urlopen.call_args[0][0]
+        self.assertEqual(request.full_url, 'http://chat.localhost/hooks/1')
+        self.assertEqual(request.get_header('Content-type'), 'application/json')
+        text = json.loads(request.data.decode('utf-8'))['text']
+        self.assertTrue(text.startswith(SBJ_CAT_NEW + '\n\n'))
+
+
+class LogChannelTests(unittest.TestCase):
+
+    def test_send(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'notifications.log')
+        channel = LogChannel(path)
+
+        channel.send(EMAIL_CATALOGUE_NEW)
+        channel.send(EMAIL_CATALOGUE_NEW._replace(data={'timestamp': datetime(2018, 3, 23)}))
+
+        with open(path) as stream:
+            lines = [json.loads(line) for line in stream]
+        self.assertEqual(lines[0]['subject'], SBJ_CAT_NEW)
+        self.assertEqual(lines[0]['to'], ['dev@sanger.ac.uk'])
+        self.assertEqual(lines[1]['data'], {'timestamp': '2018-03-23 00:00:00'})
+
+
+class ChannelPoolTests(unittest.TestCase):
+
+    def create_pool(self, channel, **kwargs):
+        pool = ChannelPool(channel, base_delay=0, **kwargs)
+        self.addCleanup(pool.stop)
+        return pool
+
+    def test_submit(self):
+        channel = FakeChannel('fake')
+        pool = self.create_pool(channel)
+
+        pool.submit(EMAIL_CATALOGUE_NEW).result(timeout=5)
+
+        channel.send.assert_called_once_with(EMAIL_CATALOGUE_NEW)
+
+    def test_failures_are_retried(self):
+        channel = FakeChannel('fake', send=[OSError(), None])
+        pool = self.create_pool(channel, retries=1)
+
+        pool.submit(EMAIL_CATALOGUE_NEW).result(timeout=5)
+
+        self.assertEqual(channel.send.call_count, 2)
+
+    def test_failure_is_set_on_the_future(self):
+        channel = FakeChannel('fake', send=OSError('unreachable'))
+        pool = self.create_pool(channel, retries=2)
+
+        with self.assertRaises(OSError):
+            pool.submit(EMAIL_CATALOGUE_NEW).result(timeout=5)
+        self.assertEqual(channel.send.call_count, 3)
+
+    def test_notifications_are_dropped_when_the_queue_is_full(self):
+        started, release = threading.Event(), threading.Event()
+        channel = FakeChannel('slow', send=lambda email: started.set() or release.wait(5))
+        pool = self.create_pool(channel, queue_size=1, queue_timeout=0)
+        self.addCleanup(release.set)
+
+        pool.submit(EMAIL_CATALOGUE_NEW)
+        self.assertTrue(started.wait(5))
+        queued = pool.submit(EMAIL_CATALOGUE_NEW)
+        dropped = pool.submit(EMAIL_CATALOGUE_NEW)
+
+        self.assertFalse(queued.done())
+        self.assertIsInstance(dropped.exception(timeout=0), queue.Full)
+
+    def test_slow_channels_do_not_block_others(self):
+        release = threading.Event()
+        slow = self.create_pool(FakeChannel('slow', send=lambda email: release.wait(5)))
+        fast = self.create_pool(FakeChannel('fast'))
+        self.addCleanup(release.set)
+
+        slow_future = slow.submit(EMAIL_CATALOGUE_NEW)
+        fast.submit(EMAIL_CATALOGUE_NEW).result(timeout=5)
+
+        self.assertFalse(slow_future.done())
+
+
+class ChannelsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.log = FakeChannel('log')
+        self.webhook = FakeChannel('webhook')
+        self.pools = [ChannelPool(self.log), ChannelPool(self.webhook)]
+        self.channels = Channels(self.pools, [('aker.events.catalogue.#', ['log']),
+                                              (EVENT_CAT_REJECTED, ['email', 'webhook', 'log'])])
+        self.addCleanup(self.channels.stop)
+
+    def test_for_event(self):
+        self.assertEqual(self.channels.for_event(EVENT_MAN_CREATED), (EMAIL,))
+        self.assertEqual(self.channels.for_event(EVENT_CAT_NEW), ('log',))
+        self.assertEqual(self.channels.for_event(EVENT_CAT_REJECTED), ('log', EMAIL, 'webhook'))
+
+    def test_unknown_channel(self):
+        with self.assertRaises(ValueError):
+            Channels(self.pools, [(EVENT_CAT_NEW, ['sms'])])
+
+    def test_events_without_routes_use_notify(self):
+        notify = Mock()
+        self.assertIs(self.channels.notify(EVENT_MAN_CREATED, notify), notify)
+
+    def test_rules_send_to_the_routed_channels(self):
+        notify = Mock()
+        run.process_message(event_body(EVENT_CAT_REJECTED), ENV_TEST, config, notify=notify,
+                            channels=self.channels)
+        self.channels.stop()
+
+        notify.send_email.assert_called_once()
+        email = self.webhook.send.call_args[0][0]
+        self.assertEqual(email.subject, SBJ_CAT_REJECTED)
+        self.assertEqual(email.to, [config.contact.email_dev_team])
+        self.log.send.assert_called_once_with(email)
+
+    def test_rules_skip_email_when_not_routed(self):
+        notify = Mock()
+        run.process_message(event_body(EVENT_CAT_NEW), ENV_TEST, config, notify=notify,
+                            channels=self.channels)
+        self.channels.stop()
+
+        notify.send_email.assert_not_called()
+        self.log.send.assert_called_once()
+
+    def test_on_sent_once_sent_to_all_the_channels(self):
+        notify, on_sent = Mock(), Mock()
+        routed = self.channels.notify(EVENT_CAT_REJECTED, notify)
+
+        routed.send_email(*EMAIL_CATALOGUE_NEW, on_sent=on_sent)
+        for future in routed.futures:
+            future.result(timeout=5)
+
+        self.assertEqual(len(routed.futures), 2)
+        on_sent.assert_called_once_with()
+
+    def test_on_sent_not_called_when_a_channel_fails(self):
+        self.log.send.side_effect = OSError()
+        on_sent = Mock()
+        routed = self.channels.notify(EVENT_CAT_NEW, Mock())
+
+        with self.assertLogs('notifier.channels', 'ERROR'):
+            routed.send_email(*EMAIL_CATALOGUE_NEW, on_sent=on_sent)
+            self.channels.stop()
+
+        on_sent.assert_not_called()
+
+    def test_redelivered_events_are_not_sent_to_the_channels_again(self):
+        body = event_body(EVENT_CAT_NEW, uuid='1')
+        sent = SentCache(size=10, ttl=60)
+
+        for _ in range(2):
+            run.process_message(body, ENV_TEST, config, notify=Mock(), sent=sent,
+                                channels=self.channels)
+            self.channels.stop()
+
+        self.log.send.assert_called_once()
+
+    def test_from_config(self):
+        channels = Channels.from_config(config.channels._replace(
+            log_path=os.devnull, routes=[(EVENT_CAT_NEW, ['log'])]))
+        self.addCleanup(channels.stop)
+
+        self.assertEqual(channels.for_event(EVENT_CAT_NEW), ('log',))
+        with self.assertRaises(ValueError):
+            Channels.from_config(config.channels._replace(routes=[(EVENT_CAT_NEW, ['webhook'])]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import unittest
+from mock import Mock
+from notifier.consts import *
+from notifier.digest import Digest
+from notifier.notify import unique_addresses
+
+
+class DigestTests(unittest.TestCase):
+
+    def create_digest(self, window=60, on_failure=None):
+        self.notify = Mock()
+        digest = Digest(notify=self.notify, templates=['manifest_received'], window=window,
+                        poll_interval=60, on_failure=on_failure)
+        self.addCleanup(digest.close)
+        return digest
+
+    def send_received(self, digest, manifest_id, to):
+        digest.send_email(subject='{} {}'.format(SBJ_MAN_RECEIVED, manifest_id),
+                          from_address='no-reply@sanger.ac.uk',
+                          to=to,
+                          template='manifest_received',
+                          data={'manifest_id': manifest_id, 'barcode': 'AKER-1'})
+
+    def test_other_templates_are_sent(self):
+        digest = self.create_digest()
+        digest.send_email(subject=SBJ_CAT_NEW,
+                          from_address='no-reply@sanger.ac.uk',
+                          to=['dev@sanger.ac.uk'],
+                          template='catalogue_new',
+                          data={})
+
+        self.notify.send_email.assert_called_once_with(subject=SBJ_CAT_NEW,
+                                                       from_address='no-reply@sanger.ac.uk',
+                                                       to=['dev@sanger.ac.uk'],
+                                                       template='catalogue_new',
+                                                       data={})
+
+    def test_on_sent_is_called_once_all_the_digests_are_sent(self):
+        digest = self.create_digest()
+        on_sent = Mock()
+        digest.send_email(subject='{} 1'.format(SBJ_MAN_RECEIVED),
+                          from_address='no-reply@sanger.ac.uk',
+                          to=['a@sanger.ac.uk', 'b@sanger.ac.uk'],
+                          template='manifest_received',
+                          data={'manifest_id': 1, 'barcode': 'AKER-1'},
+                          on_sent=on_sent)
+        self.send_received(digest, 2, ['a@sanger.ac.uk'])
+        on_sent.assert_not_called()
+
+        digest.flush(force=True)
+        on_sent.assert_called_once_with()
+
+    def test_emails_are_held_until_the_window_closes(self):
+        digest = self.create_digest()
+        self.send_received(digest, 1, ['a@sanger.ac.uk'])
+        digest.flush()
+
+        self.notify.send_email.assert_not_called()
+        self.assertEqual(digest.pending, 1)
+
+    def test_digest_per_recipient(self):
+        digest = self.create_digest(window=0)
+        self.send_received(digest, 1, ['a@sanger.ac.uk', 'b@sanger.ac.uk'])
+        self.send_received(digest, 2, ['A@sanger.ac.uk'])
+        digest.flush()
+
+        self.assertEqual(self.notify.send_email.call_count, 2)
+        calls = {c[1]['to'][0].lower(): c[1] for c in self.notify.send_email.call_args_list}
+
+        combined = calls['a@sanger.ac.uk']
+        self.assertEqual(combined['template'], 'digest')
+        self.assertEqual(combined['subject'], '{} (2 notifications)'.format(SBJ_DIGEST))
+        self.assertEqual([e['subject'] for e in combined['data']['entries']],
+                         [SBJ_MAN_RECEIVED + ' 1', SBJ_MAN_RECEIVED + ' 2'])
+        self.assertIn('AKER-1', combined['data']['entries'][0]['text'])
+        self.assertIn('<td>AKER-1</td>', combined['data']['entries'][0]['html'])
+
+        # A single email is sent as it is
+        single = calls['b@sanger.ac.uk']
+        self.assertEqual(single['template'], 'manifest_received')
+        self.assertEqual(single['to'], ['b@sanger.ac.uk'])
+        self.assertEqual(digest.pending, 0)
+
+    def test_close_sends_everything(self):
+        digest = self.create_digest()
+        self.send_received(digest, 1, ['a@sanger.ac.uk'])
+        digest.close()
+
+        self.notify.send_email.assert_called_once()
+
+    def test_failed_digest_does_not_stop_the_others(self):
+        digest = self.create_digest(window=0)
+        self.notify.send_email.side_effect = [Exception(), None]
+        self.send_received(digest, 1, ['a@sanger.ac.uk', 'b@sanger.ac.uk'])
+        digest.flush()
+
+        self.assertEqual(self.notify.send_email.call_count, 2)
+
+    def test_failed_digest_is_reported(self):
+        on_failure = Mock()
+        digest = self.create_digest(window=0, on_failure=on_failure)
+        self.notify.send_email.side_effect = ValueError('SMTP down')
+        self.send_received(digest, 1, ['a@sanger.ac.uk'])
+
+        with self.assertLogs('notifier.digest', 'ERROR'):
+            digest.flush()
+
+        subject, body, trace = on_failure.call_args[0]
+        self.assertEqual(subject, SBJ_DIGEST_FAILED)
+        self.assertEqual(json.loads(body.decode('utf-8')),
+                         {'event_type': 'digest', 'template': 'manifest_received',
+                          'recipient': 'a@sanger.ac.uk', 'subjects': [SBJ_MAN_RECEIVED + ' 1']})
+        self.assertIn('SMTP down', trace)
+
+    def test_unique_addresses(self):
+        self.assertEqual(unique_addresses(['a@sanger.ac.uk', 'b@sanger.ac.uk', 'A@Sanger.ac.uk']),
+                         ['a@sanger.ac.uk', 'b@sanger.ac.uk'])
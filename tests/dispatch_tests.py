@@ -0,0 +1,94 @@
+import queue
+import unittest
+from mock import Mock, call
+from notifier import Email
+from notifier.dispatch import Dispatcher
+
+
+class DispatcherTests(unittest.TestCase):
+
+    _email = Email(subject='subject',
+                   from_address='no-reply@sanger.ac.uk',
+                   to=['test@sanger.ac.uk'],
+                   template='catalogue_new',
+                   data={})
+
+    def create_dispatcher(self, notify):
+        dispatcher = Dispatcher(notify=notify, workers=2, queue_size=10)
+        self.addCleanup(dispatcher.stop, 1)
+        return dispatcher
+
+    def wait_for_completed(self, dispatcher):
+        dispatcher.stop()
+        return list(dispatcher.completed())
+
+    def test_emails_are_sent(self):
+        notify = Mock()
+        dispatcher = self.create_dispatcher(notify)
+        dispatcher.submit(1, b'body', [self._email, self._email])
+
+        self.assertEqual(self.wait_for_completed(dispatcher), [(1, b'body', None)])
+        notify.send_email.assert_has_calls([call(*self._email), call(*self._email)])
+
+    def test_on_sent_is_called_once_sent(self):
+        notify = Mock()
+        on_sent = Mock()
+        dispatcher = self.create_dispatcher(notify)
+        dispatcher.submit(1, b'body', [self._email, self._email], on_sent=[None, on_sent])
+
+        self.wait_for_completed(dispatcher)
+        on_sent.assert_called_once_with()
+
+    def test_on_sent_is_not_called_if_sending_fails(self):
+        notify = Mock()
+        notify.send_email.side_effect = ValueError('SMTP down')
+        on_sent = Mock()
+        dispatcher = self.create_dispatcher(notify)
+        dispatcher.submit(1, b'body', [self._email], on_sent=[on_sent])
+
+        with self.assertLogs('notifier.dispatch', 'ERROR'):
+            self.wait_for_completed(dispatcher)
+        on_sent.assert_not_called()
+
+    def test_failure_is_reported(self):
+        notify = Mock()
+        notify.send_email.side_effect = ValueError('SMTP down')
+        dispatcher = self.create_dispatcher(notify)
+        dispatcher.submit(1, b'body', [self._email, self._email])
+
+        [(delivery_tag, body, trace)] = self.wait_for_completed(dispatcher)
+        self.assertEqual((delivery_tag, body), (1, b'body'))
+        self.assertIn('SMTP down', trace)
+        # The remaining emails are not sent
+        notify.send_email.assert_called_once()
+
+    def test_without_delivery_tag_is_not_reported(self):
+        notify = Mock()
+        dispatcher = self.create_dispatcher(notify)
+        dispatcher.submit(None, b'body', [self._email])
+
+        self.assertEqual(self.wait_for_completed(dispatcher), [])
+        notify.send_email.assert_called_once()
+
+    def test_submit_without_blocking(self):
+        dispatcher = Dispatcher(notify=Mock(), workers=0, queue_size=1)
+        dispatcher.submit(1, b'body', [self._email])
+
+        with self.assertRaises(queue.Full):
+            dispatcher.submit(2, b'body', [self._email], block=False)
+
+    def test_stop_without_waiting_drops_the_queued_emails(self):
+        notify = Mock()
+        dispatcher = Dispatcher(notify=notify, workers=0, queue_size=10)
+        dispatcher.submit(1, b'body', [self._email])
+        dispatcher.submit(None, b'body', [self._email])
+
+        self.assertEqual(dispatcher.stop(wait=False), 1)
+        self.assertEqual(dispatcher.pending, 0)
+        notify.send_email.assert_not_called()
+
+    def test_no_emails(self):
+        dispatcher = self.create_dispatcher(Mock())
+        dispatcher.submit(1, b'body', [])
+
+        self.assertEqual(self.wait_for_completed(dispatcher), [(1, b'body', None)])
@@ -0,0 +1,61 @@
+import os
+import time
+import unittest
+from notifier import Fleet
+
+
+def sleep_forever(index):
+    time.sleep(60)
+
+
+def crash(index):
+    os._exit(1)
+
+
+class FleetTests(unittest.TestCase):
+
+    def create_fleet(self, target, workers=2, restart_delay=0):
+        fleet = Fleet(target=target, workers=workers, restart_delay=restart_delay)
+        self.addCleanup(fleet.stop, 1)
+        return fleet
+
+    def test_workers_are_started(self):
+        fleet = self.create_fleet(sleep_forever, workers=3)
+        fleet.check()
+
+        processes = fleet.processes
+        self.assertEqual(len(processes), 3)
+        self.assertTrue(all(p.is_alive() for p in processes))
+        self.assertEqual(len({p.pid for p in processes}), 3)
+
+    def test_crashed_workers_are_restarted(self):
+        fleet = self.create_fleet(crash, workers=1)
+        fleet.check()
+        first = fleet.processes[0]
+        first.join(5)
+
+        fleet.check()
+
+        self.assertEqual(first.exitcode, 1)
+        self.assertIsNot(fleet.processes[0], first)
+
+    def test_restart_delay(self):
+        fleet = self.create_fleet(crash, workers=1, restart_delay=60)
+        fleet.check()
+        fleet.processes[0].join(5)
+
+        fleet.check()
+
+        self.assertIsNone(fleet.processes[0])
+
+    def test_stop(self):
+        fleet = self.create_fleet(sleep_forever)
+        fleet.check()
+        processes = fleet.processes
+
+        fleet.stop(timeout=5)
+
+        self.assertFalse(any(p.is_alive() for p in processes))
+        # Stopped workers are not restarted by run
+        fleet.run()
+        self.assertFalse(any(p.is_alive() for p in fleet.processes))
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from mock import Mock, patch
+from notifier.idempotency import Idempotent, SentCache
+from notifier.notify import EmailCollector
+
+UUID = '1d6c4d8b-8c5e-4d2b-9a8e-2f2c2e7b5b1a'
+
+
+class SentCacheTests(unittest.TestCase):
+
+    def test_contains(self):
+        sent = SentCache(size=10, ttl=60)
+        sent.add([(UUID, 'catalogue_new', 'a@sanger.ac.uk')])
+
+        self.assertIn((UUID, 'catalogue_new', 'a@sanger.ac.uk'), sent)
+        self.assertNotIn((UUID, 'catalogue_new', 'b@sanger.ac.uk'), sent)
+        self.assertNotIn((UUID, 'catalogue_processed', 'a@sanger.ac.uk'), sent)
+
+    def test_least_recently_used_are_dropped(self):
+        sent = SentCache(size=2, ttl=60)
+        sent.add([('1', 't', 'a')])
+        sent.add([('2', 't', 'a')])
+        self.assertIn(('1', 't', 'a'), sent)
+        sent.add([('3', 't', 'a')])
+
+        self.assertEqual(len(sent), 2)
+        self.assertIn(('1', 't', 'a'), sent)
+        self.assertNotIn(('2', 't', 'a'), sent)
+        self.assertIn(('3', 't', 'a'), sent)
+
+    def test_entries_expire(self):
+        sent = SentCache(size=10, ttl=60)
+        with patch('time.time', return_value=1000):
+            sent.add([('1', 't', 'a')])
+        with patch('time.time', return_value=1059):
+            self.assertIn(('1', 't', 'a'), sent)
+        with patch('time.time', return_value=1060):
+            self.assertNotIn(('1', 't', 'a'), sent)
+        self.assertEqual(len(sent), 0)
+
+    def test_entries_survive_a_restart(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'sent.sqlite')
+
+        sent = SentCache(size=10, ttl=60, path=path)
+        sent.add([('1', 't', 'a'), ('2', 't', 'a')])
+        sent.close()
+
+        sent = SentCache(size=1, ttl=60, path=path)
+        self.addCleanup(sent.close)
+        self.assertEqual(len(sent), 1)
+        self.assertIn(('2', 't', 'a'), sent)
+
+    def test_entries_added_by_another_process(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'sent.sqlite')
+        sent = SentCache(size=10, ttl=60, path=path, shared=True)
+        self.addCleanup(sent.close)
+        other = SentCache(size=10, ttl=60, path=path, shared=True)
+        self.addCleanup(other.close)
+
+        other.add([('1', 't', 'a')])
+
+        self.assertIn(('1', 't', 'a'), sent)
+        self.assertNotIn(('2', 't', 'a'), sent)
+        with patch('time.time', return_value=time.time() + 60):
+            self.assertNotIn(('1', 't', 'a'), other)
+
+    def test_file_is_only_read_when_it_may_know_more(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sent = SentCache(size=1, ttl=60, path=os.path.join(directory, 'sent.sqlite'))
+        self.addCleanup(sent.close)
+
+        with patch.object(sent, '_lookup', wraps=sent._lookup) as lookup:
+            sent.add([('1', 't', 'a')])
+            self.assertNotIn(('2', 't', 'a'), sent)
+            lookup.assert_not_called()
+
+            # Dropped from memory, but still in the file
+            sent.add([('2', 't', 'a')])
+            self.assertIn(('1', 't', 'a'), sent)
+            lookup.assert_called_once_with(('1', 't', 'a'))
+
+    def test_expired_rows_are_deleted(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sent = SentCache(size=10, ttl=60, path=os.path.join(directory, 'sent.sqlite'),
+                         purge_every=2)
+        self.addCleanup(sent.close)
+
+        with patch('time.time', return_value=1000):
+            sent.add([('1', 't', 'a')])
+        with patch('time.time', return_value=1060):
+            sent.add([('2', 't', 'a')])
+
+        rows = sent._db.execute('SELECT uuid FROM sent').fetchall()
+        self.assertEqual(rows, [('2',)])
+
+
+class IdempotentTests(unittest.TestCase):
+
+    def setUp(self):
+        self.notify = Mock()
+        self.sent = SentCache(size=10, ttl=60)
+
+    def send_email(self, to, uuid=UUID):
+        Idempotent(self.notify, self.sent, uuid).send_email(subject='Subject',
+                                                            from_address='no-reply@sanger.ac.uk',
+                                                            to=to,
+                                                            template='catalogue_new',
+                                                            data={})
+
+    def test_emails_are_sent_once(self):
+        self.send_email(['a@sanger.ac.uk'])
+        self.send_email(['a@sanger.ac.uk'])
+
+        self.notify.send_email.assert_called_once_with(subject='Subject',
+                                                       from_address='no-reply@sanger.ac.uk',
+                                                       to=['a@sanger.ac.uk'],
+                                                       template='catalogue_new',
+                                                       data={})
+
+    def test_only_new_recipients_are_sent_to(self):
+        self.send_email(['a@sanger.ac.uk'])
+        self.send_email(['A@sanger.ac.uk', 'b@sanger.ac.uk'])
+
+        self.assertEqual(self.notify.send_email.call_args[1]['to'], ['b@sanger.ac.uk'])
+
+    def test_other_events_are_sent(self):
+        self.send_email(['a@sanger.ac.uk'])
+        self.send_email(['a@sanger.ac.uk'], uuid='another')
+
+        self.assertEqual(self.notify.send_email.call_count, 2)
+
+    def test_held_emails_are_remembered_once_sent(self):
+        collector = EmailCollector()
+        Idempotent(collector, self.sent, UUID).send_email(subject='Subject',
+                                                          from_address='no-reply@sanger.ac.uk',
+                                                          to=['a@sanger.ac.uk'],
+                                                          template='catalogue_new',
+                                                          data={})
+        self.assertEqual(len(self.sent), 0)
+
+        collector.on_sent[0]()
+        self.assertIn((UUID, 'catalogue_new', 'a@sanger.ac.uk'), self.sent)
+
+    def test_failed_emails_are_not_remembered(self):
+        self.notify.send_email.side_effect = ConnectionRefusedError()
+        with self.assertRaises(ConnectionRefusedError):
+            self.send_email(['a@sanger.ac.uk'])
+
+        self.assertEqual(len(self.sent), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
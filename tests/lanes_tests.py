@@ -0,0 +1,125 @@
+import queue
+import threading
+import unittest
+from mock import Mock
+from notifier import Email
+from notifier.config import Config
+from notifier.consts import *
+from notifier.dispatch import Dispatcher
+from notifier.lanes import ALERTS, DEFAULT, LaneQueue, Lanes
+
+
+class LanesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lanes = Lanes({'priority': 5}, [('aker.events.manifest.*', 'priority')],
+                           [('priority', 'aker.events.notifications.priority')])
+
+    def test_for_event(self):
+        self.assertEqual(self.lanes.for_event(EVENT_MAN_CREATED), 'priority')
+        self.assertEqual(self.lanes.for_event(EVENT_CAT_NEW), DEFAULT)
+
+    def test_default_lane(self):
+        self.assertEqual(self.lanes.weights, {'priority': 5, DEFAULT: 1})
+
+    def test_unknown_lane(self):
+        with self.assertRaises(ValueError):
+            Lanes({'priority': 5}, [(EVENT_CAT_NEW, 'urgent')])
+        with self.assertRaises(ValueError):
+            Lanes({'priority': 5}, queues=[('urgent', 'aker.events.notifications.urgent')])
+
+    def test_from_config(self):
+        self.assertIsNone(Lanes.from_config(Config.LanesConfig({}, [], [])))
+        lanes = Lanes.from_config(Config.LanesConfig({'priority': 5}, [], []))
+        self.assertEqual(lanes.weights, {'priority': 5, DEFAULT: 1})
+
+
+class LaneQueueTests(unittest.TestCase):
+
+    def drain(self, pending):
+        items = []
+        while len(pending):
+            items.append(pending.get(block=False)[1])
+        return items
+
+    def test_urgent_items_skip_the_backlog(self):
+        pending = LaneQueue({'priority': 5})
+        for i in range(10):
+            pending.put(DEFAULT, 'bulk{}'.format(i))
+        pending.put('priority', 'hmdmc0')
+        pending.put('priority', 'hmdmc1')
+
+        self.assertEqual(self.drain(pending)[:3], ['hmdmc0', 'hmdmc1', 'bulk0'])
+
+    def test_lanes_share_in_proportion_to_weights(self):
+        pending = LaneQueue({'fast': 2})
+        for i in range(30):
+            pending.put('fast', 'fast')
+            pending.put(DEFAULT, 'slow')
+
+        first = self.drain(pending)[:9]
+        self.assertEqual(first.count('fast'), 6)
+        self.assertEqual(first.count('slow'), 3)
+
+    def test_items_of_unknown_lanes_go_to_default(self):
+        pending = LaneQueue({})
+        pending.put(ALERTS, 'alert')
+
+        self.assertEqual(pending.get(block=False), (DEFAULT, 'alert'))
+
+    def test_full(self):
+        pending = LaneQueue({}, maxsize=1)
+        pending.put(DEFAULT, 'item')
+
+        with self.assertRaises(queue.Full):
+            pending.put(DEFAULT, 'item', block=False)
+
+    def test_empty(self):
+        with self.assertRaises(queue.Empty):
+            LaneQueue({}).get(timeout=0.01)
+
+    def test_close(self):
+        pending = LaneQueue({})
+        pending.put(DEFAULT, 'item')
+        pending.close()
+
+        self.assertEqual(pending.get(), (DEFAULT, 'item'))
+        # Once closed, an empty queue does not wait for more items
+        with self.assertRaises(queue.Empty):
+            pending.get()
+
+
+class DispatcherLanesTests(unittest.TestCase):
+
+    def email(self, subject):
+        return Email(subject=subject, from_address='no-reply@sanger.ac.uk',
+                     to=['test@sanger.ac.uk'], template='catalogue_new', data={})
+
+    def test_alerts_are_sent_before_the_backlog(self):
+        started, release = threading.Event(), threading.Event()
+        sent = []
+
+        def send_email(subject, *args):
+            started.set()
+            release.wait(5)
+            sent.append(subject)
+
+        dispatcher = Dispatcher(notify=Mock(send_email=send_email), workers=1, queue_size=100,
+                                lanes={ALERTS: 10})
+        self.addCleanup(dispatcher.stop, 5)
+        self.addCleanup(release.set)
+
+        dispatcher.submit(1, b'body', [self.email('bulk0')])
+        self.assertTrue(started.wait(5))
+        for i in range(1, 5):
+            dispatcher.submit(i + 1, b'body', [self.email('bulk{}'.format(i))])
+        dispatcher.submit(None, b'body', [self.email('alert')], lane=ALERTS)
+        release.set()
+        dispatcher.stop(5)
+
+        self.assertEqual(sent[:2], ['bulk0', 'alert'])
+        self.assertEqual(len(sent), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import io
+import unittest
+from mock import Mock
+from notifier import loadgen
+from notifier.consts import *
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ReadEventsTests(unittest.TestCase):
+
+    def test_read_events(self):
+        stream = io.BytesIO(b'{"event_type": "a"}\n\n  {"event_type": "b"}\r\n')
+        self.assertEqual(list(loadgen.read_events(stream)),
+                         [b'{"event_type": "a"}', b'{"event_type": "b"}'])
+
+    def test_routing_key(self):
+        self.assertEqual(loadgen.routing_key(b'{"event_type": "%s"}' % EVENT_CAT_NEW.encode()),
+                         EVENT_CAT_NEW)
+        self.assertEqual(loadgen.routing_key(b'not json'), '')
+
+
+class MemoryChannelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.channel = loadgen.MemoryChannel(clock=self.clock)
+
+    def test_deliver(self):
+        callback = Mock()
+        delivery_tag = self.channel.deliver(b'{}', callback)
+
+        channel, method_frame, _, body = callback.call_args[0]
+        self.assertIs(channel, self.channel)
+        self.assertEqual(method_frame.delivery_tag, delivery_tag)
+        self.assertEqual(body, b'{}')
+        self.assertEqual(self.channel.unsettled, 1)
+
+    def test_settle(self):
+        def callback(channel, method_frame, header_frame, body):
+            self.clock.sleep(0.5)
+            if body == b'ack':
+                channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+            else:
+                channel.basic_nack(delivery_tag=method_frame.delivery_tag, requeue=False)
+
+        self.channel.deliver(b'ack', callback)
+        self.channel.deliver(b'nack', callback, due=-1.0)
+
+        self.assertEqual(self.channel.settled, {1: (True, 0.5), 2: (False, 2.0)})
+        self.assertEqual(self.channel.unsettled, 0)
+
+    def test_ack_multiple(self):
+        for _ in range(3):
+            self.channel.deliver(b'{}', Mock())
+
+        self.channel.basic_ack(delivery_tag=2, multiple=True)
+
+        self.assertEqual(sorted(self.channel.settled), [1, 2])
+        self.assertEqual(self.channel.unsettled, 1)
+
+
+class ReplayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.channel = loadgen.MemoryChannel(clock=self.clock)
+
+    def ack_after(self, seconds):
+        def callback(channel, method_frame, header_frame, body):
+            self.clock.sleep(seconds)
+            channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+        return callback
+
+    def replay(self, callback, count=10, **kwargs):
+        return loadgen.replay([b'{}'] * count, self.channel, callback, clock=self.clock,
+                              sleep=self.clock.sleep, **kwargs)
+
+    def test_replay_at_rate(self):
+        elapsed = self.replay(self.ack_after(0.01), rate=10)
+
+        self.assertAlmostEqual(elapsed, 0.91)
+        report = loadgen.report(self.channel, elapsed, 10)
+        self.assertEqual(report['messages'], 10)
+        self.assertEqual(report['acked'], 10)
+        self.assertAlmostEqual(report['latency_ms']['p99'], 10)
+
+    def test_latency_counts_from_when_due(self):
+        # The consumer can not keep up with the rate, so the messages wait longer and longer
+        elapsed = self.replay(self.ack_after(0.2), rate=10)
+
+        self.assertAlmostEqual(elapsed, 2.0)
+        report = loadgen.report(self.channel, elapsed, 10)
+        self.assertAlmostEqual(report['latency_ms']['p50'], 600)
+        self.assertAlmostEqual(report['latency_ms']['max'], 1100)
+
+    def test_replay_as_fast_as_possible(self):
+        elapsed = self.replay(self.ack_after(0.01))
+
+        self.assertAlmostEqual(elapsed, 0.1)
+        self.assertAlmostEqual(loadgen.report(self.channel, elapsed)['messages_per_second'], 100)
+
+    def test_poll_until_settled(self):
+        pending = []
+
+        def callback(channel, method_frame, header_frame, body):
+            pending.append(method_frame.delivery_tag)
+
+        def poll():
+            # Settles one delivery per call, as a Dispatcher completing in the background would
+            if pending:
+                self.channel.basic_ack(delivery_tag=pending.pop(0))
+
+        self.replay(callback, count=5, poll=poll)
+
+        self.assertEqual(self.channel.unsettled, 0)
+        self.assertEqual(len(self.channel.settled), 5)
+
+    def test_report_without_messages(self):
+        report = loadgen.report(self.channel, 0)
+        self.assertEqual(report['messages_per_second'], 0.0)
+        self.assertEqual(report['latency_ms']['max'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,10 @@
 import dateutil.parser
 import unittest
 from collections import namedtuple
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from notifier import consts
 from notifier import Message
+from notifier.message import keep_metadata, parse_timestamp, METADATA_FIELDS
 
 
 class MessageTests(unittest.TestCase):
@@ -59,3 +60,70 @@ class MessageTests(unittest.TestCase):
         self.assertEqual(message.user_identifier, self._fake_message.user_identifier)
         self.assertEqual(message.metadata, self._fake_message.metadata)
         self.assertEqual(message.notifier_info, self._fake_message.notifier_info)
+
+    def test_from_json_bytes(self):
+        message_as_json = '{{"event_type":"{a}","timestamp":"{b}","user_identifier":"{c}",' \
+            '"metadata":{{}},"notifier_info":{{}}}}'.format(a=self._fake_message.event_type,
+                                                          b=self._fake_message.timestamp,
+                                                          c=self._fake_message.user_identifier)
+
+        message = Message.from_json(message_as_json.encode('utf-8'))
+        self.assertEqual(message.event_type, self._fake_message.event_type)
+        self.assertEqual(message.timestamp.isoformat(), self._fake_message.timestamp)
+        self.assertEqual(message.notifier_info, '')
+
+    def test_parse_timestamp_utc(self):
+        self.assertEqual(parse_timestamp('2018-03-23T14:37:45.123Z'),
+                         datetime(2018, 3, 23, 14, 37, 45, 123000, timezone.utc))
+
+    def test_parse_timestamp_offset(self):
+        self.assertEqual(parse_timestamp('2018-03-23T14:37:45-05:30'),
+                         datetime(2018, 3, 23, 14, 37, 45, 0,
+                                  timezone(-timedelta(hours=5, minutes=30))))
+        self.assertEqual(parse_timestamp('2018-03-23T14:37:45+0100'),
+                         datetime(2018, 3, 23, 14, 37, 45, 0, timezone(timedelta(hours=1))))
+
+    def test_parse_timestamp_naive(self):
+        timestamp = parse_timestamp('2018-03-23 14:37:45.123456789')
+        self.assertEqual(timestamp, datetime(2018, 3, 23, 14, 37, 45, 123456))
+        self.assertIsNone(timestamp.tzinfo)
+
+    def test_parse_timestamp_matches_dateutil(self):
+        for timestamp in ('2018-03-23T14:37:45.123Z', '2018-03-23T14:37:45+01:00',
+                          '2018-03-23T14:37:45.5', self._fake_message.timestamp):
+            self.assertEqual(parse_timestamp(timestamp), dateutil.parser.parse(timestamp))
+
+    def test_parse_timestamp_other_formats(self):
+        self.assertEqual(parse_timestamp('23 March 2018 14:37'), datetime(2018, 3, 23, 14, 37))
+
+    def test_from_json_keeps_only_used_metadata(self):
+        message = Message.from_json('{"event_type":"a","timestamp":"2018-03-23T14:37:45Z",'
+                                    '"user_identifier":"u","notifier_info":{},'
+                                    '"metadata":{"manifest_id":1,"unused":[1,2,3]}}')
+        self.assertEqual(message.metadata, {'manifest_id': 1})
+
+    def test_from_json_keeps_uuid(self):
+        message = Message.from_json('{"event_type":"a","timestamp":"2018-03-23T14:37:45Z",'
+                                    '"user_identifier":"u","metadata":{},'
+                                    '"uuid":"1d6c4d8b-8c5e-4d2b-9a8e-2f2c2e7b5b1a"}')
+        self.assertEqual(message.uuid, '1d6c4d8b-8c5e-4d2b-9a8e-2f2c2e7b5b1a')
+
+    def test_from_json_without_uuid(self):
+        message = Message.from_json('{"event_type":"a","timestamp":"2018-03-23T14:37:45Z",'
+                                    '"user_identifier":"u","metadata":{}}')
+        self.assertIsNone(message.uuid)
+
+    def test_keep_metadata(self):
+        self.addCleanup(METADATA_FIELDS.discard, 'plugin_field')
+        keep_metadata('plugin_field')
+
+        message = Message.from_json('{"event_type":"a","timestamp":"2018-03-23T14:37:45Z",'
+                                    '"user_identifier":"u","metadata":{"plugin_field":1}}')
+        self.assertEqual(message.metadata, {'plugin_field': 1})
+
+    def test_slots(self):
+        message = Message.from_json('{"event_type":"a","timestamp":"2018-03-23T14:37:45Z",'
+                                    '"user_identifier":"u","metadata":{}}')
+        self.assertFalse(hasattr(message, '__dict__'))
+        with self.assertRaises(AttributeError):
+            message.event_type = 'b'
@@ -0,0 +1,75 @@
+import unittest
+from urllib.request import urlopen
+from notifier.metrics import Counter, Gauge, Histogram, Registry, serve
+
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = Counter('emails_total', 'Emails.', registry=self.registry)
+        counter.inc()
+        counter.inc(2)
+
+        self.assertEqual(counter.value, 3)
+        self.assertEqual(self.registry.expose(), '# HELP emails_total Emails.\n'
+                                                 '# TYPE emails_total counter\n'
+                                                 'emails_total 3.0\n')
+
+    def test_labels(self):
+        counter = Counter('events_total', 'Events.', ['event_type'], registry=self.registry)
+        counter.labels('b').inc()
+        counter.labels('a"\\').inc()
+
+        self.assertIs(counter.labels('b'), counter.labels('b'))
+        self.assertIn('events_total{event_type="a\\"\\\\"} 1.0\nevents_total{event_type="b"} 1.0',
+                      self.registry.expose())
+        with self.assertRaises(ValueError):
+            counter.labels('a', 'b')
+        with self.assertRaises(AttributeError):
+            counter.inc()
+
+    def test_gauge(self):
+        gauge = Gauge('in_flight', 'In flight.', registry=self.registry)
+        gauge.inc(3)
+        gauge.dec()
+        self.assertEqual(gauge.value, 2)
+        gauge.set(7)
+        self.assertIn('in_flight 7.0', self.registry.expose())
+
+    def test_histogram(self):
+        histogram = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1),
+                              registry=self.registry)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        with histogram.time():
+            pass
+
+        self.assertEqual(histogram.count, 4)
+        exposed = self.registry.expose()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2\n', exposed)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 3\n', exposed)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4\n', exposed)
+        self.assertIn('latency_seconds_count 4\n', exposed)
+
+    def test_histogram_with_labels(self):
+        histogram = Histogram('stage_seconds', 'Stages.', ['stage'], buckets=(1,),
+                              registry=self.registry)
+        histogram.labels('parse').observe(0.5)
+
+        self.assertIn('stage_seconds_bucket{stage="parse",le="1.0"} 1\n',
+                      self.registry.expose())
+        self.assertIn('stage_seconds_sum{stage="parse"} 0.5\n', self.registry.expose())
+
+    def test_serve(self):
+        Counter('served_total', 'Served.', registry=self.registry).inc()
+        server = serve('127.0.0.1', 0, registry=self.registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with urlopen('http://127.0.0.1:{}/metrics'.format(server.server_address[1])) as response:
+            self.assertEqual(response.status, 200)
+            self.assertIn(b'served_total 1.0', response.read())
@@ -0,0 +1,76 @@
+import unittest
+from email import message_from_bytes, policy
+from notifier.mime import BOUNDARY, MAX_HEADER, MAX_LINE, build_message, encode_part, header
+
+
+def build(subject='Aker | New Catalogue Available', to=('a@sanger.ac.uk',), text='Hello\n',
+          html='<p>Hello</p>\n'):
+    message = build_message(subject, 'no-reply@sanger.ac.uk', list(to),
+                            (encode_part(text, 'plain'), encode_part(html, 'html')))
+    return message, message_from_bytes(message, policy=policy.default)
+
+
+class MimeTests(unittest.TestCase):
+
+    def test_multipart_alternative(self):
+        _, msg = build()
+
+        self.assertEqual(msg.get_content_type(), 'multipart/alternative')
+        self.assertEqual(msg['MIME-Version'], '1.0')
+        self.assertEqual(msg['Subject'], 'Aker | New Catalogue Available')
+        self.assertEqual(msg['From'], 'no-reply@sanger.ac.uk')
+        self.assertEqual(msg['To'], 'a@sanger.ac.uk')
+        self.assertIsNotNone(msg['Date'])
+        self.assertTrue(msg['Message-ID'].endswith('@sanger.ac.uk>'))
+        text, html = msg.iter_parts()
+        self.assertEqual(text.get_content_type(), 'text/plain')
+        self.assertEqual(text.get_content(), 'Hello')
+        self.assertEqual(html.get_content_type(), 'text/html')
+        self.assertEqual(html.get_content(), '<p>Hello</p>')
+        self.assertEqual(msg.defects, [])
+
+    def test_lines_end_with_crlf(self):
+        message, _ = build(text='one\ntwo\r\nthree\rfour')
+
+        self.assertNotIn(b'\n', message.replace(b'\r\n', b''))
+        self.assertNotIn(b'\r', message.replace(b'\r\n', b''))
+        self.assertTrue(message.endswith(b'--' + BOUNDARY.encode() + b'--\r\n'))
+
+    def test_non_ascii_is_encoded(self):
+        message, msg = build(subject='Aker | Manifest Créé', text='Émilie\n')
+
+        message.decode('ascii')
+        self.assertEqual(msg['Subject'], 'Aker | Manifest Créé')
+        text, _ = msg.iter_parts()
+        self.assertEqual(text['Content-Transfer-Encoding'], 'base64')
+        self.assertEqual(text.get_content(), 'Émilie')
+
+    def test_long_lines_are_encoded(self):
+        message, msg = build(html='<p>{}</p>'.format('a' * 2000))
+
+        self.assertLessEqual(max(len(line) for line in message.split(b'\r\n')), MAX_LINE)
+        _, html = msg.iter_parts()
+        self.assertEqual(html.get_content(), '<p>{}</p>'.format('a' * 2000))
+
+    def test_boundary_in_text_is_encoded(self):
+        _, msg = build(text='--{}--\n'.format(BOUNDARY))
+
+        text, html = msg.iter_parts()
+        self.assertEqual(text.get_content(), '--{}--'.format(BOUNDARY))
+        self.assertEqual(html.get_content(), '<p>Hello</p>')
+
+    def test_long_headers_are_folded(self):
+        to = ['recipient{}@sanger.ac.uk'.format(i) for i in range(20)]
+        message, msg = build(to=to)
+
+        headers = message.split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+        self.assertLessEqual(max(len(line) for line in headers), MAX_HEADER)
+        self.assertEqual([address.addr_spec for address in msg['To'].addresses], to)
+
+    def test_header_line_breaks_are_removed(self):
+        self.assertEqual(header('Subject', 'a\r\nBcc: b@sanger.ac.uk'),
+                         b'Subject: a Bcc: b@sanger.ac.uk\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+from datetime import datetime
+from email import message_from_bytes
+from markupsafe import Markup
+from mock import patch
+from smtplib import SMTP, SMTPDataError, SMTPRecipientsRefused
+from notifier.consts import *
+from notifier.notify import NOT_SENT_REPLY, EmailCollector, Notify, RenderCache
+from notifier.sink import SMTPSink
+from notifier.smtp_pool import SMTPPool
+from notifier.throttle import Throttle
+from tests.helper import config
+
+
+class SendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = SMTPSink(keep=True)
+        self.addCleanup(self.sink.close)
+        self.addCleanup(SMTPPool.close_all)
+        self.config = config.replace(email=config.email._replace(smtp_host=self.sink.host,
+                                                                 smtp_port=self.sink.port,
+                                                                 smtp_max_recipients=2))
+        self.notify = Notify(ENV_TEST, self.config)
+
+    def send_email(self, to):
+        return self.notify.send_email(subject=SBJ_CAT_NEW,
+                                      from_address='no-reply@sanger.ac.uk',
+                                      to=to,
+                                      template='catalogue_new',
+                                      data={})
+
+    def test_recipients_share_transactions(self):
+        to = ['a@sanger.ac.uk', 'b@sanger.ac.uk', 'c@sanger.ac.uk']
+        self.assertEqual(self.send_email(to), {})
+
+        self.assertEqual([recipients for _, recipients, _ in self.sink.emails],
+                         [to[:2], to[2:]])
+
+    def test_permanently_refused_recipients_are_returned(self):
+        self.sink.refused['bad@sanger.ac.uk'] = (550, 'No such user')
+        self.sink.refused['worse@sanger.ac.uk'] = (550, 'No such user')
+
+        refused = self.send_email(['bad@sanger.ac.uk', 'worse@sanger.ac.uk', 'a@sanger.ac.uk'])
+
+        self.assertEqual(refused, {'bad@sanger.ac.uk': (550, b'No such user'),
+                                   'worse@sanger.ac.uk': (550, b'No such user')})
+        self.assertEqual([recipients for _, recipients, _ in self.sink.emails],
+                         [['a@sanger.ac.uk']])
+
+    def test_temporarily_refused_recipients_are_raised(self):
+        self.sink.refused['busy@sanger.ac.uk'] = (451, 'Try again later')
+        self.sink.refused['bad@sanger.ac.uk'] = (550, 'No such user')
+
+        with self.assertRaises(SMTPRecipientsRefused) as context:
+            self.send_email(['busy@sanger.ac.uk', 'bad@sanger.ac.uk', 'a@sanger.ac.uk'])
+
+        self.assertEqual(context.exception.recipients,
+                         {'busy@sanger.ac.uk': (451, b'Try again later')})
+        self.assertEqual(self.sink.emails[0][1], ['a@sanger.ac.uk'])
+
+    def test_closed_connection_is_retried_for_every_recipient(self):
+        self.sink.refused['busy@sanger.ac.uk'] = (421, 'Too many connections')
+
+        with self.assertRaises(SMTPRecipientsRefused) as context, \
+                self.assertLogs('notifier.throttle', 'WARNING'):
+            self.send_email(['a@sanger.ac.uk', 'busy@sanger.ac.uk', 'c@sanger.ac.uk'])
+
+        # Accepted before the 421, or never tried, none of them were sent the email
+        self.assertEqual(context.exception.recipients,
+                         {'a@sanger.ac.uk': NOT_SENT_REPLY,
+                          'busy@sanger.ac.uk': (421, b'Too many connections'),
+                          'c@sanger.ac.uk': NOT_SENT_REPLY})
+        self.assertEqual(self.sink.emails, [])
+
+    def test_failed_transaction_is_retried_for_its_recipients_only(self):
+        sendmail = SMTP.sendmail
+        failures = iter([None, SMTPDataError(554, b'Transaction failed')])
+
+        def fail_second(smtp, *args):
+            error = next(failures)
+            if error is not None:
+                raise error
+            return sendmail(smtp, *args)
+
+        with patch.object(SMTP, 'sendmail', autospec=True, side_effect=fail_second), \
+                self.assertRaises(SMTPRecipientsRefused) as context, \
+                self.assertLogs('notifier.notify', 'WARNING'):
+            self.send_email(['a@sanger.ac.uk', 'b@sanger.ac.uk', 'c@sanger.ac.uk'])
+
+        self.assertEqual(context.exception.recipients, {'c@sanger.ac.uk': NOT_SENT_REPLY})
+        self.assertEqual(self.sink.emails[0][1], ['a@sanger.ac.uk', 'b@sanger.ac.uk'])
+
+    def test_failed_transaction_is_raised_when_nothing_was_sent(self):
+        with patch.object(SMTP, 'sendmail', side_effect=SMTPDataError(554, b'Failed')), \
+                self.assertRaises(SMTPDataError):
+            self.send_email(['a@sanger.ac.uk', 'b@sanger.ac.uk', 'c@sanger.ac.uk'])
+
+    def test_relay_pushing_back_slows_down_the_domain(self):
+        self.config = self.config.replace(throttle=self.config.throttle._replace(domain_rate=100))
+        throttle = Throttle.for_config(self.config.email, self.config.throttle)
+        self.sink.refused['busy@example.com'] = (451, 'Too many messages, try again later')
+
+        with self.assertRaises(SMTPRecipientsRefused), \
+                self.assertLogs('notifier.throttle', 'WARNING'):
+            Notify(ENV_TEST, self.config).send_email(subject=SBJ_CAT_NEW,
+                                                     from_address='no-reply@sanger.ac.uk',
+                                                     to=['busy@example.com', 'a@sanger.ac.uk'],
+                                                     template='catalogue_new',
+                                                     data={})
+
+        self.assertEqual(throttle.domain_rate('example.com'), 50)
+        self.assertEqual(throttle.domain_rate('sanger.ac.uk'), 100)
+
+
+class EmailCollectorTests(unittest.TestCase):
+
+    def test_keeps_a_copy_of_data(self):
+        collector = EmailCollector()
+        data = {'manifest_id': 1}
+        collector.send_email('subject', 'no-reply@sanger.ac.uk', ['a@sanger.ac.uk'],
+                             'manifest_created', data)
+        data['hmdmc_list'] = 'abc321'
+
+        self.assertEqual(collector.emails[0].data, {'manifest_id': 1})
+
+
+class RenderCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(RenderCache, '_shared', RenderCache(size=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.notify = Notify(ENV_TEST, config)
+
+    def build_email(self, template='catalogue_new', data=None, to=('dev@sanger.ac.uk',)):
+        return self.notify.build_email(subject=SBJ_CAT_NEW,
+                                       from_address='no-reply@sanger.ac.uk',
+                                       to=list(to),
+                                       template=template,
+                                       data=data or {})
+
+    def test_identical_emails_are_rendered_once(self):
+        with patch.object(self.notify._renderer, 'render',
+                          wraps=self.notify._renderer.render) as render:
+            first = self.build_email()
+            second = self.build_email(to=['other@sanger.ac.uk'])
+
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(second.recipients, ['other@sanger.ac.uk'])
+        first, second = (message_from_bytes(envelope.message) for envelope in (first, second))
+        self.assertEqual(second['To'], 'other@sanger.ac.uk')
+        self.assertEqual([part.get_payload() for part in first.get_payload()],
+                         [part.get_payload() for part in second.get_payload()])
+
+    def test_key_depends_on_the_data(self):
+        cache = RenderCache(size=2)
+        key = cache.key('catalogue_rejected', {'error': 'a', 'timestamp': datetime(2018, 3, 23)})
+
+        self.assertEqual(key, cache.key('catalogue_rejected',
+                                        {'timestamp': datetime(2018, 3, 23), 'error': 'a'}))
+        self.assertNotEqual(key, cache.key('catalogue_rejected', {'error': 'b'}))
+        self.assertNotEqual(key, cache.key('catalogue_new',
+                                           {'error': 'a', 'timestamp': datetime(2018, 3, 23)}))
+        self.assertNotEqual(cache.key('digest', {'html': '<b>'}),
+                            cache.key('digest', {'html': Markup('<b>')}))
+        self.assertNotEqual(cache.key('t', {'all_received': True}),
+                            cache.key('t', {'all_received': 1}))
+
+    def test_unhashable_data_is_not_cached(self):
+        cache = RenderCache(size=2)
+        self.assertIsNone(cache.key('t', {'ids': [set()]}))
+
+    def test_least_recently_used_are_dropped(self):
+        cache = RenderCache(size=2)
+        cache.put(cache.key('a', {}), 'a')
+        cache.put(cache.key('b', {}), 'b')
+        cache.get(cache.key('a', {}))
+        cache.put(cache.key('c', {}), 'c')
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(cache.key('a', {})), 'a')
+        self.assertIsNone(cache.get(cache.key('b', {})))
+
+    def test_disabled(self):
+        cache = RenderCache(size=0)
+        self.assertIsNone(cache.key('a', {}))
+        cache.put(None, 'a')
+        self.assertEqual(len(cache), 0)
+
+    def test_configure_disables_the_cache_with_auto_reload(self):
+        cache = RenderCache.configure(config.templates._replace(auto_reload=True))
+        self.assertIsNone(cache.key('a', {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock, patch
+from smtplib import SMTPRecipientsRefused
+from notifier.mime import Envelope
+from notifier.outbox import Outbox, orphaned_paths
+
+
+def build_email(subject, from_address, to, template, data):
+    return Envelope(sender=from_address,
+                    recipients=to,
+                    message='Subject: {}\r\n\r\n{} {}'.format(subject, template, data).encode())
+
+
+class OutboxTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'outbox.sqlite')
+        self.notify = Mock()
+        self.notify.build_email.side_effect = build_email
+
+    def create_outbox(self, **kwargs):
+        # The tests send the emails themselves with flush
+        with patch('threading.Thread.start'):
+            outbox = Outbox(notify=self.notify, path=self.path, **kwargs)
+        outbox._thread = Mock()
+        self.addCleanup(outbox.close)
+        return outbox
+
+    def send_email(self, outbox, subject='Subject'):
+        outbox.send_email(subject=subject,
+                          from_address='no-reply@sanger.ac.uk',
+                          to=['a@sanger.ac.uk', 'b@sanger.ac.uk'],
+                          template='catalogue_new',
+                          data={})
+
+    def test_emails_are_stored(self):
+        outbox = self.create_outbox()
+        self.send_email(outbox)
+
+        self.notify.send.assert_not_called()
+        self.assertEqual(outbox.pending, 1)
+
+    def test_rendering_errors_are_raised(self):
+        outbox = self.create_outbox()
+        self.notify.build_email.side_effect = KeyError('manifest_id')
+
+        with self.assertRaises(KeyError):
+            self.send_email(outbox)
+        self.assertEqual(outbox.pending, 0)
+
+    def test_flush_sends_and_removes_the_emails(self):
+        outbox = self.create_outbox()
+        self.send_email(outbox, 'First')
+        self.send_email(outbox, 'Second')
+
+        self.assertEqual(outbox.flush(), 2)
+
+        sent = [c[0][0] for c in self.notify.send.call_args_list]
+        self.assertEqual(sent[0], Envelope(sender='no-reply@sanger.ac.uk',
+                                           recipients=['a@sanger.ac.uk', 'b@sanger.ac.uk'],
+                                           message=b'Subject: First\r\n\r\ncatalogue_new {}'))
+        self.assertEqual(sent[1].message, b'Subject: Second\r\n\r\ncatalogue_new {}')
+        self.assertEqual(outbox.pending, 0)
+
+    def test_failed_emails_are_retried_later(self):
+        outbox = self.create_outbox(base_delay=60)
+        self.send_email(outbox)
+        self.notify.send.side_effect = ConnectionRefusedError()
+
+        self.assertEqual(outbox.flush(), 0)
+        self.assertEqual(outbox.pending, 1)
+
+        # Not due yet
+        self.notify.send.side_effect = None
+        self.notify.send.reset_mock()
+        self.assertEqual(outbox.flush(), 0)
+        self.notify.send.assert_not_called()
+
+    def test_only_refused_recipients_are_retried(self):
+        outbox = self.create_outbox(base_delay=0)
+        self.send_email(outbox)
+        self.notify.send.side_effect = [
+            SMTPRecipientsRefused({'b@sanger.ac.uk': (451, b'Try again later')}), None]
+
+        self.assertEqual(outbox.flush(), 0)
+        self.assertEqual(outbox.flush(), 1)
+
+        self.assertEqual(self.notify.send.call_args[0][0].recipients, ['b@sanger.ac.uk'])
+
+    def test_emails_are_given_up_on(self):
+        outbox = self.create_outbox(base_delay=0, max_attempts=2)
+        self.send_email(outbox)
+        self.notify.send.side_effect = ConnectionRefusedError()
+
+        outbox.flush()
+        outbox.flush()
+
+        self.assertEqual(self.notify.send.call_count, 2)
+        self.assertEqual(outbox.pending, 0)
+        self.assertEqual(outbox.failed, 1)
+
+    def test_emails_are_sent_after_a_restart(self):
+        outbox = self.create_outbox()
+        self.send_email(outbox)
+        outbox.close()
+
+        outbox = self.create_outbox()
+        self.assertEqual(outbox.flush(), 1)
+
+    def test_adopt(self):
+        orphan = self.create_outbox()
+        self.send_email(orphan, 'Pending')
+        self.send_email(orphan, 'Failed')
+        orphan._db.execute("UPDATE outbox SET next_attempt_at = NULL WHERE message LIKE '%Failed%'")
+        orphan._db.commit()
+        orphan.close()
+        os.rename(self.path, self.path + '.3')
+        outbox = self.create_outbox()
+
+        with self.assertLogs('notifier.outbox', 'INFO'):
+            self.assertEqual(outbox.adopt(self.path + '.3'), 2)
+
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        self.assertEqual((outbox.pending, outbox.failed), (1, 1))
+        self.assertEqual(outbox.flush(), 1)
+
+    def test_orphaned_paths(self):
+        for name in ('outbox.sqlite', 'outbox.sqlite.0', 'outbox.sqlite.1', 'outbox.sqlite.1-wal',
+                     'outbox.sqlite.10', 'outbox.sqlite.2', 'outbox.sqlite.old'):
+            open(os.path.join(self.directory, name), 'w').close()
+
+        def names(workers):
+            return [os.path.basename(path) for path in orphaned_paths(self.path, workers)]
+
+        self.assertEqual(names(1), ['outbox.sqlite.0', 'outbox.sqlite.1', 'outbox.sqlite.2',
+                                    'outbox.sqlite.10'])
+        self.assertEqual(names(2), ['outbox.sqlite', 'outbox.sqlite.2', 'outbox.sqlite.10'])
+        self.assertEqual(names(11), ['outbox.sqlite'])
+
+    def test_backoff(self):
+        outbox = self.create_outbox(base_delay=1, max_delay=8)
+        for attempts, delay in [(1, 1), (2, 2), (3, 4), (4, 8), (10, 8)]:
+            backoff = outbox.backoff(attempts)
+            self.assertGreaterEqual(backoff, delay / 2)
+            self.assertLessEqual(backoff, delay)
+
+    def test_thread_sends_the_emails(self):
+        outbox = Outbox(notify=self.notify, path=self.path, poll_interval=60)
+        self.addCleanup(outbox.close)
+        self.send_email(outbox)
+
+        outbox._stopped.wait(0.01)
+        for _ in range(100):
+            if self.notify.send.called:
+                break
+            outbox._stopped.wait(0.01)
+        self.notify.send.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from mock import Mock, patch
+from notifier.consts import *
+from notifier.registry import OTHER, Registry
+
+
+class RegistryTests(unittest.TestCase):
+
+    def test_exact(self):
+        registry = Registry()
+        handler = Mock()
+        registry.register(EVENT_MAN_CREATED, handler)
+
+        self.assertEqual(registry.handlers(EVENT_MAN_CREATED), (handler,))
+        self.assertEqual(registry.handlers(EVENT_MAN_RECEIVED), ())
+
+    def test_star_matches_one_word(self):
+        registry = Registry()
+        handler = Mock()
+        registry.register('aker.events.work_order.*', handler)
+
+        self.assertEqual(registry.handlers(EVENT_WO_DISPATCHED), (handler,))
+        self.assertEqual(registry.handlers(EVENT_WO_CONCLUDED), (handler,))
+        self.assertEqual(registry.handlers('aker.events.work_order'), ())
+        self.assertEqual(registry.handlers('aker.events.work_order.a.b'), ())
+
+    def test_hash_matches_any_number_of_words(self):
+        registry = Registry()
+        handler = Mock()
+        registry.register('aker.#', handler)
+
+        self.assertEqual(registry.handlers('aker'), (handler,))
+        self.assertEqual(registry.handlers(EVENT_CAT_NEW), (handler,))
+        self.assertEqual(registry.handlers('other.events'), ())
+
+    def test_pattern_is_not_a_regex(self):
+        registry = Registry()
+        registry.register('aker.events.*', Mock())
+
+        self.assertEqual(registry.handlers('akerXevents.manifest'), ())
+
+    def test_label(self):
+        registry = Registry()
+        registry.register('aker.events.work_order.*', Mock())
+        registry.register(EVENT_WO_DISPATCHED, Mock())
+        registry.register('aker.#', Mock())
+
+        self.assertEqual(registry.label(EVENT_WO_DISPATCHED), EVENT_WO_DISPATCHED)
+        self.assertEqual(registry.label(EVENT_WO_CONCLUDED), 'aker.events.work_order.*')
+        self.assertEqual(registry.label(EVENT_CAT_NEW), 'aker.#')
+        self.assertEqual(registry.label('unknown.event'), OTHER)
+        self.assertNotIn('unknown.event', registry._resolved)
+
+    def test_fan_out_in_registration_order(self):
+        registry = Registry()
+        first, second, third = Mock(), Mock(), Mock()
+        registry.register('aker.events.#', first)
+        registry.register(EVENT_CAT_NEW, second)
+        registry.register('aker.events.catalogue.*', third)
+
+        self.assertEqual(registry.handlers(EVENT_CAT_NEW), (first, second, third))
+
+    def test_register_as_decorator(self):
+        registry = Registry()
+
+        @registry.register(EVENT_CAT_NEW)
+        def handler(rule):
+            pass
+
+        self.assertEqual(registry.handlers(EVENT_CAT_NEW), (handler,))
+
+    def test_register_after_lookup(self):
+        registry = Registry()
+        registry.handlers(EVENT_CAT_NEW)
+        handler = Mock()
+        registry.register('aker.events.catalogue.*', handler)
+
+        self.assertEqual(registry.handlers(EVENT_CAT_NEW), (handler,))
+
+    @patch('notifier.registry.importlib.import_module')
+    def test_load_plugins(self, mocked_import):
+        Registry().load_plugins(['plugin.one', 'plugin.two'])
+
+        self.assertEqual([c[0][0] for c in mocked_import.call_args_list],
+                         ['plugin.one', 'plugin.two'])
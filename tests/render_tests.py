@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+from notifier.render import Renderer
+from .helper import config
+
+
+class RendererTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.write_template('hello.txt', 'Hello {{ name }}')
+
+    def write_template(self, name, content):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(content)
+
+    def test_render(self):
+        renderer = Renderer(path=self.path)
+        self.assertEqual(renderer.render('hello.txt', {'name': 'Aker'}), 'Hello Aker')
+
+    def test_compile_all_caches_templates(self):
+        renderer = Renderer(path=self.path)
+        renderer.compile_all()
+        template = renderer.get_template('hello.txt')
+
+        # The compiled template is used even though the file changed
+        self.write_template('hello.txt', 'Bye {{ name }}')
+        self.assertIs(renderer.get_template('hello.txt'), template)
+        self.assertEqual(renderer.render('hello.txt', {'name': 'Aker'}), 'Hello Aker')
+
+    def test_auto_reload(self):
+        renderer = Renderer(auto_reload=True, path=self.path)
+        renderer.compile_all()
+        self.write_template('hello.txt', 'Bye {{ name }}')
+        # Make sure the modification time changes
+        os.utime(os.path.join(self.path, 'hello.txt'), (0, 0))
+
+        self.assertEqual(renderer.render('hello.txt', {'name': 'Aker'}), 'Bye Aker')
+
+    def test_bytecode_cache(self):
+        cache_dir = os.path.join(self.path, 'cache')
+        Renderer(bytecode_cache_dir=cache_dir, path=self.path).compile_all()
+        self.assertTrue(os.listdir(cache_dir))
+
+    def test_configure(self):
+        renderer = Renderer.configure(config.templates)
+        self.assertIs(Renderer.shared(), renderer)
+        self.assertTrue(renderer.get_template('base.html'))
+
+    def test_html_is_autoescaped(self):
+        self.write_template('hello.html', '{{ name }}')
+        renderer = Renderer(path=self.path)
+        self.assertEqual(renderer.render('hello.html', {'name': '<b>'}), '&lt;b&gt;')
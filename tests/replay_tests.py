@@ -0,0 +1,170 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+from mock import Mock, patch
+import run
+from notifier.consts import *
+from notifier.message import Message
+from notifier.replay import EventFilter, ReplayNotify, open_archive, replay
+from tests.helper import config
+
+EVENTS = [
+    b'{"event_type": "%s", "timestamp": "2018-03-23T10:00:00Z", "user_identifier": '
+    b'"user@sanger.ac.uk", "metadata": {}, "notifier_info": {}}' % EVENT_CAT_NEW.encode(),
+    b'{"event_type": "%s", "timestamp": "2018-03-24T10:00:00Z", "user_identifier": '
+    b'"user@sanger.ac.uk", "metadata": {"manifest_id": 1, "sample_custodian": '
+    b'"custodian@sanger.ac.uk"}, "notifier_info": {"work_plan_id": 1, "drs_study_code": 1}}'
+    % EVENT_MAN_CREATED.encode(),
+]
+
+
+class OpenArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.content = b'\n'.join(EVENTS) + b'\n\n'
+
+    def write(self, name, content, opener=open):
+        path = os.path.join(self.directory, name)
+        with opener(path, 'wb') as stream:
+            stream.write(content)
+        return path
+
+    def test_plain(self):
+        with open_archive(self.write('events.ndjson', self.content)) as bodies:
+            self.assertEqual(list(bodies), EVENTS)
+
+    def test_gzip(self):
+        with open_archive(self.write('events.ndjson.gz', self.content, gzip.open)) as bodies:
+            self.assertEqual(list(bodies), EVENTS)
+
+    def test_mmap(self):
+        with open_archive(self.write('events.ndjson', self.content), use_mmap=True) as bodies:
+            self.assertEqual(list(bodies), EVENTS)
+        with open_archive(self.write('empty.ndjson', b''), use_mmap=True) as bodies:
+            self.assertEqual(list(bodies), [])
+
+
+class EventFilterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.catalogue, self.manifest = (Message.from_json(body) for body in EVENTS)
+
+    def test_everything_by_default(self):
+        event_filter = EventFilter()
+
+        self.assertTrue(event_filter.matches(self.catalogue))
+        self.assertEqual(event_filter.recipients(['a@sanger.ac.uk']), ['a@sanger.ac.uk'])
+
+    def test_event_types(self):
+        event_filter = EventFilter(event_types=['aker.events.manifest.*'])
+
+        self.assertFalse(event_filter.matches(self.catalogue))
+        self.assertTrue(event_filter.matches(self.manifest))
+
+    def test_time_range(self):
+        event_filter = EventFilter(since=datetime(2018, 3, 24),
+                                   until=datetime(2018, 3, 25, tzinfo=timezone.utc))
+
+        self.assertFalse(event_filter.matches(self.catalogue))
+        self.assertTrue(event_filter.matches(self.manifest))
+        self.assertFalse(EventFilter(until=datetime(2018, 3, 24, 10)).matches(self.manifest))
+
+    def test_recipients(self):
+        event_filter = EventFilter(recipients=['A@sanger.ac.uk', '@example.com'])
+
+        self.assertEqual(event_filter.recipients(['a@Sanger.ac.uk', 'b@sanger.ac.uk',
+                                                  'c@example.com']),
+                         ['a@Sanger.ac.uk', 'c@example.com'])
+
+
+class ReplayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.notify = Mock()
+
+    def test_replay(self):
+        replay_notify = ReplayNotify(self.notify, EventFilter())
+
+        stats = replay(EVENTS * 3, ENV_TEST, config, replay_notify, EventFilter(), workers=2)
+
+        self.assertEqual(stats, {'events': 6, 'replayed': 6, 'failed': 0})
+        self.assertEqual(replay_notify.emails, self.notify.send_email.call_count)
+        self.assertGreater(replay_notify.emails, 0)
+
+    def test_only_the_selected_recipients(self):
+        event_filter = EventFilter(recipients=['custodian@sanger.ac.uk'])
+        replay_notify = ReplayNotify(self.notify, event_filter)
+
+        replay(EVENTS, ENV_TEST, config, replay_notify, event_filter)
+
+        for call in self.notify.send_email.call_args_list:
+            self.assertEqual(call[0][2], ['custodian@sanger.ac.uk'])
+        self.assertEqual(replay_notify.emails, self.notify.send_email.call_count)
+
+    def test_dry_run(self):
+        replay_notify = ReplayNotify(self.notify, EventFilter(), dry_run=True)
+
+        with self.assertLogs('notifier.replay', 'INFO'):
+            replay(EVENTS, ENV_TEST, config, replay_notify, EventFilter())
+
+        self.notify.send_email.assert_not_called()
+        self.assertEqual(replay_notify.emails, self.notify.build_email.call_count)
+
+    def test_failed_events_are_skipped(self):
+        self.notify.send_email.side_effect = [ValueError('SMTP down')] + [None] * 10
+
+        with self.assertLogs('notifier.replay', 'ERROR') as logs:
+            stats = replay([b'not json'] + EVENTS, ENV_TEST, config, self.notify, EventFilter())
+
+        self.assertEqual(stats, {'events': 3, 'replayed': 1, 'failed': 2})
+        self.assertIn('event 1 of the archive', logs.output[0])
+
+    def test_events_in_flight_are_bounded(self):
+        release = threading.Event()
+        self.notify.send_email.side_effect = lambda **kwargs: release.wait(5)
+
+        def bodies():
+            for number in range(20):
+                # Sending the first events blocks, the workers read ahead by two events each
+                if number > 4:
+                    self.assertTrue(release.is_set())
+                yield EVENTS[1]
+
+        threading.Timer(0.1, release.set).start()
+        stats = replay(bodies(), ENV_TEST, config, self.notify, EventFilter(), workers=2)
+
+        self.assertEqual(stats, {'events': 20, 'replayed': 20, 'failed': 0})
+
+
+class RunReplayTests(unittest.TestCase):
+
+    def test_dry_run(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'events.ndjson.gz')
+        with gzip.open(path, 'wb') as stream:
+            stream.write(b'\n'.join(EVENTS))
+
+        with patch('run.logging.basicConfig'), patch('notifier.notify.SMTPPool') as pool, \
+                self.assertLogs('run', 'INFO') as logs, self.assertLogs('notifier.replay', 'INFO'):
+            status = run.replay([path, '--env', ENV_TEST, '--config', 'config/test.cfg',
+                                 '--dry-run', '--event-type', EVENT_MAN_CREATED,
+                                 '--since', '2018-03-24'])
+
+        self.assertEqual(status, 0)
+        pool.for_config.assert_not_called()
+        self.assertIn('Replayed 1 of 2 events (0 failed)', logs.output[-1])
+
+    def test_unrecognised_environment(self):
+        with self.assertRaises(ValueError):
+            run.replay(['-', '--env', 'nowhere', '--config', 'config/test.cfg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
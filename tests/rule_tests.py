@@ -5,6 +5,7 @@ from collections import namedtuple
 from datetime import datetime
 from notifier.consts import *
 from notifier import Message, Notify, Rule
+from notifier.registry import Registry
 from .helper import config
 
 
@@ -47,6 +48,13 @@ class RulesTests(unittest.TestCase):
         self.assertEqual(rule._message, self._fake_message)
         self.assertIsInstance(rule._notify, Notify)
 
+    @patch('notifier.rule.EVENTS')
+    def test_unknown_event_types_are_counted_as_other(self, mocked_events):
+        message = self.create_fake_generic_catalogue_message('aker.events.unknown')
+        Rule(env='test', config='test', message=message).check_rules()
+
+        mocked_events.labels.assert_called_once_with('other')
+
     def test_manifest_create_triggered(self):
         message = self.create_fake_generic_manifest_message(EVENT_MAN_CREATED)
         rule = Rule(env='test', config='test', message=message)
@@ -189,6 +197,28 @@ class RulesTests(unittest.TestCase):
         rule._on_catalogue_processed.assert_not_called()
         rule._on_catalogue_rejected.assert_called_once()
 
+    def test_registered_handlers_triggered(self):
+        handler = Mock()
+        # A registry of its own, the handler is gone once the test is over
+        registry = Registry()
+        registry.register('aker.events.test_plugin.*', handler)
+        message = self.create_fake_generic_catalogue_message('aker.events.test_plugin.event')
+        rule = Rule(env='test', config='test', message=message)
+
+        with patch('notifier.rule.registry', registry):
+            rule.check_rules()
+
+        handler.assert_called_once_with(rule)
+
+    def test_unknown_event_type(self):
+        message = self.create_fake_generic_catalogue_message('aker.events.unknown')
+        rule = Rule(env='test', config='test', message=message)
+        rule._notify = Mock()
+
+        rule.check_rules()
+
+        rule._notify.send_email.assert_not_called()
+
     def test_common_work_order_with_id(self):
         message = self.FakeMessage(
             event_type=EVENT_WO_DISPATCHED,
@@ -237,6 +267,21 @@ class RulesTests(unittest.TestCase):
                               'dep1@sanger.ac.uk', 'dep2@sanger.ac.uk']),
         self.assertEqual(data, {'manifest_id': message.metadata['manifest_id'], 'link': ''})
 
+    def test_common_manifest_removes_duplicates(self):
+        message = self.FakeMessage(
+            event_type=EVENT_MAN_RECEIVED,
+            timestamp=datetime.now().isoformat(),
+            user_identifier='test@sanger.ac.uk',
+            metadata={'sample_custodian': 'Test@sanger.ac.uk',
+                      'manifest_id': 1234,
+                      'deputies': ['dep1@sanger.ac.uk', 'DEP1@sanger.ac.uk']},
+            notifier_info={'work_plan_id': 1, 'drs_study_code': 1234})
+        rule = Rule(env='test', config=config, message=message)
+
+        to, data = rule._common_manifest()
+
+        self.assertEqual(to, ['test@sanger.ac.uk', 'dep1@sanger.ac.uk'])
+
     @patch('notifier.rule.Notify', autospec=True)
     def test_on_manifest_create(self, mocked_notify):
         message = self.create_fake_generic_manifest_message(EVENT_MAN_CREATED)
@@ -271,7 +316,7 @@ class RulesTests(unittest.TestCase):
         self.assertIsInstance(mocked_notify, Notify)
         self.assertEqual(mocked_notify.return_value.send_email.call_count, 2)
 
-        exp1 = call(data={'hmdmc_list': 'abc321', 'manifest_id': 123, 'link': 'http://aker.localhost:80/reception/material_submissions/123', 'user_identifier': 'test@sanger.ac.uk'},
+        exp1 = call(data={'manifest_id': 123, 'link': 'http://aker.localhost:80/reception/material_submissions/123', 'user_identifier': 'test@sanger.ac.uk'},
             from_address=u'no-reply@sanger.ac.uk',
             subject='Aker | Manifest Created 123',
             template='manifest_created',
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from mock import patch, AsyncMock, Mock
+from notifier.channels import ChannelPool, Channels
+from notifier.consts import *
+from run_async import AsyncConsumer
+from .helper import config
+
+BODY = ('{"event_type": "%s", "timestamp": "2018-03-23T10:00:00Z", '
+        '"user_identifier": "user@sanger.ac.uk", "metadata": {}, "notifier_info": {}}'
+        % EVENT_CAT_NEW).encode()
+
+
+@patch('run_async.AsyncNotify')
+class AsyncConsumerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        self.log = Mock()
+        self.log.name = 'log'
+        pool = ChannelPool(self.log, base_delay=0)
+        self.channels = Channels([pool], [(EVENT_CAT_NEW, ['email', 'log'])])
+        self.addCleanup(self.channels.stop)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def create_consumer(self, mocked_notify, alerts_config=None):
+        mocked_notify.return_value.send_emails = AsyncMock()
+        mocked_notify.return_value.send_email = AsyncMock()
+        mocked_notify.return_value.close = AsyncMock()
+        consumer = AsyncConsumer(ENV_TEST, config.replace(alerts=alerts_config or config.alerts),
+                                 channels=self.channels)
+        self.addCleanup(lambda: self.run_async(consumer.close()))
+        return consumer
+
+    def test_process_message_waits_for_the_channels(self, mocked_notify):
+        consumer = self.create_consumer(mocked_notify)
+
+        self.run_async(consumer.process_message(BODY))
+
+        self.log.send.assert_called_once()
+        emails = mocked_notify.return_value.send_emails.call_args[0][0]
+        self.assertEqual(len(emails), 1)
+
+    def test_process_message_raises_when_a_channel_fails(self, mocked_notify):
+        self.log.send.side_effect = OSError()
+        consumer = self.create_consumer(mocked_notify)
+
+        with self.assertLogs('notifier.channels', 'ERROR'), self.assertRaises(OSError):
+            self.run_async(consumer.process_message(BODY))
+
+    def test_redelivered_events_are_not_sent_again(self, mocked_notify):
+        consumer = self.create_consumer(mocked_notify)
+        send_emails = mocked_notify.return_value.send_emails
+
+        async def send(emails, on_sent):
+            for callback in on_sent:
+                callback()
+        send_emails.side_effect = send
+        body = BODY.replace(b'"metadata"', b'"uuid": "1", "metadata"')
+
+        for _ in range(2):
+            self.run_async(consumer.process_message(body))
+
+        self.log.send.assert_called_once()
+        self.assertEqual([len(call[0][0]) for call in send_emails.call_args_list], [1, 0])
+
+    def test_failures_are_sent_through_alerts(self, mocked_notify):
+        consumer = self.create_consumer(mocked_notify, config.alerts._replace(threshold=2))
+        send_email = mocked_notify.return_value.send_email
+
+        with self.assertLogs('notifier.alerts', 'ERROR'):
+            for _ in range(3):
+                self.run_async(consumer.alert_devs(SBJ_MSG_FAILED, BODY, 'KeyError: uuid'))
+
+        # The circuit opens at the second failure, the rest go into the summary
+        send_email.assert_called_once()
+        self.assertEqual(send_email.call_args[0][3], 'notification_dev')
+        self.assertEqual(consumer._alerts.suppressed, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+import queue
+import threading
+import unittest
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from mock import Mock, patch
+import pika
+import run
+from notifier.consts import *
+from notifier.lanes import DEFAULT, LaneQueue, Lanes
+from tests.helper import config
+
+
+class CallInThreadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown)
+        self.connection = Mock()
+
+    def test_connection_events_are_processed_while_waiting(self):
+        release = threading.Event()
+        # The SMTP server answers once the connection has processed its events a few times
+        self.connection.process_data_events.side_effect = \
+            lambda time_limit: self.connection.process_data_events.call_count >= 3 and release.set()
+
+        def send():
+            release.wait(5)
+            return threading.current_thread()
+
+        thread = run.call_in_thread(self.executor, self.connection, 0.001, send)
+
+        self.assertIsNot(thread, threading.current_thread())
+        self.connection.process_data_events.assert_called_with(time_limit=0)
+        self.assertGreaterEqual(self.connection.process_data_events.call_count, 3)
+
+    def test_exceptions_are_raised(self):
+        with self.assertRaises(ValueError):
+            run.call_in_thread(self.executor, self.connection, 0.001, int, 'not a number')
+
+
+class OnMessageTests(unittest.TestCase):
+
+    def test_processed_through_offload(self):
+        channel = Mock()
+        offload = Mock()
+
+        run.on_message(channel, Mock(delivery_tag=1), None, b'{}', ENV_TEST, config,
+                       offload=offload)
+
+        self.assertIs(offload.call_args[0][0], run.process_message)
+        channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+    def test_failures_are_offloaded(self):
+        channel = Mock()
+        alerts = Mock()
+        offload = Mock(side_effect=[ValueError(), None])
+
+        with self.assertLogs('run', 'ERROR'), patch('run.traceback.print_exc'):
+            run.on_message(channel, Mock(delivery_tag=1), None, b'{}', ENV_TEST, config,
+                           alerts=alerts, offload=offload)
+
+        channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+        self.assertEqual(offload.call_args[0][:2], (alerts.failure, SBJ_MSG_FAILED))
+
+    def test_connection_errors_are_raised(self):
+        channel = Mock()
+        alerts = Mock()
+        offload = Mock(side_effect=pika.exceptions.AMQPConnectionError())
+
+        with self.assertRaises(pika.exceptions.AMQPConnectionError):
+            run.on_message(channel, Mock(delivery_tag=1), None, b'{}', ENV_TEST, config,
+                           alerts=alerts, offload=offload)
+
+        channel.basic_nack.assert_not_called()
+        alerts.failure.assert_not_called()
+        offload.assert_called_once()
+
+
+class LanesTests(unittest.TestCase):
+
+    def test_urgent_messages_are_handled_first(self):
+        lanes = Lanes({'priority': 5}, [(EVENT_MAN_CREATED, 'priority')])
+        pending = LaneQueue(lanes.weights)
+        handled = []
+        handles = {lane: partial(self.handle, handled, lane) for lane in lanes.weights}
+        for delivery_tag in range(1, 4):
+            run.on_message_lane(None, Mock(delivery_tag=delivery_tag, routing_key=EVENT_CAT_NEW),
+                                None, b'{}', lanes, pending, handles)
+        run.on_message_lane(None, Mock(delivery_tag=4, routing_key=EVENT_MAN_CREATED), None,
+                            b'{}', lanes, pending, handles)
+        # Consumed from the queue of the lane, whatever the event
+        run.on_message_lane(None, Mock(delivery_tag=5, routing_key=EVENT_CAT_NEW), None, b'{}',
+                            lanes, pending, handles, lane='priority')
+
+        connection = Mock()
+        channel = Mock(consumer_tags=['aker-events-notifier'])
+        # Stops once all the messages are handled
+        connection.process_data_events.side_effect = \
+            lambda time_limit: len(handled) == 5 and self.stop()
+        with self.assertRaises(KeyboardInterrupt):
+            run.consume_lanes(connection, channel, pending, 0.1)
+
+        self.assertEqual(handled, [('priority', 4), ('priority', 5), (DEFAULT, 1), (DEFAULT, 2),
+                                   (DEFAULT, 3)])
+        # Does not wait for broker events while messages are pending
+        for call in connection.process_data_events.call_args_list[:-1]:
+            self.assertEqual(call[1], {'time_limit': 0})
+
+    def handle(self, handled, lane, channel, method_frame, header_frame, body):
+        handled.append((lane, method_frame.delivery_tag))
+
+    def stop(self):
+        raise KeyboardInterrupt()
+
+
+class CancelledConsumerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.channel = Mock(consumer_tags=['aker-events-notifier'])
+        self.connection = Mock()
+        # The broker cancels the consumer, e.g. the queue was deleted
+        self.connection.process_data_events.side_effect = \
+            lambda time_limit: self.channel.consumer_tags.clear()
+
+    def test_consume_lanes_returns(self):
+        run.consume_lanes(self.connection, self.channel, LaneQueue({}), 0.1)
+
+        self.connection.process_data_events.assert_called_once_with(time_limit=0.1)
+
+    def test_consume_dispatched_returns(self):
+        dispatcher = Mock()
+        dispatcher.completed.return_value = []
+
+        run.consume_dispatched(self.connection, self.channel, dispatcher, config)
+
+        self.connection.process_data_events.assert_called_once()
+
+
+class DispatchTests(unittest.TestCase):
+
+    def test_check_dispatch(self):
+        lanes = Lanes({'urgent': 5}, [], [('urgent', 'urgent_q')])
+        dispatch_config = config.replace(
+            dispatch=config.dispatch._replace(workers=2, queue_size=100),
+            broker=config.broker._replace(prefetch_count=50))
+
+        run.check_dispatch(dispatch_config, None)
+        run.check_dispatch(dispatch_config, lanes)
+        with self.assertRaises(ValueError):
+            run.check_dispatch(dispatch_config.replace(
+                broker=config.broker._replace(prefetch_count=60)), lanes)
+        with self.assertRaises(ValueError):
+            # No limit on the deliveries sent at once
+            run.check_dispatch(dispatch_config.replace(
+                broker=config.broker._replace(prefetch_count=0)), None)
+        run.check_dispatch(config.replace(broker=config.broker._replace(prefetch_count=0)),
+                           None)
+
+    def test_check_dispatch_rejects_batches(self):
+        dispatch_config = config.replace(dispatch=config.dispatch._replace(workers=2),
+                                         broker=config.broker._replace(batch_size=10))
+
+        with self.assertRaises(ValueError):
+            run.check_dispatch(dispatch_config, None)
+        run.check_dispatch(dispatch_config.replace(dispatch=config.dispatch._replace(workers=0)),
+                           None)
+
+    def test_alerts_do_not_block_on_a_full_queue(self):
+        dispatcher = Mock()
+        dispatcher.submit.side_effect = queue.Full()
+
+        with self.assertLogs('run', 'ERROR'):
+            run.send_dispatched(dispatcher, run.dev_email('subject', b'body', 'trace', config))
+
+        self.assertFalse(dispatcher.submit.call_args[1]['block'])
+
+
+class ListenTests(unittest.TestCase):
+
+    @patch('run.metrics.IN_FLIGHT')
+    @patch('notifier.dispatch.Dispatcher')
+    def test_queued_emails_are_dropped_when_the_connection_is_lost(self, mocked_dispatcher,
+                                                                  mocked_in_flight):
+        dispatcher = mocked_dispatcher.return_value
+        dispatcher.stop.return_value = 2
+        dispatcher.completed.side_effect = [[], [(1, b'body', None)]]
+        connection = Mock(is_open=False)
+        connection.channel.return_value.consumer_tags = ['aker-events-notifier']
+        connection.process_data_events.side_effect = [None, pika.exceptions.AMQPConnectionError()]
+        dispatch_config = config.replace(dispatch=config.dispatch._replace(workers=1))
+
+        with self.assertRaises(pika.exceptions.AMQPConnectionError):
+            run.listen(connection, ENV_TEST, dispatch_config, Mock(), None, Mock(), None, None,
+                       'aker-events-notifier', Mock())
+
+        dispatcher.stop.assert_called_once_with(wait=False)
+        mocked_in_flight.dec.assert_called_once_with(3)
+
+
+class ConsumeTests(unittest.TestCase):
+
+    @patch('run.time.sleep')
+    @patch('pika.ConnectionParameters')
+    @patch('pika.BlockingConnection')
+    def test_reconnect(self, mocked_connection, mocked_parameters, mocked_sleep):
+        connection = Mock()
+        connection.channel.return_value.start_consuming.side_effect = [
+            pika.exceptions.AMQPConnectionError(), KeyboardInterrupt()]
+        mocked_connection.side_effect = [pika.exceptions.AMQPConnectionError(), connection,
+                                         connection]
+
+        with self.assertRaises(KeyboardInterrupt), self.assertLogs('run', 'ERROR'):
+            run.consume(ENV_TEST, config)
+
+        self.assertEqual(mocked_connection.call_count, 3)
+        self.assertEqual(mocked_sleep.call_count, 2)
+        # The backoff restarts once connected
+        first, second = (call[0][0] for call in mocked_sleep.call_args_list)
+        self.assertLessEqual(first, config.broker.reconnect_base_delay_seconds)
+        self.assertLessEqual(second, config.broker.reconnect_base_delay_seconds)
+        parameters = mocked_parameters.call_args[1]
+        self.assertEqual(parameters['heartbeat'], config.broker.heartbeat_seconds)
+        self.assertEqual(parameters['socket_timeout'], config.broker.socket_timeout_seconds)
+        self.assertEqual(parameters['blocked_connection_timeout'],
+                         config.broker.blocked_connection_timeout_seconds)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from smtplib import SMTP, SMTPRecipientsRefused
+from notifier.sink import SMTPSink
+
+
+class SMTPSinkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = SMTPSink(keep=True)
+        self.addCleanup(self.sink.close)
+
+    def test_emails_are_received(self):
+        with SMTP(host=self.sink.host, port=self.sink.port) as smtp:
+            smtp.sendmail('from@sanger.ac.uk', ['a@sanger.ac.uk', 'b@sanger.ac.uk'],
+                          b'Subject: test\r\n\r\n.leading dot\r\nbody\r\n')
+            smtp.noop()
+
+        self.assertEqual(self.sink.received, 1)
+        sender, recipients, data = self.sink.emails[0]
+        self.assertEqual(sender, 'from@sanger.ac.uk')
+        self.assertEqual(recipients, ['a@sanger.ac.uk', 'b@sanger.ac.uk'])
+        self.assertEqual(data, b'Subject: test\r\n\r\n.leading dot\r\nbody\r\n')
+
+    def test_refused_recipients(self):
+        self.sink.refused['bad@sanger.ac.uk'] = (550, 'No such user')
+        with SMTP(host=self.sink.host, port=self.sink.port) as smtp:
+            refused = smtp.sendmail('from@sanger.ac.uk', ['a@sanger.ac.uk', 'bad@sanger.ac.uk'],
+                                    b'Subject: test\r\n\r\nbody\r\n')
+            with self.assertRaises(SMTPRecipientsRefused):
+                smtp.sendmail('from@sanger.ac.uk', ['bad@sanger.ac.uk'], b'\r\n')
+
+        self.assertEqual(refused, {'bad@sanger.ac.uk': (550, b'No such user')})
+        self.assertEqual(self.sink.emails[0][1], ['a@sanger.ac.uk'])
@@ -0,0 +1,100 @@
+import time
+import unittest
+from mock import patch, Mock
+from smtplib import SMTPServerDisconnected
+from notifier.smtp_pool import SMTPPool
+from .helper import config
+
+
+class SMTPPoolTests(unittest.TestCase):
+
+    def create_pool(self, **kwargs):
+        self.smtp_class = Mock()
+        self.smtp_class.return_value.noop.return_value = (250, b'OK')
+        return SMTPPool(host='localhost', port=25, smtp_class=self.smtp_class, **kwargs)
+
+    def test_connection_is_reused(self):
+        pool = self.create_pool()
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.smtp_class.assert_called_once_with(host='localhost', port=25)
+        first.noop.assert_called_once()
+
+    def test_login_when_username(self):
+        pool = self.create_pool(username='user', password='pass')
+        with pool.connection() as smtp:
+            smtp.login.assert_called_once_with(user='user', password='pass')
+
+    def test_no_login_without_username(self):
+        pool = self.create_pool()
+        with pool.connection() as smtp:
+            smtp.login.assert_not_called()
+
+    def test_stale_connection_is_replaced(self):
+        pool = self.create_pool()
+        stale, fresh = Mock(), Mock()
+        stale.noop.side_effect = SMTPServerDisconnected()
+        self.smtp_class.side_effect = [stale, fresh]
+
+        with pool.connection():
+            pass
+        with pool.connection() as smtp:
+            self.assertIs(smtp, fresh)
+
+        stale.close.assert_called_once()
+
+    def test_connection_discarded_on_error(self):
+        pool = self.create_pool()
+        with self.assertRaises(SMTPServerDisconnected):
+            with pool.connection() as smtp:
+                raise SMTPServerDisconnected()
+
+        smtp.close.assert_called_once()
+        self.assertEqual(pool.idle, 0)
+        self.assertEqual(pool.in_use, 0)
+
+    def test_idle_connections_are_closed(self):
+        pool = self.create_pool(idle_timeout=10)
+        with patch('notifier.smtp_pool.time.monotonic', return_value=100):
+            with pool.connection() as smtp:
+                pass
+        self.assertEqual(pool.idle, 1)
+
+        with patch('notifier.smtp_pool.time.monotonic', return_value=111):
+            pool.prune()
+
+        smtp.quit.assert_called_once()
+        self.assertEqual(pool.idle, 0)
+
+    def test_idle_connections_are_closed_while_unused(self):
+        pool = self.create_pool(idle_timeout=0.05)
+        with pool.connection() as smtp:
+            pass
+
+        for _ in range(100):
+            if smtp.quit.called:
+                break
+            time.sleep(0.05)
+        smtp.quit.assert_called_once()
+        self.assertEqual(pool.idle, 0)
+
+    def test_close(self):
+        pool = self.create_pool()
+        with pool.connection() as smtp:
+            pass
+        pool.close()
+
+        smtp.quit.assert_called_once()
+        self.assertEqual(pool.idle, 0)
+
+    def test_for_config_is_shared(self):
+        SMTPPool.close_all()
+        pool = SMTPPool.for_config(config.email)
+
+        self.assertIs(pool, SMTPPool.for_config(config.email))
+        self.assertEqual(pool.size, config.email.smtp_pool_size)
+        SMTPPool.close_all()
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from mock import Mock
+from notifier.startup import StartupTimer, load_cached
+
+# Seconds from importing run.py to being ready to connect to the broker, measured at ~0.15s
+STARTUP_BUDGET = 1.0
+
+# Run in a new interpreter, so that nothing has been imported already
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import run
+imported = sorted(set(sys.modules) & {'daemon', 'jinja2.sandbox', 'multiprocessing', 'pika',
+                                      'urllib.request', 'http.server', 'yaml', 'dateutil'})
+config = run.Config('config/test.cfg')
+run.Renderer.configure(config.templates)
+run.RenderCache.configure(config.templates)
+run.rule_registry.load_plugins(config.rules.plugins)
+import pika
+print(json.dumps({'seconds': time.perf_counter() - start, 'imported': imported}))
+'''
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 10.0
+
+    def __call__(self):
+        return self.now
+
+
+class StartupTimerTests(unittest.TestCase):
+
+    def test_summary(self):
+        clock = FakeClock()
+        timer = StartupTimer(clock=clock)
+        clock.now += 0.0125
+        timer.mark('config')
+        clock.now += 0.1
+        timer.mark('connect')
+
+        self.assertEqual(list(timer.phases), ['config', 'connect'])
+        self.assertAlmostEqual(timer.elapsed, 0.1125)
+        self.assertEqual(timer.summary(), 'Started in 112.5 ms (config 12.5 ms, connect 100.0 ms)')
+
+
+class LoadCachedTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'logging.yml')
+        self.cache_path = os.path.join(self.directory, 'startup_cache.json')
+        with open(self.path, 'w') as stream:
+            stream.write('version: 1')
+        self.load = Mock(return_value={'version': 1})
+
+    def test_cached(self):
+        self.assertEqual(load_cached(self.path, self.load, self.cache_path), {'version': 1})
+        self.assertEqual(load_cached(self.path, self.load, self.cache_path), {'version': 1})
+
+        self.load.assert_called_once()
+
+    def test_without_cache(self):
+        load_cached(self.path, self.load)
+        load_cached(self.path, self.load)
+
+        self.assertEqual(self.load.call_count, 2)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_changed_file_is_loaded_again(self):
+        load_cached(self.path, self.load, self.cache_path)
+        with open(self.path, 'w') as stream:
+            stream.write('version: 1\ndisable_existing_loggers: true')
+
+        load_cached(self.path, self.load, self.cache_path)
+
+        self.assertEqual(self.load.call_count, 2)
+
+    def test_invalid_cache_is_ignored(self):
+        with open(self.cache_path, 'w') as stream:
+            stream.write('{"key": ')
+
+        with self.assertLogs('notifier.startup', 'WARNING'):
+            self.assertEqual(load_cached(self.path, self.load, self.cache_path), {'version': 1})
+        with open(self.cache_path) as stream:
+            self.assertEqual(json.load(stream)['value'], {'version': 1})
+
+    def test_unwritable_cache_is_ignored(self):
+        cache_path = os.path.join(self.directory, 'missing', 'startup_cache.json')
+
+        with self.assertLogs('notifier.startup', 'WARNING'):
+            self.assertEqual(load_cached(self.path, self.load, cache_path), {'version': 1})
+
+
+class StartupBudgetTests(unittest.TestCase):
+
+    def test_startup_budget(self):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT],
+                                         cwd=os.path.dirname(os.path.dirname(
+                                             os.path.realpath(__file__))))
+        result = json.loads(output.decode('utf-8').splitlines()[-1])
+
+        # Only imported when used, e.g. not by the load test
+        self.assertEqual(result['imported'], [])
+        self.assertLess(result['seconds'], STARTUP_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
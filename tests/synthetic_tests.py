@@ -0,0 +1,35 @@
+import unittest
+from notifier import EmailCollector, Message, Rule
+from notifier import synthetic
+from .helper import config
+
+
+class SyntheticTests(unittest.TestCase):
+
+    def test_parse_mix(self):
+        self.assertEqual(synthetic.parse_mix('manifest_received=3,catalogue_new'),
+                         {'manifest_received': 3.0, 'catalogue_new': 1.0})
+
+    def test_parse_mix_default(self):
+        self.assertEqual(set(synthetic.parse_mix('')), set(synthetic.KINDS))
+
+    def test_parse_mix_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            synthetic.parse_mix('unknown=1')
+
+    def test_events_are_deterministic(self):
+        weights = synthetic.parse_mix('')
+        first = [kind for kind, _ in synthetic.events(weights, 20, seed=1)]
+        second = [kind for kind, _ in synthetic.events(weights, 20, seed=1)]
+        self.assertEqual(first, second)
+
+    def test_every_kind_sends_emails(self):
+        for kind in synthetic.KINDS:
+            message = Message.from_json(synthetic.event(kind, 1))
+            collector = EmailCollector()
+            Rule(env='test', config=config, message=message, notify=collector).check_rules()
+            self.assertTrue(collector.emails, kind)
+        hmdmc = Message.from_json(synthetic.event('manifest_created_hmdmc', 1))
+        collector = EmailCollector()
+        Rule(env='test', config=config, message=hmdmc, notify=collector).check_rules()
+        self.assertEqual(len(collector.emails), 2)
@@ -0,0 +1,126 @@
+import unittest
+from smtplib import SMTPSenderRefused
+from notifier.throttle import Throttle, TokenBucket
+from tests.helper import config
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(rate=10, burst=5, clock=self.clock)
+
+    def test_burst_then_rate(self):
+        self.assertEqual([self.bucket.reserve() for _ in range(5)], [0] * 5)
+        self.assertAlmostEqual(self.bucket.reserve(), 0.1)
+        # Queued behind the previous reservation
+        self.assertAlmostEqual(self.bucket.reserve(), 0.2)
+
+        self.clock.now += 1
+        self.assertEqual(self.bucket.reserve(), 0)
+
+    def test_more_than_a_burst(self):
+        self.assertEqual(self.bucket.reserve(8), 0)
+        # The next caller pays for it
+        self.assertAlmostEqual(self.bucket.reserve(), 0.4)
+
+    def test_slow_down(self):
+        self.assertTrue(self.bucket.slow_down())
+        self.assertEqual(self.bucket.rate, 5)
+        # No burst once slowed down
+        self.assertAlmostEqual(self.bucket.reserve(), 0.2)
+
+    def test_slow_down_once_per_cooldown(self):
+        self.assertTrue(self.bucket.slow_down())
+        self.assertFalse(self.bucket.slow_down())
+        self.assertEqual(self.bucket.rate, 5)
+
+        self.clock.now += 1
+        self.assertTrue(self.bucket.slow_down())
+        self.assertEqual(self.bucket.rate, 2.5)
+
+    def test_min_rate(self):
+        for _ in range(10):
+            self.clock.now += 1
+            self.bucket.slow_down()
+
+        self.assertAlmostEqual(self.bucket.rate, 0.5)
+
+    def test_speed_up(self):
+        self.bucket.slow_down()
+        for _ in range(5):
+            self.bucket.speed_up()
+        self.assertAlmostEqual(self.bucket.rate, 7.5)
+
+        for _ in range(10):
+            self.bucket.speed_up()
+        self.assertEqual(self.bucket.rate, 10)
+
+
+class ThrottleTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        throttle_config = config.throttle._replace(relay_rate=10, relay_burst=2, domain_rate=0,
+                                                   domains={'sanger.ac.uk': (4, 4)})
+        self.throttle = Throttle(throttle_config, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_relay_counts_transactions(self):
+        self.throttle.acquire([['a@example.com'] * 50, ['b@example.com']])
+        self.throttle.acquire([['c@example.com']])
+
+        self.assertAlmostEqual(self.clock.now, 0.1)
+
+    def test_domains_count_recipients(self):
+        self.assertEqual(self.throttle.reserve([['a@Sanger.ac.uk', 'b@sanger.ac.uk']]), 0)
+        self.assertAlmostEqual(self.throttle.reserve([['c@sanger.ac.uk'] * 3]), 0.25)
+        self.assertIsNone(self.throttle.domain_rate('example.com'))
+
+    def test_temporary_failure_slows_down_the_domain(self):
+        with self.assertLogs('notifier.throttle', 'WARNING'):
+            self.throttle.sent(['a@sanger.ac.uk', 'b@example.com'],
+                               {'a@sanger.ac.uk': (451, b'Try again later')})
+
+        self.assertEqual(self.throttle.domain_rate('sanger.ac.uk'), 2)
+        self.assertEqual(self.throttle.relay_rate, 10)
+
+    def test_service_unavailable_slows_down_the_relay(self):
+        with self.assertLogs('notifier.throttle', 'WARNING'):
+            self.throttle.sent(['a@sanger.ac.uk'],
+                               {'a@sanger.ac.uk': (421, b'Too many messages')})
+        self.assertEqual(self.throttle.relay_rate, 5)
+
+        self.clock.now += 1
+        with self.assertLogs('notifier.throttle', 'WARNING'):
+            self.throttle.failed(SMTPSenderRefused(421, b'Too many messages', 'a@sanger.ac.uk'))
+        self.assertEqual(self.throttle.relay_rate, 2.5)
+
+    def test_accepted_emails_speed_up(self):
+        with self.assertLogs('notifier.throttle', 'WARNING'):
+            self.throttle.failed(SMTPSenderRefused(451, b'Try again later', 'a@sanger.ac.uk'))
+        self.throttle.sent(['a@sanger.ac.uk'], {})
+
+        self.assertEqual(self.throttle.relay_rate, 5.5)
+
+    def test_permanent_failures_are_ignored(self):
+        self.throttle.sent(['a@sanger.ac.uk'], {'a@sanger.ac.uk': (550, b'No such user')})
+        self.throttle.failed(SMTPSenderRefused(550, b'No such user', 'a@sanger.ac.uk'))
+
+        self.assertEqual(self.throttle.relay_rate, 10)
+        self.assertEqual(self.throttle.domain_rate('sanger.ac.uk'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()